@@ -29,8 +29,10 @@
 
 """ Configuration module for Cnchi """
 
+import copy
 import multiprocessing
 import os
+import pickle
 import strictyaml as yaml
 from strictyaml.validators import CommentedMap
 
@@ -71,10 +73,15 @@ settings = {
     'country_code': '',
     'country_name': '',
     'data': '/usr/share/cnchi/data/',
+    'deferred_jobs': 'async',
     'desktop': 'gnome',
     'desktop_ask': True,
     'desktop_manager': 'lightdm',
     'desktops': [],
+    'download_connections_per_mirror': 2,
+    'download_staging': True,
+    'download_staging_dir': '/var/cache/cnchi/pkg',
+    'download_threads': 4,
     'enable_alongside': True,
     'encrypt_home': False,
     'f2fs': False,
@@ -94,6 +101,7 @@ settings = {
     'feature_visual': False,
     'fullname': '',
     'hostname': 'antergos',
+    'install_streaming': False,
     'is_iso': False,
     'is_vbox': False,
     'keyboard_layout': '',
@@ -107,11 +115,18 @@ settings = {
     'luks_root_device': '',
     'luks_root_password': '',
     'luks_root_volume': '',
+    'mkinitcpio_fallback': 'build',
     'network_manager': 'NetworkManager',
     'partition_mode': 'automatic',
     'password': '',
+    'progress_events_rate': 10,
+    'rankmirrors_cache_dir': '',
+    'rankmirrors_cache_ttl': 21600,
+    'rankmirrors_concurrency': 16,
     'rankmirrors_done': False,
     'rankmirrors_result': '',
+    'rankmirrors_stats': {},
+    'rankmirrors_time_budget': 20,
     'require_password': True,
     'ruuid': '',
     'sentry_dsn': '',
@@ -142,16 +157,37 @@ settings = {
     'zfs_pool_name': 'antergos'}
 
 
+# Size of the shared memory buffer that holds the pickled settings
+SETTINGS_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Values of these types are returned as they are (no need to copy them)
+IMMUTABLE_TYPES = (type(None), bool, int, float, str, bytes, tuple, frozenset)
+
+
 class Settings(object):
-    """ Store all Cnchi setup options here """
+    """ Store all Cnchi setup options here
 
-    def __init__(self):
+        Settings are shared between the GUI and the installation processes
+        through a pickled snapshot stored in shared memory. The snapshot has a
+        version number that is increased each time a setting changes, so each
+        process can keep its own unpickled copy and only read the shared
+        buffer again when the version has changed. Reading a setting that has
+        not changed takes no locks and does not cross any process boundary. """
+
+    def __init__(self, buffer_size=SETTINGS_BUFFER_SIZE):
         """ Initialize default configuration """
 
-        # Creates a one element size queue
-        self.settings = multiprocessing.Queue(1)
+        self.lock = multiprocessing.Lock()
+        # Notifies waiting processes that a setting has changed
+        self.changed = multiprocessing.Condition(self.lock)
+        self.version = multiprocessing.Value('L', 0, lock=False)
+        self.size = multiprocessing.Value('L', 0, lock=False)
+        self.buffer = multiprocessing.RawArray('c', buffer_size)
+
+        # Local (per process) copy of the settings: (version, settings dict)
+        self.cache = (-1, {})
 
-        self.settings.put({
+        self._store({
             'alternate_package_list': '',
             'auto_device': '/dev/sda',
             'bootloader': 'grub2',
@@ -164,10 +200,15 @@ class Settings(object):
             'country_name': '',
             'country_code': '',
             'data': '/usr/share/cnchi/data/',
+            'deferred_jobs': 'async',
             'desktop': 'gnome',
             'desktop_ask': True,
             'desktop_manager': 'lightdm',
             'desktops': [],
+            'download_connections_per_mirror': 2,
+            'download_staging': True,
+            'download_staging_dir': '/var/cache/cnchi/pkg',
+            'download_threads': 4,
             'enable_alongside': True,
             'encrypt_home': False,
             'f2fs': False,
@@ -188,6 +229,7 @@ class Settings(object):
             'fullname': '',
             'GRUB_CMDLINE_LINUX': '',
             'hostname': 'antergos',
+            'install_streaming': False,
             'is_vbox': False,
             'is_iso': False,
             'keyboard_layout': '',
@@ -201,11 +243,18 @@ class Settings(object):
             'luks_root_password': '',
             'luks_root_volume': '',
             'luks_root_device': '',
+            'mkinitcpio_fallback': 'build',
             'network_manager': 'NetworkManager',
             'partition_mode': 'automatic',
             'password': '',
+            'progress_events_rate': 10,
+            'rankmirrors_cache_dir': '',
+            'rankmirrors_cache_ttl': 21600,
+            'rankmirrors_concurrency': 16,
             'rankmirrors_done': False,
             'rankmirrors_result': '',
+            'rankmirrors_stats': {},
+            'rankmirrors_time_budget': 20,
             'require_password': True,
             'ruuid': '',
             'sentry_dsn': '',
@@ -235,35 +284,62 @@ class Settings(object):
             'zfs_pool_name': 'antergos',
             'zfs_pool_id': 0})
 
-    def _get_settings(self):
-        """ Get a copy of our settings """
-        settings = self.settings.get()
-        copy = settings.copy()
-        self.settings.put(settings)
-        return copy
+    def _load(self):
+        """ Reads the shared snapshot into our local cache (lock must be held) """
+        version = self.version.value
+        if version != self.cache[0]:
+            settings = pickle.loads(self.buffer[:self.size.value])
+            self.cache = (version, settings)
+        return self.cache[1]
+
+    def _store(self, settings):
+        """ Writes settings to the shared snapshot (lock must be held) """
+        data = pickle.dumps(settings, pickle.HIGHEST_PROTOCOL)
+        if len(data) > len(self.buffer):
+            raise ValueError(
+                "Settings need {0} bytes but the shared buffer only has {1}".format(
+                    len(data), len(self.buffer)))
+        self.buffer[:len(data)] = data
+        self.size.value = len(data)
+        self.version.value += 1
+        self.cache = (self.version.value, settings)
 
-    def _update_settings(self, new_settings):
-        """ Updates global settings """
-        settings = self.settings.get()
-        try:
-            settings.update(new_settings)
-        finally:
-            self.settings.put(settings)
+    def _get_settings(self):
+        """ Get our settings, reading them again only if they have changed """
+        version, settings = self.cache
+        if version != self.version.value:
+            with self.lock:
+                settings = self._load()
+        return settings
 
     def get(self, key):
         """ Get one setting value """
-        settings = self._get_settings()
-        return settings.get(key, None)
+        value = self._get_settings().get(key, None)
+        if not isinstance(value, IMMUTABLE_TYPES):
+            # Callers must not be able to modify our cached copy
+            value = copy.deepcopy(value)
+        return value
 
     def set(self, key, value):
         """ Set one setting's value """
-        settings = self._get_settings()
-        current = settings.get(key, 'keyerror')
-        exists = 'keyerror' != current
+        if not isinstance(value, IMMUTABLE_TYPES):
+            value = copy.deepcopy(value)
+        with self.changed:
+            settings = self._load().copy()
+            current = settings.get(key, 'keyerror')
+            exists = 'keyerror' != current
+
+            if exists and current and isinstance(current, list) and not isinstance(value, list):
+                settings[key] = current + [value]
+            else:
+                settings[key] = value
 
-        if exists and current and isinstance(current, list) and not isinstance(value, list):
-            settings[key].append(value)
-        else:
-            settings[key] = value
+            self._store(settings)
+            self.changed.notify_all()
 
-        self._update_settings(settings)
+    def wait_for(self, key, value, timeout=None):
+        """ Blocks until setting key has the given value (or timeout seconds
+            have passed). Returns True if the setting has that value """
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: self._load().get(key, None) == value, timeout)
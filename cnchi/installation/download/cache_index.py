@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache_index.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Index of the hashes of the packages stored in a cache directory """
+
+import json
+import logging
+import os
+import threading
+from concurrent import futures
+
+import misc.state_files as state_files
+from installation.download import checksum
+
+INDEX_NAME = 'cache-index'
+
+
+def get_file_id(path):
+    """ Returns size, mtime and inode of a file. If any of them changes,
+        its stored hashes are no longer valid """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class CacheIndex(object):
+    """ Stores the hashes of all files in a package cache directory.
+        Hashes are computed (in parallel) only for new or modified files,
+        and the index is saved to Cnchi's state dir (never to the cache dir,
+        which is the user's media) so hashes are not computed again while
+        Cnchi runs in this live session """
+
+    def __init__(self, cache_dir, max_workers=None):
+        self.cache_dir = cache_dir
+        self.path = state_files.get_path(cache_dir, INDEX_NAME)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """ Reads the index from disk (if it exists) """
+        try:
+            with open(self.path) as index_file:
+                self.entries = json.load(index_file)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as err:
+            logging.debug("Can't read cache index %s: %s", self.path, err)
+            self.entries = {}
+
+    def save(self):
+        """ Writes the index to disk. Not being able to do it is not an error """
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as index_file:
+                    json.dump(self.entries, index_file)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except OSError as err:
+                logging.debug("Can't save cache index %s: %s", self.path, err)
+
+    def get_cached_hashes(self, filename, algorithms):
+        """ Returns stored hashes of filename if they are still valid """
+        path = os.path.join(self.cache_dir, filename)
+        try:
+            file_id = get_file_id(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(filename)
+        if not entry or entry.get('file_id') != file_id:
+            return None
+        hashes = entry.get('hashes', {})
+        if all(algorithm in hashes for algorithm in algorithms):
+            return hashes
+        return None
+
+    def store_hashes(self, filename, file_id, hashes):
+        """ Stores the hashes of a file """
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry and entry.get('file_id') == file_id:
+                entry['hashes'].update(hashes)
+            else:
+                self.entries[filename] = {'file_id': file_id, 'hashes': hashes}
+            self.dirty = True
+
+    def update(self, filenames, algorithms=checksum.ALGORITHMS):
+        """ Computes (in parallel) the hashes of all filenames that
+            are not in the index yet """
+        pending = {}
+        for filename in filenames:
+            path = os.path.join(self.cache_dir, filename)
+            if not os.path.isfile(path):
+                continue
+            if self.get_cached_hashes(filename, algorithms) is None:
+                pending[filename] = get_file_id(path)
+
+        if not pending:
+            return
+
+        logging.debug(
+            "Hashing %d files from %s cache...",
+            len(pending),
+            self.cache_dir)
+
+        # hashlib releases the GIL while hashing, so threads are enough.
+        # Worker processes would have to be forked from Cnchi, which
+        # already runs other threads (staging, event timers...) by now.
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            jobs = {
+                executor.submit(
+                    checksum.get_file_hashes,
+                    os.path.join(self.cache_dir, filename),
+                    algorithms): filename
+                for filename in pending}
+            for job in futures.as_completed(jobs):
+                filename = jobs[job]
+                try:
+                    self.store_hashes(filename, pending[filename], job.result())
+                except OSError as err:
+                    logging.debug("Can't hash %s: %s", filename, err)
+
+        self.save()
+
+    def get_hashes(self, filename, algorithms=checksum.ALGORITHMS):
+        """ Returns the hashes of filename (computing them if needed) """
+        hashes = self.get_cached_hashes(filename, algorithms)
+        if hashes is None:
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                file_id = get_file_id(path)
+                hashes = checksum.get_file_hashes(path, algorithms)
+            except OSError:
+                return None
+            self.store_hashes(filename, file_id, hashes)
+        return hashes
+
+    def is_valid(self, filename, expected):
+        """ Checks that filename exists and has the expected hashes
+            (a dict algorithm: hexdigest) """
+        hashes = self.get_hashes(filename, tuple(expected.keys()) or checksum.ALGORITHMS)
+        if hashes is None:
+            return False
+        return all(hashes.get(algorithm) == value for algorithm, value in expected.items())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# checksum.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Package checksums (md5 and sha256) """
+
+import hashlib
+import mmap
+import os
+
+# Files are hashed in blocks of this size
+BLOCK_SIZE = 1024 * 1024
+
+ALGORITHMS = ('md5', 'sha256')
+
+
+def get_expected_hashes(element):
+    """ Returns the known hashes of a metalink element as a dict
+        (algorithm: hexdigest) """
+    hashes = {}
+    for algorithm in ALGORITHMS:
+        if element.get(algorithm):
+            hashes[algorithm] = element[algorithm]
+    if 'md5' not in hashes and element.get('hash'):
+        # Old metalink info only stores the last hash (md5)
+        hashes['md5'] = element['hash']
+    return hashes
+
+
+class StreamHasher(object):
+    """ Computes several hashes at the same time over data chunks
+        as they are downloaded """
+
+    def __init__(self, algorithms=ALGORITHMS):
+        self.hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    def update(self, data):
+        """ Adds a chunk of data """
+        for new_hash in self.hashes.values():
+            new_hash.update(data)
+
+    def update_from_file(self, path, length):
+        """ Adds the first length bytes of a file (used when resuming
+            a partial download) """
+        with open(path, 'rb') as my_file:
+            while length > 0:
+                data = my_file.read(min(BLOCK_SIZE, length))
+                if not data:
+                    break
+                self.update(data)
+                length -= len(data)
+
+    def hexdigests(self):
+        """ Returns a dict with all hexdigests """
+        return {name: new_hash.hexdigest() for name, new_hash in self.hashes.items()}
+
+    def matches(self, expected):
+        """ Checks our hashes against the expected ones (only the
+            algorithms present in both are checked) """
+        digests = self.hexdigests()
+        for algorithm, value in expected.items():
+            if algorithm in digests and digests[algorithm] != value:
+                return False
+        return True
+
+
+def get_file_hashes(path, algorithms=ALGORITHMS):
+    """ Reads a file once and returns all requested hashes (as a dict).
+        The file is mapped in memory so it is hashed in big blocks
+        without copying it to user space buffers """
+    hasher = StreamHasher(algorithms)
+    with open(path, 'rb') as my_file:
+        size = os.fstat(my_file.fileno()).st_size
+        if size == 0:
+            # Empty files can't be mapped
+            return hasher.hexdigests()
+        with mmap.mmap(my_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                for offset in range(0, size, BLOCK_SIZE):
+                    hasher.update(view[offset:offset + BLOCK_SIZE])
+            finally:
+                # mmap can't be closed while a view is still alive
+                view.release()
+    return hasher.hexdigests()
+
+
+def get_file_hash(path, algorithm='md5'):
+    """ Returns one hash of a file """
+    return get_file_hashes(path, (algorithm,))[algorithm]
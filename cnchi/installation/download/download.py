@@ -32,11 +32,12 @@ import logging
 import os
 import queue
 
-import download.download_requests as download_requests
+import installation.download.download_requests as download_requests
 
 import installation.download.metalink as ml
+from installation.download.mirror_health import MirrorHealth, UNRANKED
 import misc.extra as misc
-from installation import pacman as pac
+import installation.pacman.session_pool as session_pool
 
 
 class DownloadPackages(object):
@@ -52,8 +53,11 @@ class DownloadPackages(object):
             pacman_conf_file,
             pacman_cache_dir,
             settings=None,
-            callback_queue=None):
-        """ Initialize DownloadPackages class. Gets default configuration """
+            callback_queue=None,
+            extra_cache_dirs=None):
+        """ Initialize DownloadPackages class. Gets default configuration
+            extra_cache_dirs: other dirs (besides xz_cache) where packages
+            may have been downloaded before """
 
         self.package_names = package_names
 
@@ -63,8 +67,21 @@ class DownloadPackages(object):
         self.settings = settings
         if self.settings:
             self.xz_cache_dirs = self.settings.get('xz_cache')
+            self.max_workers = self.settings.get('download_threads')
+            self.max_connections_per_mirror = self.settings.get(
+                'download_connections_per_mirror')
         else:
             self.xz_cache_dirs = []
+            self.max_workers = None
+            self.max_connections_per_mirror = None
+
+        if extra_cache_dirs:
+            self.xz_cache_dirs = self.xz_cache_dirs + extra_cache_dirs
+
+        if not self.max_workers:
+            self.max_workers = download_requests.MAX_WORKERS
+        if not self.max_connections_per_mirror:
+            self.max_connections_per_mirror = download_requests.MAX_CONNECTIONS_PER_MIRROR
 
         self.callback_queue = callback_queue
 
@@ -78,8 +95,17 @@ class DownloadPackages(object):
         # List of packages' metalinks
         self.metalinks = None
 
-    def start(self, metalinks=None):
-        """ Begin download """
+        # Mirror measurements shared by the whole download run
+        self.mirror_health = MirrorHealth()
+        if self.settings:
+            # Index the mirrorlist we created earlier by host, so we don't
+            # have to search the whole list for each url
+            self.mirror_health.set_ranking(self.settings.get('rankmirrors_result') or [])
+
+    def start(self, metalinks=None, package_callback=None):
+        """ Begin download
+            package_callback is called with each package (metalink element)
+            as soon as it has been downloaded """
         if metalinks:
             self.metalinks = metalinks
 
@@ -95,7 +121,11 @@ class DownloadPackages(object):
         download = download_requests.Download(
             self.pacman_cache_dir,
             self.xz_cache_dirs,
-            self.callback_queue)
+            self.callback_queue,
+            max_workers=self.max_workers,
+            max_connections_per_mirror=self.max_connections_per_mirror,
+            mirror_health=self.mirror_health,
+            package_callback=package_callback)
 
         if not download.start(self.metalinks):
             # When we can't download (even one package), we stop right here
@@ -105,13 +135,10 @@ class DownloadPackages(object):
     def url_sort_helper(self, url):
         """ helper method for sorting mirror urls """
         if not url:
-            return 9999
+            return UNRANKED
         # Use the mirrorlist we created earlier to determine a url's priority
-        ranked = self.settings.get('rankmirrors_result')
-        # Use the first part of the URL to find its position in the ranked mirror list
-        partial = '/'.join(url.split('/')[:3])
-        position = [i for i, s in enumerate(ranked) if partial in s] or [9999]
-        return position[0]
+        # and demote mirrors that have been failing in this run
+        return self.mirror_health.priority(url)
 
     @misc.raise_privileges
     def create_metalinks_list(self):
@@ -119,13 +146,13 @@ class DownloadPackages(object):
 
         self.queue_event('percent', '0')
         self.queue_event('info', _('Creating the list of packages to download...'))
-        processed_packages = 0
-        total_packages = len(self.package_names)
 
         self.metalinks = {}
 
         try:
-            pacman = pac.Pac(
+            # Reuse the alpm session (and its loaded databases) used to
+            # select the packages
+            pacman = session_pool.get_session(
                 conf_path=self.pacman_conf_file,
                 callback_queue=self.callback_queue)
             if pacman is None:
@@ -138,39 +165,46 @@ class DownloadPackages(object):
             return
 
         try:
-            for package_name in self.package_names:
-                metalink = ml.create(pacman, package_name, self.pacman_conf_file)
-                if metalink is None:
-                    txt = "Error creating metalink for package %s. Installation will stop"
-                    logging.error(txt, package_name)
-                    txt = _("Error creating metalink for package {0}. "
-                            "Installation will stop").format(package_name)
-                    raise misc.InstallError(txt)
-
-                # Get metalink info
-                metalink_info = ml.get_info(metalink)
-
-                # Update downloads list with the new info from
-                # the processed metalink
-                for key in metalink_info:
-                    if key not in self.metalinks:
-                        self.metalinks[key] = metalink_info[key]
-                        urls = metalink_info[key]['urls']
-                        if self.settings:
-                            # Sort urls based on the mirrorlist
-                            # we created earlier
-                            sorted_urls = sorted(
-                                urls,
-                                key=self.url_sort_helper)
-                            self.metalinks[key]['urls'] = sorted_urls
-                        else:
-                            # When testing, settings is not available
-                            self.metalinks[key]['urls'] = urls
-
-                # Show progress to the user
-                processed_packages += 1
-                percent = round(float(processed_packages / total_packages), 2)
-                self.queue_event('percent', str(percent))
+            # Resolve all packages at once (instead of one by one), so
+            # their shared dependencies are only processed one time
+            metalink, not_found, missing_deps = ml.create_batch(
+                pacman, self.package_names, self.pacman_conf_file)
+
+            for package_name in sorted(not_found):
+                txt = "Can't find package %s. Installation will stop"
+                logging.error(txt, package_name)
+            for dependency in sorted(missing_deps):
+                txt = "Can't resolve dependency %s. Installation will stop"
+                logging.error(txt, dependency)
+
+            if metalink is None:
+                names = sorted(not_found) + sorted(missing_deps)
+                txt = _("Error creating metalink for packages {0}. "
+                        "Installation will stop").format(', '.join(names))
+                raise misc.InstallError(txt)
+
+            self.queue_event('percent', '0.5')
+
+            # Get metalink info
+            metalink_info = ml.get_info(metalink)
+
+            # Update downloads list with the new info from
+            # the processed metalink
+            for key in metalink_info:
+                self.metalinks[key] = metalink_info[key]
+                urls = metalink_info[key]['urls']
+                if self.settings:
+                    # Sort urls based on the mirrorlist
+                    # we created earlier
+                    sorted_urls = sorted(
+                        urls,
+                        key=self.url_sort_helper)
+                    self.metalinks[key]['urls'] = sorted_urls
+                else:
+                    # When testing, settings is not available
+                    self.metalinks[key]['urls'] = urls
+
+            self.queue_event('percent', '1')
         except Exception as ex:
             template = "Can't create download set. An exception of type {0} occured. Arguments:\n{1!r}"
             message = template.format(type(ex).__name__, ex.args)
@@ -178,16 +212,6 @@ class DownloadPackages(object):
             self.metalinks = None
             return
 
-        try:
-            pacman.release()
-            del pacman
-        except Exception as ex:
-            self.metalinks = None
-            template = "Can't release pyalpm. An exception of type {0} occured. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            return
-
         # Overwrite last event (to clean up the last message)
         self.queue_event('info', "")
 
@@ -237,5 +261,48 @@ def test():
         callback_queue=None)
     download_packages.start()
 
+
+def benchmark_url_sort(num_packages=1500, num_mirrors=200):
+    """ Compares sorting the urls of num_packages packages searching the
+        whole ranked mirror list for each url (as it was done before) with
+        using the mirror health index. Only url ordering is measured (with
+        made up urls), not the rest of create_metalinks_list """
+    import random
+    import time
+
+    ranked = ['http://mirror{0}.example.com/archlinux/'.format(i)
+              for i in range(num_mirrors)]
+    metalinks = {}
+    for index in range(num_packages):
+        urls = random.sample(ranked, ml.MAX_URLS)
+        metalinks['pkg{0}'.format(index)] = [
+            '{0}core/os/x86_64/pkg{1}.pkg.tar.xz'.format(url, index) for url in urls]
+
+    def linear_search(url):
+        """ Old url_sort_helper """
+        partial = '/'.join(url.split('/')[:3])
+        position = [i for i, s in enumerate(ranked) if partial in s] or [UNRANKED]
+        return position[0]
+
+    start = time.time()
+    for urls in metalinks.values():
+        sorted(urls, key=linear_search)
+    linear_time = time.time() - start
+
+    mirror_health = MirrorHealth()
+    start = time.time()
+    mirror_health.set_ranking(ranked)
+    for urls in metalinks.values():
+        sorted(urls, key=mirror_health.priority)
+    index_time = time.time() - start
+
+    print("Sorting urls of {0} packages ({1} mirrors): {2:.3f}s (linear search), "
+          "{3:.3f}s (host index)".format(num_packages, num_mirrors, linear_time, index_time))
+
+
 if __name__ == '__main__':
-    test()
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark-url-sort':
+        benchmark_url_sort()
+    else:
+        test()
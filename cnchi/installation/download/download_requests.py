@@ -35,19 +35,37 @@ import queue
 import shutil
 import requests
 import time
-import hashlib
 import socket
 import io
 import threading
+import urllib.parse
+from concurrent import futures
+
+import misc.http_session as http_session
+from installation.download.mirror_health import MirrorHealth
+from installation.download import cache_index
+from installation.download import checksum
+from installation.download import file_import
+from installation.download import journal
+from installation.download import segmented
+
+# Number of packages downloaded at the same time
+MAX_WORKERS = 4
+
+# Max number of simultaneous connections to the same mirror
+MAX_CONNECTIONS_PER_MIRROR = 2
+
+# Number of packages imported at the same time from the xz cache dirs
+MAX_IMPORT_WORKERS = 2
+
+# When all mirrors fail, Cnchi waits (2, 4, 8...) seconds and tries again
+MAX_RETRY_ROUNDS = 4
+MAX_BACKOFF = 60
 
 
 def get_md5(file_name):
     """ Gets md5 hash from a file """
-    md5_hash = hashlib.md5()
-    with open(file_name, "rb") as myfile:
-        for line in myfile:
-            md5_hash.update(line)
-    return md5_hash.hexdigest()
+    return checksum.get_file_hash(file_name, 'md5')
 
 
 class CopyToCache(threading.Thread):
@@ -69,141 +87,290 @@ class CopyToCache(threading.Thread):
                 pass
 
 
+class MirrorSlots(object):
+    """ Limits how many connections are opened to the same mirror """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS_PER_MIRROR):
+        self.max_connections = max(1, max_connections)
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    @staticmethod
+    def get_host(url):
+        """ Returns the host part of an url """
+        return urllib.parse.urlsplit(url).netloc
+
+    def get_semaphore(self, url):
+        """ Returns the semaphore of the url's mirror """
+        host = self.get_host(url)
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(
+                    self.max_connections)
+            return self.semaphores[host]
+
+    def acquire(self, urls):
+        """ Gets a connection slot for one of the urls. Urls are tried in
+            order, the first one with a free slot is returned. If all
+            mirrors are busy, waits for the first one. """
+        for url in urls:
+            if self.get_semaphore(url).acquire(blocking=False):
+                return url
+        url = urls[0]
+        self.get_semaphore(url).acquire()
+        return url
+
+    def release(self, url):
+        """ Frees the connection slot used by url """
+        self.get_semaphore(url).release()
+
+
+class DownloadProgress(object):
+    """ Aggregates the progress of all running downloads and reports it
+        using Cnchi's percent and downloads_percent events """
+
+    def __init__(self, total_downloads, queue_event):
+        self.total_downloads = total_downloads
+        self.queue_event = queue_event
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        # identity: [completed length, total length, resumed length]
+        self.active = {}
+        self.bytes_downloaded = 0
+        self.start_time = time.perf_counter()
+
+    def start(self, element):
+        """ A new package download starts """
+        with self.lock:
+            try:
+                total_length = int(element.get('size', 0))
+            except (TypeError, ValueError):
+                total_length = 0
+            self.active[element['identity']] = [0, total_length, 0]
+            txt = _("Fetching {0} {1} ({2}/{3})...").format(
+                element['identity'],
+                element['version'],
+                self.downloaded + len(self.active),
+                self.total_downloads)
+        self.queue_event('info', txt)
+
+    def set_total_length(self, identity, total_length):
+        """ Sets the real package size (from the server's response) """
+        with self.lock:
+            if identity in self.active and total_length > 0:
+                self.active[identity][1] = total_length
+
+    def reset(self, identity):
+        """ Package download has to start again (from another mirror) """
+        with self.lock:
+            if identity in self.active:
+                completed, total, resumed = self.active[identity]
+                self.bytes_downloaded -= completed - resumed
+                self.active[identity] = [0, total, 0]
+
+    def resume(self, identity, offset):
+        """ Package download continues a previous one. The bytes already
+            on disk count towards the percentage but not towards the
+            transfer rate """
+        with self.lock:
+            if identity in self.active:
+                self.active[identity][0] += offset
+                self.active[identity][2] += offset
+
+    def update(self, identity, length):
+        """ Some data of package identity has been downloaded """
+        with self.lock:
+            if identity in self.active:
+                self.active[identity][0] += length
+            self.bytes_downloaded += length
+            completed = sum(current for current, _total, _resumed in self.active.values())
+            total = sum(total for _current, total, _resumed in self.active.values())
+            elapsed = time.perf_counter() - self.start_time
+        if total > 0:
+            percent = round(min(completed / total, 1.0), 2)
+            self.queue_event('percent', percent)
+            if elapsed > 0:
+                bps = self.bytes_downloaded // elapsed
+                msg = format_progress_message(percent, bps)
+                self.queue_event('progress_bar_show_text', msg)
+
+    def finish(self, identity):
+        """ Package identity is now in pacman's cache """
+        with self.lock:
+            self.active.pop(identity, None)
+            self.downloaded += 1
+            downloads_percent = round(
+                float(self.downloaded / self.total_downloads), 2)
+        self.queue_event('downloads_percent', str(downloads_percent))
+
+
+def format_progress_message(percent, bps):
+    """ Formats speed message information """
+    if bps >= (1024 * 1024):
+        Mbps = bps / (1024 * 1024)
+        msg = "{0}%   {1:.2f} Mbps".format(int(percent * 100), Mbps)
+    elif bps >= 1024:
+        Kbps = bps / 1024
+        msg = "{0}%   {1:.2f} Kbps".format(int(percent * 100), Kbps)
+    else:
+        msg = "{0}%   {1:.2f} bps".format(int(percent * 100), bps)
+    return msg
+
+
 class Download(object):
     """ Class to download packages using requests
         This class tries to previously download all necessary packages for
-        Antergos installation using requests """
-
-    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue):
-        """ Initialize Download class. Gets default configuration """
+        Antergos installation using requests. Several packages are
+        downloaded at the same time (max_workers) """
+
+    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue,
+                 max_workers=MAX_WORKERS,
+                 max_connections_per_mirror=MAX_CONNECTIONS_PER_MIRROR,
+                 mirror_health=None,
+                 package_callback=None,
+                 index_packages=False):
+        """ Initialize Download class. Gets default configuration
+            package_callback (if given) is called with each element as soon
+            as its package is in pacman's cache (from a worker thread)
+            If index_packages is True, the hashes of the packages put in
+            pacman_cache_dir are stored in its cache index, so they are not
+            hashed again when pacman_cache_dir is used as a xz cache dir """
         self.pacman_cache_dir = pacman_cache_dir
         self.xz_cache_dirs = xz_cache_dirs
         self.callback_queue = callback_queue
+        self.package_callback = package_callback
+        self.max_workers = max(1, max_workers)
 
         # Check that pacman cache directory exists
         os.makedirs(self.pacman_cache_dir, mode=0o755, exist_ok=True)
 
         # Stores last issued event (to prevent repeating events)
         self.last_event = {}
+        self.event_lock = threading.Lock()
 
         self.copy_to_cache_threads = []
 
+        # Remembers complete and partial downloads between Cnchi runs
+        self.journal = journal.DownloadJournal(self.pacman_cache_dir)
+
+        # Hashes of the packages found in each xz cache directory
+        self.cache_indexes = {}
+
+        # Hashes of the packages we put in pacman_cache_dir
+        self.own_index = None
+        if index_packages:
+            self.own_index = cache_index.CacheIndex(self.pacman_cache_dir)
 
-    def is_hash_ok(self, path, element=None, md5hash=None):
-        """ Checks file md5 hash """
+        self.mirror_slots = MirrorSlots(max_connections_per_mirror)
+
+        # Mirror measurements are shared by all downloads
+        if mirror_health is None:
+            mirror_health = MirrorHealth()
+        self.mirror_health = mirror_health
+        self.progress = None
+
+        # Set when a package can't be downloaded, so all
+        # other running downloads stop as soon as possible
+        self.abort = threading.Event()
+
+    def is_hash_ok(self, path, element=None, md5hash=None, hasher=None):
+        """ Checks file hashes (md5 and sha256 when available).
+            If a hasher is given, its hashes (computed while downloading
+            the file) are used instead of reading the file again """
         # Note: path must exist!
 
         if element:
             # element['hash'] is not always available
-            md5hash = element.get('hash', False)
+            expected = checksum.get_expected_hashes(element)
             identity = element['identity']
             filename = element['filename']
-        elif md5hash:
+        else:
+            expected = {'md5': md5hash} if md5hash else {}
             identity = path
             filename = path
 
-        if not md5hash:
+        if not expected:
             logging.debug('Checksum unavailable for package: %s', identity)
             self.queue_event('cache_pkgs_md5_check_failed', identity)
             # We cannot check md5, let's assume it's ok
             return True
 
-        if md5hash != get_md5(path):
-            logging.warning("MD5 hash of file %s does not match!", filename)
+        if hasher is None:
+            hashes = checksum.get_file_hashes(path, expected.keys())
+            ok = all(hashes[algorithm] == value for algorithm, value in expected.items())
+        else:
+            ok = hasher.matches(expected)
+
+        if not ok:
+            logging.warning("Hash of file %s does not match!", filename)
             return False
 
-        # If we reach this point, md5 hash is ok
+        # If we reach this point, hash is ok
         return True
 
     def start(self, downloads):
         """ Downloads using requests """
-        downloaded = 0
         total_downloads = len(downloads)
 
         self.queue_event('downloads_progress_bar', 'show')
         self.queue_event('downloads_percent', '0')
+        self.queue_event('percent', '0')
 
         self.copy_to_cache_threads = []
+        self.abort.clear()
+        self.progress = DownloadProgress(total_downloads, self.queue_event)
 
         logging.debug(
-            "Downloading packages to pacman cache dir '%s'",
-            self.pacman_cache_dir)
-
-        while len(downloads) > 0:
-            needs_to_download = True
-
-            # Get package to download from downloads list
-            identity, element = downloads.popitem()
-
-            self.queue_event('percent', '0')
-
-            txt = _("Fetching {0} {1} ({2}/{3})...").format(
-                element['identity'],
-                element['version'],
-                downloaded + 1,
-                total_downloads)
-            self.queue_event('info', txt)
-
-            dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
-
-            if os.path.exists(dst_path):
-                # File already exists in destination pacman's cache
-                # (previous install?). We check the file md5 hash.
-                if not self.is_hash_ok(path=dst_path, element=element):
-                    # We're sure it's a wrong hash. Force to download it
-                    needs_to_download = True
+            "Downloading packages to pacman cache dir '%s' (%d at a time)",
+            self.pacman_cache_dir,
+            self.max_workers)
+
+        # Validate all packages found in the xz cache dirs at once
+        self.update_cache_indexes(downloads.values())
+
+        all_ok = True
+        # Packages found in the xz cache dirs are imported by their own
+        # workers, so they do not wait behind (or block) the downloads
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                futures.ThreadPoolExecutor(max_workers=MAX_IMPORT_WORKERS) as importer:
+            pending = set()
+            while downloads:
+                # Get package to download from downloads list
+                identity, element = downloads.popitem()
+                if self.is_in_xz_cache(element):
+                    pending.add(importer.submit(self.get_package, element))
                 else:
-                    needs_to_download = False
-                    logging.debug(
-                        "File %s found in %s cache, there is no need to download it",
-                        element['filename'],
-                        self.pacman_cache_dir)
-            else:
-                needs_to_download = True
-                # Check all cache directories
-                for xz_cache_dir in self.xz_cache_dirs:
-                    dst_xz_cache_path = os.path.join(
-                        xz_cache_dir,
-                        element['filename'])
-
-                    if (os.path.exists(dst_xz_cache_path) and
-                            self.is_hash_ok(path=dst_xz_cache_path, element=element)):
-                        # We're lucky, the package is already downloaded
-                        # in the cache the user has given us
-                        # and its md5 checks out (if there is a md5)
-                        try:
-                            shutil.copy(dst_xz_cache_path, dst_path)
-                            needs_to_download = False
-                            logging.debug(
-                                "%s found in %s cache, there is no need to download it",
-                                element['filename'],
-                                xz_cache_dir)
-                            # Get out of the cache for loop, as we managed
-                            # to find the package in this cache directory
-                            break
-                        except OSError as os_error:
-                            needs_to_download = True
-                            logging.debug(
-                                "Error copying %s to %s : %s",
-                                dst_xz_cache_path,
-                                dst_path,
-                                os_error)
-
-            if needs_to_download and not self.download_package(element, dst_path):
-                # None of the mirror urls works.
-                # Stop right here, so the user does not have to wait
-                # to download the other packages.
-                logging.error(
-                    "Can't download %s, even after trying all available mirrors",
-                    element['filename'])
-                return False
-            else:
-                downloaded += 1
+                    pending.add(executor.submit(self.get_package, element))
 
-            self.queue_event('progress_bar_show_text', '')
+            for future in futures.as_completed(pending):
+                try:
+                    package_ok = future.result()
+                except Exception as err:
+                    # An unexpected error (writing to disk, a bad url...)
+                    # is treated as any other failed package
+                    logging.error("Error downloading a package: %s", err)
+                    package_ok = False
+                if not package_ok:
+                    # None of the mirror urls works.
+                    # Stop right here, so the user does not have to wait
+                    # to download the other packages.
+                    all_ok = False
+                    self.abort.set()
+                    for other in pending:
+                        other.cancel()
+                    break
+
+        # Downloads are done, close all kept alive connections
+        http_session.close_all()
+        self.journal.flush()
+        if self.own_index is not None:
+            self.own_index.save()
+        self.mirror_health.log_stats()
+
+        if not all_ok:
+            return False
 
-            downloads_percent = round(float(downloaded / total_downloads), 2)
-            self.queue_event('downloads_percent', str(downloads_percent))
+        self.queue_event('progress_bar_show_text', '')
 
         # Wait until all xz packages are also copied to provided cache (if any)
         for cache_thread in self.copy_to_cache_threads:
@@ -212,6 +379,143 @@ class Download(object):
         self.queue_event('downloads_progress_bar', 'hide')
         return True
 
+    def is_in_xz_cache(self, element):
+        """ Returns True if there is a copy of the package in
+            any of the xz cache directories """
+        return any(
+            os.path.exists(os.path.join(xz_cache_dir, element['filename']))
+            for xz_cache_dir in self.xz_cache_dirs)
+
+    def update_cache_indexes(self, elements):
+        """ Hashes (in parallel) all packages found in the xz cache
+            directories that are not already in their cache index.
+            Only the hashes each package will be checked with are computed """
+        by_algorithms = {}
+        for element in elements:
+            algorithms = tuple(sorted(checksum.get_expected_hashes(element)))
+            if algorithms:
+                by_algorithms.setdefault(algorithms, []).append(element['filename'])
+
+        for xz_cache_dir in self.xz_cache_dirs:
+            if not os.path.isdir(xz_cache_dir):
+                continue
+            if xz_cache_dir not in self.cache_indexes:
+                self.cache_indexes[xz_cache_dir] = cache_index.CacheIndex(xz_cache_dir)
+            for algorithms, filenames in by_algorithms.items():
+                self.cache_indexes[xz_cache_dir].update(filenames, algorithms)
+
+    def is_cached_hash_ok(self, xz_cache_dir, element):
+        """ Checks the hash of a package in a xz cache dir
+            using the cache index """
+        index = self.cache_indexes.get(xz_cache_dir)
+        expected = checksum.get_expected_hashes(element)
+        if index is None or not expected:
+            path = os.path.join(xz_cache_dir, element['filename'])
+            return self.is_hash_ok(path=path, element=element)
+        if index.is_valid(element['filename'], expected):
+            return True
+        logging.warning(
+            "Hash of file %s in %s does not match!",
+            element['filename'],
+            xz_cache_dir)
+        return False
+
+    def get_package(self, element):
+        """ Puts the package in pacman's cache. Uses the copy that is already
+            there (or in the xz cache) if possible, downloads it otherwise.
+            Runs in a worker thread. """
+        if self.abort.is_set():
+            return False
+
+        dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
+
+        self.progress.start(element)
+
+        if not self.is_in_cache(element, dst_path):
+            if not self.download_package(element, dst_path):
+                if not self.abort.is_set():
+                    logging.error(
+                        "Can't download %s, even after trying all available mirrors",
+                        element['filename'])
+                return False
+
+        if self.own_index is not None:
+            self.index_package(element, dst_path)
+
+        self.progress.finish(element['identity'])
+        if self.package_callback is not None:
+            self.package_callback(element)
+        return True
+
+    def index_package(self, element, dst_path):
+        """ Stores the hashes of a package that has just been checked,
+            so nobody has to read it again to know them """
+        hashes = checksum.get_expected_hashes(element)
+        if not hashes:
+            return
+        try:
+            file_id = cache_index.get_file_id(dst_path)
+        except OSError:
+            return
+        self.own_index.store_hashes(element['filename'], file_id, hashes)
+
+    def is_in_cache(self, element, dst_path):
+        """ Checks if the package is already in pacman's cache or in one
+            of the xz cache directories (copying it from there) """
+        md5hash = element.get('hash')
+
+        if self.journal.is_complete(element['filename'], dst_path, md5hash):
+            # Downloaded (and checked) in a previous run and
+            # not modified since. No need to check its hash again.
+            logging.debug(
+                "File %s already downloaded in a previous run",
+                element['filename'])
+            return True
+
+        if os.path.exists(dst_path):
+            # File already exists in destination pacman's cache
+            # (previous install?). We check the file md5 hash.
+            if self.is_hash_ok(path=dst_path, element=element):
+                logging.debug(
+                    "File %s found in %s cache, there is no need to download it",
+                    element['filename'],
+                    self.pacman_cache_dir)
+                self.journal.mark_complete(element['filename'], dst_path, md5hash)
+                return True
+            # We're sure it's a wrong hash. Force to download it
+            return False
+
+        # Check all cache directories
+        for xz_cache_dir in self.xz_cache_dirs:
+            dst_xz_cache_path = os.path.join(
+                xz_cache_dir,
+                element['filename'])
+
+            if (os.path.exists(dst_xz_cache_path) and
+                    self.is_cached_hash_ok(xz_cache_dir, element)):
+                # We're lucky, the package is already downloaded
+                # in the cache the user has given us
+                # and its md5 checks out (if there is a md5)
+                try:
+                    # Use reflink, hard link or in-kernel copy when possible
+                    method = file_import.import_file(dst_xz_cache_path, dst_path)
+                    self.journal.mark_complete(element['filename'], dst_path, md5hash)
+                    logging.debug(
+                        "%s found in %s cache, there is no need to download it (%s)",
+                        element['filename'],
+                        xz_cache_dir,
+                        method)
+                    # Get out of the cache for loop, as we managed
+                    # to find the package in this cache directory
+                    return True
+                except OSError as os_error:
+                    logging.debug(
+                        "Error copying %s to %s : %s",
+                        dst_xz_cache_path,
+                        dst_path,
+                        os_error)
+        return False
+
     def download_package(self, element, dst_path):
         """ Package wasn't previously downloaded or its md5 was wrong
             We'll have to download it
@@ -224,17 +528,103 @@ class Download(object):
             element['version'],
             len(element['urls']))
 
-        for url in element['urls']:
-            # Let's catch empty values as well as None just to be safe
-            if not url:
-                # Something bad has happened, let's try another mirror
-                download_ok = False
-                logging.debug(
-                    "Package %s-%s has an empty url for this mirror",
-                    element['identity'],
-                    element['version'])
+        # Let's catch empty values as well as None just to be safe
+        all_urls = [url for url in element['urls'] if url]
+        if len(all_urls) < len(element['urls']):
+            logging.debug(
+                "Package %s-%s has an empty url for some mirror",
+                element['identity'],
+                element['version'])
+
+        if self.can_use_segments(element, all_urls):
+            if self.download_segmented(element, dst_path, all_urls):
+                return True
+            # Try again the usual way (one mirror at a time)
+            self.progress.reset(element['identity'])
+
+        for retry_round in range(MAX_RETRY_ROUNDS):
+            if retry_round == 0:
+                # Skip mirrors that have been failing lately
+                urls = [url for url in all_urls
+                        if self.mirror_health.is_available(url)]
             else:
-                download_ok = self.download_url(url, dst_path)
+                # Every mirror is failing. Wait a bit and try all of them
+                backoff = min(2 ** retry_round, MAX_BACKOFF)
+                logging.debug(
+                    "All mirrors failed for %s, Cnchi will try again in %d seconds",
+                    element['filename'],
+                    backoff)
+                if self.abort.wait(backoff):
+                    return False
+                urls = list(all_urls)
+
+            if self.download_from_mirrors(element, dst_path, urls):
+                return True
+
+            if self.abort.is_set():
+                break
+
+        return False
+
+    def can_use_segments(self, element, urls):
+        """ Big packages with more than one mirror are downloaded
+            in segments from several mirrors at once """
+        try:
+            size = int(element.get('size', 0))
+        except (TypeError, ValueError):
+            return False
+        urls = [url for url in urls if self.mirror_health.is_available(url)]
+        return size >= segmented.MIN_SIZE and len(urls) > 1
+
+    def download_segmented(self, element, dst_path, urls):
+        """ Downloads the package in segments from several mirrors
+            and checks its hash once all segments are in place """
+        identity = element['identity']
+        urls = self.mirror_health.sort_urls(
+            [url for url in urls if self.mirror_health.is_available(url)])
+
+        logging.debug(
+            "Downloading %s in segments from %d mirrors...",
+            element['filename'],
+            min(len(urls), segmented.MAX_WORKERS))
+
+        # A segmented .part file has holes, it can't be resumed later
+        part_path = journal.get_part_path(dst_path)
+        self.discard_part(element['filename'], part_path)
+
+        segmented_download = segmented.SegmentedDownload(
+            urls=urls,
+            dst_path=part_path,
+            total_length=int(element['size']),
+            mirror_slots=self.mirror_slots,
+            mirror_health=self.mirror_health,
+            abort=self.abort,
+            progress_callback=lambda length: self.progress.update(identity, length))
+
+        if (not segmented_download.run() or
+                not self.is_hash_ok(path=part_path, element=element)):
+            logging.debug("Segmented download of %s failed", element['filename'])
+            self.discard_part(element['filename'], part_path)
+            return False
+
+        os.replace(part_path, dst_path)
+        self.journal.mark_complete(element['filename'], dst_path, element.get('hash'))
+        return True
+
+    def download_from_mirrors(self, element, dst_path, urls):
+        """ Tries to download the package from the given mirror urls,
+            best mirrors first """
+        # Use the live mirror health to decide which mirror is tried first
+        urls = self.mirror_health.sort_urls(urls)
+
+        while urls and not self.abort.is_set():
+            # Use the best mirror that is not already serving
+            # too many of our requests
+            url = self.mirror_slots.acquire(urls)
+            try:
+                download_ok = self.download_url(url, dst_path, element=element)
+            finally:
+                self.mirror_slots.release(url)
 
             if download_ok:
                 # Copy downloaded xz file to the cache the user has provided, too.
@@ -245,78 +635,162 @@ class Download(object):
                 # copy_to_cache_thread = CopyToCache(dst_path, self.xz_cache_dirs)
                 # self.copy_to_cache_threads += [copy_to_cache_thread]
                 # copy_to_cache_thread.start()
+                return True
 
-                # Get out of the for loop, as we managed
-                # to download the package
-                break
-            else:
-                # requests failed to obtain the file. Wrong url?
+            # requests failed to obtain the file. Wrong url?
+            if not self.abort.is_set():
+                self.mirror_health.record_failure(url)
                 msg = "Can't download %s, Cnchi will try another mirror."
                 logging.debug(msg, url)
-                # delays for 60 seconds
-                time.sleep(60)
+            urls.remove(url)
+            self.progress.reset(element['identity'])
+
+        return False
+
+    def download_url(self, url, dst_path, md5hash="", element=None):
+        """ Downloads url to dst_path. If element is given, the package
+            progress is reported to the shared progress aggregator.
+            Data is written to a .part file first, so an interrupted
+            download can be resumed later (see journal.py) """
+        identity = element['identity'] if element else None
+        if element:
+            md5hash = element.get('hash', md5hash)
+        filename = os.path.basename(dst_path)
+        part_path = journal.get_part_path(dst_path)
 
-        return download_ok
+        # Resume a previous download if possible
+        offset = self.journal.get_offset(filename, part_path, md5hash)
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes={0}-'.format(offset)
 
-    def download_url(self, url, dst_path, md5hash=""):
-        percent = 0
+        req = None
         completed_length = 0
         start = time.perf_counter()
         try:
             # By default, get waits five minutes before
             # issuing a timeout, which is too much.
-            req = requests.get(url, stream=True, timeout=30)
-            if req.status_code == requests.codes.ok:
-                # Get total file length
-                try:
-                    total_length = int(req.headers.get('content-length'))
-                except TypeError as err:
-                    total_length = 0
-                    logging.debug(
-                        "Metalink for package %s has no size info", url)
+            # Connections to the mirror are kept alive and reused
+            req = http_session.get(
+                url,
+                pool_maxsize=self.mirror_slots.max_connections,
+                headers=headers,
+                stream=True,
+                timeout=30)
+
+            if offset and req.status_code == requests.codes.partial_content:
+                logging.debug("Resuming download of %s at byte %d", filename, offset)
+                mode = 'r+b'
+            elif req.status_code == requests.codes.ok:
+                # Server does not support ranges (or we are not resuming)
+                offset = 0
+                mode = 'wb'
+            else:
+                logging.debug(
+                    "Server answered %d when downloading %s",
+                    req.status_code,
+                    url)
+                if req.status_code == requests.codes.requested_range_not_satisfiable:
+                    # Our partial file is no good
+                    self.discard_part(filename, part_path)
+                return False
 
-                with open(dst_path, 'wb') as xz_file:
+            # Get total file length
+            try:
+                total_length = offset + int(req.headers.get('content-length'))
+            except TypeError as err:
+                total_length = 0
+                logging.debug(
+                    "Metalink for package %s has no size info", url)
+
+            if identity:
+                self.progress.set_total_length(identity, total_length)
+                self.progress.resume(identity, offset)
+
+            latency = time.perf_counter() - start
+
+            # Hashes are computed while the data arrives, so there
+            # is no need to read the file again to check it
+            hasher = checksum.StreamHasher()
+            if offset:
+                hasher.update_from_file(part_path, offset)
+
+            with open(part_path, mode) as xz_file:
+                xz_file.seek(offset)
+                xz_file.truncate()
+                synced = offset
+                try:
                     for data in req.iter_content(io.DEFAULT_BUFFER_SIZE):
                         if not data:
                             break
+                        if self.abort.is_set():
+                            # Another package failed, no need to continue
+                            return False
                         xz_file.write(data)
+                        hasher.update(data)
                         completed_length += len(data)
-                        old_percent = percent
-                        if total_length > 0:
-                            percent = float(completed_length / total_length)
-                            percent = round(percent, 2)
-                        else:
-                            percent += 0.1
-                        if old_percent != percent:
-                            self.queue_event('percent', percent)
-                        bps = completed_length // (time.perf_counter() - start)
-                        msg = self.format_progress_message(percent, bps)
-                        self.queue_event('progress_bar_show_text', msg)
-
-                # Check hash of downloaded package
-                if md5hash and not self.is_hash_ok(path=dst_path, md5hash=md5hash):
-                    # Wrong md5! Force to download it again
-                    return False
+                        if identity:
+                            self.progress.update(identity, len(data))
+                        if offset + completed_length - synced >= journal.CHECKPOINT:
+                            synced = self.sync_part(
+                                xz_file, filename, md5hash)
+                finally:
+                    if offset + completed_length > synced:
+                        # Save what we have, so we can resume from here
+                        self.sync_part(xz_file, filename, md5hash)
+
+            elapsed = time.perf_counter() - start
+
+            # Check hash of downloaded package
+            if element:
+                expected = checksum.get_expected_hashes(element)
+            else:
+                expected = {'md5': md5hash} if md5hash else {}
+            if expected and not hasher.matches(expected):
+                logging.warning("Hash of file %s does not match!", filename)
+                # Wrong hash! Force to download it again
+                self.discard_part(filename, part_path)
+                return False
+
+            # Only mirrors that serve good files get credit for it
+            self.mirror_health.record_success(
+                url,
+                completed_length,
+                elapsed,
+                latency)
+
+            os.replace(part_path, dst_path)
+            self.journal.mark_complete(filename, dst_path, md5hash)
         except (socket.timeout,
                 requests.exceptions.Timeout,
                 requests.exceptions.ConnectionError,
                 requests.exceptions.ChunkedEncodingError) as connection_error:
             logging.debug(connection_error)
             return False
+        finally:
+            # Gives the connection back to the pool
+            # (or discards it if the transfer was not completed)
+            if req is not None:
+                req.close()
 
         return True
 
-    def format_progress_message(self, percent, bps):
-        """ Formats speed message information """
-        if bps >= (1024 * 1024):
-            Mbps = bps / (1024 * 1024)
-            msg = "{0}%   {1:.2f} Mbps".format(int(percent * 100), Mbps)
-        elif bps >= 1024:
-            Kbps = bps / 1024
-            msg = "{0}%   {1:.2f} Kbps".format(int(percent * 100), Kbps)
-        else:
-            msg = "{0}%   {1:.2f} bps".format(int(percent * 100), bps)
-        return msg
+    def sync_part(self, part_file, filename, md5hash):
+        """ Flushes a partial file to disk and stores its size in the
+            journal. Returns the synced offset """
+        part_file.flush()
+        os.fsync(part_file.fileno())
+        offset = part_file.tell()
+        self.journal.checkpoint(filename, offset, md5hash)
+        return offset
+
+    def discard_part(self, filename, part_path):
+        """ Removes a partial file that can't be used """
+        self.journal.forget(filename)
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
 
     def queue_event(self, event_type, event_text=None):
         """ Adds an event to Cnchi event queue """
@@ -326,12 +800,14 @@ class Download(object):
                 logging.debug("{0}: {1}".format(event_type, event_text))
             return
 
-        if event_type in self.last_event:
-            if self.last_event[event_type] == event_text:
-                # do not repeat same event
-                return
+        # Events can be issued from all download threads
+        with self.event_lock:
+            if event_type in self.last_event:
+                if self.last_event[event_type] == event_text:
+                    # do not repeat same event
+                    return
 
-        self.last_event[event_type] = event_text
+            self.last_event[event_type] = event_text
 
         try:
             # Add the event
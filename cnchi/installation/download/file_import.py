@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# file_import.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Puts a file from a local package cache into pacman's cache using the
+    cheapest method available: reflink, hard link, in-kernel copy
+    (copy_file_range / sendfile) or, as a last resort, a streaming copy """
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+
+# ioctl request to clone a file (see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+# Max bytes copied by each copy_file_range/sendfile call
+COPY_CHUNK = 64 * 1024 * 1024
+
+# Errors that just mean "this method is not available here"
+UNSUPPORTED_ERRORS = (
+    errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY,
+    errno.EINVAL, errno.ENOSYS, errno.EMLINK, errno.EBADF)
+
+
+class UnsupportedMethod(Exception):
+    """ The import method can't be used with these files """
+    pass
+
+
+def reflink(src, dst):
+    """ Clones src into dst (copy on write, btrfs and xfs only) """
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as err:
+            if err.errno in UNSUPPORTED_ERRORS:
+                raise UnsupportedMethod(err)
+            raise
+
+
+def hardlink(src, dst):
+    """ Links dst to src (only possible in the same file system) """
+    if os.stat(src).st_dev != os.stat(os.path.dirname(dst)).st_dev:
+        raise UnsupportedMethod("{0} and {1} are in different file systems".format(src, dst))
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno in UNSUPPORTED_ERRORS:
+            raise UnsupportedMethod(err)
+        raise
+
+
+def kernel_copy(src, dst):
+    """ Copies src into dst without passing data through user space """
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        src_fd = src_file.fileno()
+        dst_fd = dst_file.fileno()
+        size = os.fstat(src_fd).st_size
+        copy = getattr(os, 'copy_file_range', None)
+        offset = 0
+        while offset < size:
+            count = min(COPY_CHUNK, size - offset)
+            try:
+                if copy is not None:
+                    copied = copy(src_fd, dst_fd, count)
+                else:
+                    copied = os.sendfile(dst_fd, src_fd, offset, count)
+            except OSError as err:
+                if err.errno in UNSUPPORTED_ERRORS and copy is not None and offset == 0:
+                    # copy_file_range does not work across these
+                    # file systems (older kernels), try sendfile
+                    copy = None
+                    continue
+                if err.errno in UNSUPPORTED_ERRORS:
+                    raise UnsupportedMethod(err)
+                raise
+            if copied == 0:
+                break
+            offset += copied
+            if copy is None:
+                # sendfile does not move the file offsets
+                os.lseek(src_fd, offset, os.SEEK_SET)
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+        if offset != size:
+            raise UnsupportedMethod("Only {0} of {1} bytes copied".format(offset, size))
+
+
+def stream_copy(src, dst):
+    """ Plain copy """
+    shutil.copyfile(src, dst)
+
+
+METHODS = (
+    ('reflink', reflink),
+    ('hardlink', hardlink),
+    ('kernel copy', kernel_copy),
+    ('copy', stream_copy))
+
+
+def import_file(src, dst):
+    """ Puts src in dst using the best available method. The file is
+        created with a temporary name and renamed when it is complete.
+        Returns the name of the method used """
+    tmp_dst = dst + '.import'
+    for name, method in METHODS:
+        try:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            method(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return name
+        except UnsupportedMethod as err:
+            logging.debug("Can't use %s to import %s: %s", name, src, err)
+        except OSError:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            raise
+    # shutil.copyfile always works or raises OSError
+    return None
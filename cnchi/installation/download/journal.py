@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# journal.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Download journal. Remembers which packages are already complete in
+    pacman's cache and how much of each partial (.part) file can be
+    trusted, so an interrupted download can be resumed """
+
+import json
+import logging
+import os
+import threading
+import time
+
+import misc.state_files as state_files
+
+JOURNAL_NAME = 'download-journal'
+PART_SUFFIX = '.part'
+
+# Partial files are synced to disk (and its offset saved) every CHECKPOINT bytes
+CHECKPOINT = 8 * 1024 * 1024
+
+# Min seconds between two journal writes
+SAVE_INTERVAL = 1.0
+
+
+def get_part_path(path):
+    """ Returns the path of the partial file used while downloading path """
+    return path + PART_SUFFIX
+
+
+class DownloadJournal(object):
+    """ Stores the state of each download of pacman's cache dir in a json
+        file (kept in Cnchi's state dir, not in the cache dir itself)
+
+        Complete files are stored with their size, mtime and inode. If the
+        file has not changed since, there is no need to check its hash again.
+        Partial files are stored with the offset that was synced to disk
+        the last time, which is the point where the download is resumed """
+
+    def __init__(self, cache_dir):
+        self.path = state_files.get_path(cache_dir, JOURNAL_NAME)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+        self.last_save = 0
+        self.load()
+
+    def load(self):
+        """ Reads the journal from disk (if it exists) """
+        try:
+            with open(self.path) as journal_file:
+                self.entries = json.load(journal_file)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as err:
+            logging.warning("Can't read download journal %s: %s", self.path, err)
+            self.entries = {}
+
+    def save(self, force=False):
+        """ Writes the journal to disk (at most once every SAVE_INTERVAL
+            seconds unless force is True). Lock must be held.
+            Losing the last changes is harmless: a complete file will have
+            its hash checked again and a partial one will be resumed from
+            an older (smaller) offset """
+        self.dirty = True
+        if not force and time.monotonic() - self.last_save < SAVE_INTERVAL:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as journal_file:
+                json.dump(self.entries, journal_file)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        except OSError as err:
+            logging.warning("Can't write download journal %s: %s", self.path, err)
+
+    def flush(self):
+        """ Writes pending changes to disk """
+        with self.lock:
+            if self.dirty:
+                self.save(force=True)
+
+    @staticmethod
+    def get_file_id(path):
+        """ Returns size, mtime and inode of a file """
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def is_complete(self, filename, path, file_hash=None):
+        """ Returns True if path is a file downloaded (and checked) before
+            that has not changed since """
+        with self.lock:
+            entry = self.entries.get(filename)
+        if not entry or entry.get('state') != 'complete':
+            return False
+        if file_hash and entry.get('hash') and entry['hash'] != file_hash:
+            return False
+        try:
+            return entry.get('file_id') == self.get_file_id(path)
+        except OSError:
+            return False
+
+    def mark_complete(self, filename, path, file_hash=None):
+        """ Stores that path is complete and correct """
+        try:
+            file_id = self.get_file_id(path)
+        except OSError:
+            return
+        with self.lock:
+            self.entries[filename] = {
+                'state': 'complete',
+                'hash': file_hash,
+                'file_id': file_id}
+            self.save()
+
+    def get_offset(self, filename, part_path, file_hash=None):
+        """ Returns where the download of filename can be resumed.
+            Partial files that can't be trusted are removed. """
+        with self.lock:
+            entry = self.entries.get(filename)
+
+        offset = 0
+        if (entry and entry.get('state') == 'partial' and
+                (not file_hash or entry.get('hash') == file_hash)):
+            try:
+                offset = min(entry.get('offset', 0), os.path.getsize(part_path))
+            except OSError:
+                offset = 0
+
+        if not offset and os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except OSError as err:
+                logging.debug("Can't remove %s: %s", part_path, err)
+
+        return offset
+
+    def checkpoint(self, filename, offset, file_hash=None):
+        """ Stores how many bytes of filename's partial file are on disk """
+        with self.lock:
+            self.entries[filename] = {
+                'state': 'partial',
+                'hash': file_hash,
+                'offset': offset}
+            self.save()
+
+    def forget(self, filename):
+        """ Removes filename from the journal """
+        with self.lock:
+            if self.entries.pop(filename, None) is not None:
+                self.save()
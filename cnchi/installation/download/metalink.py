@@ -31,13 +31,14 @@
 """ Operations with metalinks """
 
 import argparse
-import hashlib
 import logging
 import os
 import re
 import tempfile
 import xml.dom.minidom as minidom
+import time
 from collections import deque
+from functools import partial
 
 try:
     import pyalpm
@@ -49,6 +50,9 @@ try:
 except ImportError:
     import xml.etree.ElementTree as eTree
 
+from installation.download import cache_index
+from installation.download import checksum
+
 MAX_URLS = 15
 
 
@@ -78,6 +82,10 @@ def get_info(metalink):
                 element['description'] = elem.text
             elif elem.tag.endswith("hash"):
                 element['hash'] = elem.text
+                # Keep all hashes (md5 and sha256) by type
+                hash_type = elem.attrib.get('type')
+                if hash_type:
+                    element[hash_type] = elem.text
             elif elem.tag.endswith("url"):
                 try:
                     element['urls'].append(elem.text)
@@ -137,6 +145,26 @@ def create(alpm, package_name, pacman_conf_file):
     return metalink
 
 
+def create_batch(alpm, package_names, pacman_conf_file):
+    """ Creates one metalink to download all packages in package_names and
+        their dependencies. All packages are resolved in a single pass, so
+        shared dependencies are only looked up (and downloaded) once.
+        Returns the metalink and the packages and dependencies that
+        could not be found """
+
+    options = ["--conf", pacman_conf_file, "--noconfirm", "--all-deps"]
+    options.extend(package_names)
+
+    download_queue, not_found, missing_deps = build_download_queue(alpm, args=options)
+
+    if not_found or missing_deps:
+        return None, not_found, missing_deps
+
+    metalink = download_queue_to_metalink(download_queue)
+
+    return metalink, not_found, missing_deps
+
+
 """ From here comes modified code from pm2ml
     pm2ml is Copyright (C) 2012-2013 Xyne
     More info: http://xyne.archlinux.ca/projects/pm2ml """
@@ -312,9 +340,11 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
-def build_download_queue(alpm, args=None):
+def build_download_queue(alpm, args=None, use_index=True):
     """ Function to build a download queue.
-        Needs a pkgname in args """
+        Needs a pkgname in args.
+        If use_index is False, dependencies are looked up with
+        pyalpm.find_satisfier instead of our provider indexes """
 
     pargs = parse_args(args)
 
@@ -371,15 +401,32 @@ def build_download_queue(alpm, args=None):
     # Resolve dependencies.
     if other and not pargs.nodeps:
         queue = deque(other)
-        local_cache = handle.get_localdb().pkgcache
         syncdbs = handle.get_syncdbs()
-        seen = set(queue)
+        if use_index:
+            # Indexes are built once per alpm handle and reused
+            sync_satisfiers = [
+                alpm.get_provider_index(db).find_satisfier for db in syncdbs]
+            if not pargs.alldeps:
+                local_satisfier = alpm.get_provider_index(
+                    handle.get_localdb()).find_satisfier
+        else:
+            sync_satisfiers = [
+                partial(pyalpm.find_satisfier, db.pkgcache) for db in syncdbs]
+            local_satisfier = partial(
+                pyalpm.find_satisfier, handle.get_localdb().pkgcache)
+        seen = set(pkg.name for pkg in queue)
+        # Many packages share the same dependencies (glibc, gcc-libs...),
+        # so remember what we already resolved to look up each one once
+        resolved = set()
         while queue:
             pkg = queue.popleft()
             for dep in pkg.depends:
-                if pyalpm.find_satisfier(local_cache, dep) is None or pargs.alldeps:
-                    for db in syncdbs:
-                        prov = pyalpm.find_satisfier(db.pkgcache, dep)
+                if dep in resolved:
+                    continue
+                resolved.add(dep)
+                if pargs.alldeps or local_satisfier(dep) is None:
+                    for find_satisfier in sync_satisfiers:
+                        prov = find_satisfier(dep)
                         if prov is not None:
                             other.add(prov)
                             if prov.name not in seen:
@@ -422,15 +469,8 @@ def build_download_queue(alpm, args=None):
 
 def get_checksum(path, typ):
     """ Returns checksum of a file """
-    new_hash = hashlib.new(typ)
-    block_size = new_hash.block_size
     try:
-        with open(path, 'rb') as f:
-            buf = f.read(block_size)
-            while buf:
-                new_hash.update(buf)
-                buf = f.read(block_size)
-        return new_hash.hexdigest()
+        return checksum.get_file_hash(path, typ)
     except FileNotFoundError:
         return -1
     except IOError as io_error:
@@ -438,19 +478,26 @@ def get_checksum(path, typ):
 
 
 def check_cache(conf, pkgs):
-    """ Checks package checksum in cache """
+    """ Checks package checksum in cache. Yields the packages that are
+        not in any cache directory (or whose checksums do not match) """
+    pkgs = list(pkgs)
+    indexes = []
+    for cache in conf.options['CacheDir']:
+        # All files are hashed at once (in parallel), and the
+        # index remembers them for the next time
+        index = cache_index.CacheIndex(cache)
+        index.update(pkg.filename for pkg in pkgs)
+        indexes.append(index)
+
     for pkg in pkgs:
-        for cache in conf.options['CacheDir']:
-            fpath = os.path.join(cache, pkg.filename)
-            for checksum in ('sha256', 'md5'):
-                real_checksum = get_checksum(fpath, checksum)
-                correct_checksum = getattr(pkg, checksum + 'sum')
-                if real_checksum is None or real_checksum != correct_checksum:
-                    yield pkg
-                    break
-            else:
-                continue
-            break
+        expected = {
+            'sha256': pkg.sha256sum,
+            'md5': pkg.md5sum}
+        for index in indexes:
+            if index.is_valid(pkg.filename, expected):
+                break
+        else:
+            yield pkg
 
 
 def needs_sig(siglevel, insistence, prefix):
@@ -512,6 +559,58 @@ def test():
         message = template.format(type(ex).__name__, ex.args)
         logging.error(message)
 
+
+def get_desktop_packages(packages_xml, desktop):
+    """ Returns all package names listed in packages_xml for a desktop
+        (node attributes are ignored, so it's a superset of what Cnchi
+        would install) """
+    pkg_names = []
+    xml_root = eTree.parse(packages_xml).getroot()
+    for editions in xml_root.iter('editions'):
+        for edition in editions.iter('edition'):
+            name = edition.attrib.get('name').lower()
+            if name in ['common', 'graphic', desktop]:
+                for pkg in edition.iter('pkgname'):
+                    if pkg.text not in pkg_names:
+                        pkg_names.append(pkg.text)
+    return pkg_names
+
+
+def benchmark(packages_xml, desktops=None, pacman_conf_file="/etc/pacman.conf"):
+    """ Compares dependency resolution times using pyalpm.find_satisfier
+        and using our provider indexes """
+    import installation.pacman.pac as pac
+
+    if desktops is None:
+        desktops = ['gnome', 'kde']
+
+    pacman = pac.Pac(conf_path=pacman_conf_file, callback_queue=None)
+
+    for desktop in desktops:
+        pkg_names = get_desktop_packages(packages_xml, desktop)
+        options = ["--conf", pacman_conf_file, "--noconfirm", "--all-deps"]
+        options.extend(pkg_names)
+        for use_index in [False, True]:
+            # Start each run with empty indexes, so building them is measured too
+            pacman.provider_indexes.clear()
+            start = time.time()
+            download_queue, _not_found, _missing_deps = build_download_queue(
+                pacman, args=options, use_index=use_index)
+            elapsed = time.time() - start
+            print("{0}: {1} packages ({2} to download) resolved in {3:.3f}s ({4})".format(
+                desktop,
+                len(pkg_names),
+                len(download_queue.sync_pkgs),
+                elapsed,
+                "provider index" if use_index else "find_satisfier"))
+
+    pacman.release()
+    del pacman
+
 ''' Test case '''
 if __name__ == '__main__':
-    test()
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        benchmark(packages_xml="/usr/share/cnchi/data/packages.xml")
+    else:
+        test()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mirror_health.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Keeps track of how well each mirror works while downloading packages """
+
+import logging
+import threading
+import time
+import urllib.parse
+
+# Consecutive failures needed to stop using a mirror
+MAX_FAILURES = 3
+
+# Seconds a failing mirror is not used
+COOLDOWN = 120
+
+# Penalties used to demote mirrors when sorting urls
+BROKEN_PENALTY = 10000
+FAILURE_PENALTY = 25
+SLOW_PENALTY = 10
+
+# A mirror is slow if its throughput is below this fraction of the best one
+SLOW_FRACTION = 0.25
+
+# Rank of mirrors that are not in the ranked mirror list
+UNRANKED = 9999
+
+
+class MirrorStats(object):
+    """ Measurements of one mirror """
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.latency = None
+        self.broken_until = 0
+
+    @property
+    def throughput(self):
+        """ Average throughput in bytes per second """
+        if self.seconds > 0:
+            return self.bytes / self.seconds
+        return None
+
+
+class MirrorHealth(object):
+    """ Stores latency, throughput and failures of each mirror host.
+        Mirrors that fail too many times in a row are not used for a while
+        (circuit breaker), so a dead mirror only costs us a few failed
+        requests instead of one for each package. """
+
+    def __init__(self, max_failures=MAX_FAILURES, cooldown=COOLDOWN):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.best_throughput = 0
+        self.best_host = None
+        # Position of each mirror host in the ranked mirror list
+        self.ranks = {}
+
+    @staticmethod
+    def get_host(url):
+        """ Returns the host part of an url """
+        # Fast path for the usual scheme://host/path urls,
+        # this is called for every url of every package
+        parts = url.split('/', 3)
+        if len(parts) > 2 and parts[0].endswith(':') and not parts[1]:
+            return parts[2]
+        return urllib.parse.urlsplit(url).netloc
+
+    def set_ranking(self, urls):
+        """ Stores the ranked mirror list (best first), indexed by host """
+        ranks = {}
+        for rank, url in enumerate(urls):
+            if url:
+                ranks.setdefault(self.get_host(url), rank)
+        self.ranks = ranks
+
+    def get_rank(self, url):
+        """ Returns the position of url's mirror in the ranked list """
+        return self.ranks.get(self.get_host(url), UNRANKED)
+
+    def priority(self, url):
+        """ Returns url's priority (lower is better): its mirror's rank
+            plus the penalty earned in this run """
+        host = self.get_host(url)
+        return self.ranks.get(host, UNRANKED) + self.get_host_penalty(host)
+
+    def get_stats(self, url):
+        """ Returns the stats object of url's mirror. Lock must be held. """
+        host = self.get_host(url)
+        if host not in self.stats:
+            self.stats[host] = MirrorStats()
+        return self.stats[host]
+
+    def update_best_throughput(self, host, throughput):
+        """ Keeps the best throughput up to date. Lock must be held. """
+        if throughput >= self.best_throughput:
+            self.best_throughput = throughput
+            self.best_host = host
+        elif host == self.best_host:
+            # The best mirror got slower, another one may be the best now
+            self.best_host, best = max(
+                ((name, mirror.throughput or 0) for name, mirror in self.stats.items()),
+                key=lambda item: item[1])
+            self.best_throughput = best
+
+    def record_success(self, url, num_bytes, seconds, latency=None):
+        """ A file has been downloaded from url """
+        with self.lock:
+            stats = self.get_stats(url)
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            stats.broken_until = 0
+            stats.bytes += num_bytes
+            stats.seconds += seconds
+            self.update_best_throughput(self.get_host(url), stats.throughput or 0)
+            if latency is not None:
+                if stats.latency is None:
+                    stats.latency = latency
+                else:
+                    # Exponential moving average
+                    stats.latency = 0.8 * stats.latency + 0.2 * latency
+
+    def record_failure(self, url):
+        """ Downloading from url has failed """
+        with self.lock:
+            stats = self.get_stats(url)
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.max_failures:
+                if not stats.broken_until:
+                    logging.debug(
+                        "Mirror %s failed %d times in a row, it won't be used for %d seconds",
+                        self.get_host(url),
+                        stats.consecutive_failures,
+                        self.cooldown)
+                stats.broken_until = time.monotonic() + self.cooldown
+
+    def is_available(self, url):
+        """ Returns False if the mirror has been failing lately """
+        with self.lock:
+            stats = self.stats.get(self.get_host(url))
+            return stats is None or stats.broken_until <= time.monotonic()
+
+    def penalty(self, url):
+        """ Returns a number to add to the url's priority (bigger is worse)
+            based on how the mirror has been working in this run """
+        return self.get_host_penalty(self.get_host(url))
+
+    def get_host_penalty(self, host):
+        """ Returns the penalty of a mirror host """
+        with self.lock:
+            stats = self.stats.get(host)
+            if stats is None:
+                # Nothing downloaded from this mirror yet
+                return 0
+
+            penalty = FAILURE_PENALTY * stats.consecutive_failures
+
+            if stats.broken_until > time.monotonic():
+                penalty += BROKEN_PENALTY
+
+            throughput = stats.throughput
+            if throughput and throughput < SLOW_FRACTION * self.best_throughput:
+                penalty += SLOW_PENALTY
+
+            return penalty
+
+    def sort_urls(self, urls):
+        """ Sorts urls by mirror health. As the sort is stable,
+            mirrors with the same health keep their previous order """
+        return sorted(urls, key=self.penalty)
+
+    def log_stats(self):
+        """ Logs all mirror measurements """
+        with self.lock:
+            for host, stats in sorted(self.stats.items()):
+                throughput = stats.throughput or 0
+                logging.debug(
+                    "Mirror %s: %d ok, %d failed, %.2f KiB/s",
+                    host,
+                    stats.successes,
+                    stats.failures,
+                    throughput / 1024.0)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# segmented.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Downloads a big file in segments (HTTP ranges) from several mirrors at once """
+
+import io
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent import futures
+
+import requests
+
+import misc.http_session as http_session
+
+# Files smaller than this are downloaded in one piece
+MIN_SIZE = 32 * 1024 * 1024
+
+# Size of each range request
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+# Max number of mirrors used at the same time for one file
+MAX_WORKERS = 4
+
+# Data is written to disk in blocks of this size (memory used by each worker)
+BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSupported(Exception):
+    """ Mirror ignores our range requests """
+    pass
+
+
+class SegmentedDownload(object):
+    """ Splits a file in segments that are downloaded from different
+        mirrors at the same time and written in place (using pwrite) into
+        a preallocated file. Each worker only keeps BLOCK_SIZE bytes in
+        memory, whatever the size of the file is. """
+
+    def __init__(self, urls, dst_path, total_length, mirror_slots,
+                 mirror_health, abort, progress_callback=None,
+                 max_workers=MAX_WORKERS, segment_size=SEGMENT_SIZE):
+        self.urls = list(urls)
+        self.dst_path = dst_path
+        self.total_length = total_length
+        self.mirror_slots = mirror_slots
+        self.mirror_health = mirror_health
+        self.abort = abort
+        self.progress_callback = progress_callback
+        self.max_workers = max(1, min(max_workers, len(self.urls)))
+        self.segment_size = segment_size
+
+        self.lock = threading.Lock()
+        # Segments not downloaded yet (start, end) both included
+        self.segments = queue.Queue()
+        # Urls that must not be used anymore for this file
+        self.bad_urls = set()
+        self.failed = threading.Event()
+
+    def get_segments(self):
+        """ Splits the file in segments """
+        segments = []
+        start = 0
+        while start < self.total_length:
+            end = min(start + self.segment_size, self.total_length) - 1
+            segments.append((start, end))
+            start = end + 1
+        return segments
+
+    def preallocate(self):
+        """ Creates the destination file with its final size """
+        with open(self.dst_path, 'wb') as dst_file:
+            try:
+                os.posix_fallocate(dst_file.fileno(), 0, self.total_length)
+            except (AttributeError, OSError):
+                # Filesystem does not support fallocate
+                dst_file.truncate(self.total_length)
+
+    def good_urls(self, first):
+        """ Returns usable urls, starting with the one at index first
+            so each worker prefers a different mirror """
+        with self.lock:
+            urls = [url for url in self.urls if url not in self.bad_urls]
+        if not urls:
+            return urls
+        first = first % len(urls)
+        return urls[first:] + urls[:first]
+
+    def discard_url(self, url):
+        """ Do not use url again for this file """
+        with self.lock:
+            self.bad_urls.add(url)
+            if len(self.bad_urls) >= len(self.urls):
+                # No mirror left
+                self.failed.set()
+
+    def run(self):
+        """ Downloads the file. Returns True if all segments are downloaded """
+        for segment in self.get_segments():
+            self.segments.put(segment)
+
+        try:
+            self.preallocate()
+            fd = os.open(self.dst_path, os.O_WRONLY)
+        except OSError as os_error:
+            logging.warning("Can't create file %s: %s", self.dst_path, os_error)
+            return False
+
+        start = time.perf_counter()
+        try:
+            with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                workers = [executor.submit(self.worker, fd, index)
+                           for index in range(self.max_workers)]
+                futures.wait(workers)
+        finally:
+            os.close(fd)
+
+        if self.failed.is_set() or self.abort.is_set() or not self.segments.empty():
+            return False
+
+        logging.debug(
+            "%s downloaded in %d segments from %d mirrors in %.2f seconds",
+            os.path.basename(self.dst_path),
+            len(self.get_segments()),
+            self.max_workers,
+            time.perf_counter() - start)
+        return True
+
+    def worker(self, fd, index):
+        """ Downloads segments until there are no more left """
+        while not self.failed.is_set() and not self.abort.is_set():
+            try:
+                segment = self.segments.get_nowait()
+            except queue.Empty:
+                return
+
+            urls = self.good_urls(index)
+            if not urls:
+                self.segments.put(segment)
+                self.failed.set()
+                return
+
+            url = self.mirror_slots.acquire(urls)
+            try:
+                remaining = self.download_segment(url, fd, segment)
+            finally:
+                self.mirror_slots.release(url)
+
+            if remaining is not None:
+                # Put back the part that could not be downloaded,
+                # another mirror will take care of it
+                self.segments.put(remaining)
+
+    def download_segment(self, url, fd, segment):
+        """ Downloads segment from url and writes it in its place.
+            Returns None if the whole segment has been downloaded or the
+            part of the segment that is still missing otherwise """
+        start, end = segment
+        offset = start
+        req = None
+        begin = time.perf_counter()
+        try:
+            req = http_session.get(
+                url,
+                pool_maxsize=self.mirror_slots.max_connections,
+                headers={'Range': 'bytes={0}-{1}'.format(start, end)},
+                stream=True,
+                timeout=30)
+
+            if req.status_code != requests.codes.partial_content:
+                raise RangeNotSupported(
+                    "{0} answered {1} to a range request".format(url, req.status_code))
+
+            latency = time.perf_counter() - begin
+
+            for data in req.iter_content(BLOCK_SIZE):
+                if self.abort.is_set() or self.failed.is_set():
+                    return (offset, end)
+                # Never write outside our segment
+                data = data[:end + 1 - offset]
+                if not data:
+                    break
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+                if self.progress_callback:
+                    self.progress_callback(len(data))
+
+            if offset <= end:
+                raise requests.exceptions.ChunkedEncodingError(
+                    "Segment {0}-{1} from {2} is incomplete".format(start, end, url))
+
+            self.mirror_health.record_success(
+                url,
+                end + 1 - start,
+                time.perf_counter() - begin,
+                latency)
+            return None
+        except RangeNotSupported as range_error:
+            logging.debug(range_error)
+            self.discard_url(url)
+        except (socket.timeout,
+                OSError,
+                requests.exceptions.RequestException) as connection_error:
+            logging.debug(connection_error)
+            self.mirror_health.record_failure(url)
+            self.discard_url(url)
+        finally:
+            if req is not None:
+                req.close()
+
+        return (offset, end)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# staging.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+
+""" Downloads packages to a staging cache on the live system while the
+    disks are being partitioned and formatted """
+
+import logging
+import os
+import shutil
+import threading
+
+import installation.download.download_requests as download_requests
+
+# Extra free space needed in the staging dir (besides the packages' size)
+MIN_FREE_SPACE = 256 * 1024 * 1024
+
+
+def get_free_space(path):
+    """ Returns available bytes in the filesystem where path is """
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def get_total_size(metalinks):
+    """ Returns the size of all packages in metalinks (in bytes) """
+    total_size = 0
+    for element in metalinks.values():
+        try:
+            total_size += int(element['size'])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return total_size
+
+
+class StagedDownload(object):
+    """ Downloads all packages of a metalinks list to staging_dir in
+        a background thread. The installation waits for it to finish and
+        then imports the packages from staging_dir into the pacman cache
+        of the new system (see DownloadPackages). Packages are verified
+        while they download and their hashes are stored in staging_dir's
+        cache index, so they are not read again to be imported """
+
+    def __init__(self, metalinks, staging_dir, settings=None, mirror_health=None):
+        self.metalinks = metalinks
+        self.staging_dir = staging_dir
+
+        max_workers = None
+        max_connections_per_mirror = None
+        xz_cache_dirs = []
+        if settings:
+            xz_cache_dirs = settings.get('xz_cache')
+            max_workers = settings.get('download_threads')
+            max_connections_per_mirror = settings.get('download_connections_per_mirror')
+
+        # No events are sent to the UI, as it is showing the formatting progress
+        self.download = download_requests.Download(
+            staging_dir,
+            xz_cache_dirs,
+            None,
+            max_workers=max_workers or download_requests.MAX_WORKERS,
+            max_connections_per_mirror=(
+                max_connections_per_mirror or download_requests.MAX_CONNECTIONS_PER_MIRROR),
+            mirror_health=mirror_health,
+            index_packages=True)
+
+        self.thread = None
+        self.cancelled = threading.Event()
+        self.result = False
+
+    def has_enough_space(self):
+        """ Checks that all packages fit in the staging dir """
+        needed = get_total_size(self.metalinks) + MIN_FREE_SPACE
+        free = get_free_space(self.staging_dir)
+        if free < needed:
+            logging.warning(
+                "Not enough space in %s to stage packages (%d MiB needed, %d MiB available)",
+                self.staging_dir,
+                needed // (1024 * 1024),
+                free // (1024 * 1024))
+            return False
+        return True
+
+    def start(self):
+        """ Starts downloading in the background.
+            Returns False if packages can't be staged """
+        if not self.has_enough_space():
+            return False
+        logging.debug("Downloading packages to %s while disks are prepared", self.staging_dir)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self):
+        """ Thread function """
+        if self.cancelled.is_set():
+            return
+        try:
+            # Download.start() empties the dict it is given
+            self.result = self.download.start(dict(self.metalinks))
+        except Exception as ex:
+            template = "Can't stage packages. An exception of type {0} occured. Arguments:\n{1!r}"
+            message = template.format(type(ex).__name__, ex.args)
+            logging.error(message)
+            self.result = False
+        logging.debug("Staged download finished (ok: %s)", self.result)
+
+    def wait(self):
+        """ Waits until the staged download finishes.
+            Returns True if all packages were downloaded """
+        if self.thread is not None:
+            self.thread.join()
+        return self.result and not self.cancelled.is_set()
+
+    def cancel(self):
+        """ Stops downloading as soon as possible """
+        self.cancelled.set()
+        self.download.abort.set()
+
+    def cleanup(self):
+        """ Removes staged packages (they should have been imported to
+            the new system by now) """
+        self.cancel()
+        if self.thread is not None:
+            self.thread.join()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
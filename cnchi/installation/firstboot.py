@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# firstboot.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Jobs deferred to the first boot of the installed system """
+
+import logging
+import os
+import threading
+
+from misc.run_cmd import chroot_call
+
+DEST_DIR = "/install"
+
+UNIT_NAME = "cnchi-firstboot.service"
+
+# Jobs that can be done after the installation (their commands)
+JOBS = {
+    'mandb': ['/usr/bin/mandb', '--quiet'],
+    'pkgfile': ['/usr/bin/pkgfile', '--update']}
+
+# Jobs are added from several installation steps (that may run at the same time)
+_LOCK = threading.Lock()
+
+# A failed job must not stop the rest (nor keep the unit enabled)
+EXEC_START = "ExecStart=-"
+
+
+def read_commands(unit_path):
+    """ Returns the commands already in our unit """
+    with open(unit_path) as unit:
+        return [line[len(EXEC_START):].strip()
+                for line in unit if line.startswith(EXEC_START)]
+
+
+def add_commands(commands, dest_dir=DEST_DIR):
+    """ Adds commands to a one-shot systemd unit in the installed system that
+        runs them on its first boot and then disables itself (the unit is
+        created and enabled the first time). Commands run with the lowest
+        priority, so they do not slow down the first login """
+    unit_path = os.path.join(dest_dir, "etc/systemd/system", UNIT_NAME)
+
+    with _LOCK:
+        exists = os.path.exists(unit_path)
+        lines = read_commands(unit_path) if exists else []
+        for cmd in commands:
+            line = ' '.join(cmd)
+            if line not in lines:
+                lines.append(line)
+
+        os.makedirs(os.path.dirname(unit_path), mode=0o755, exist_ok=True)
+        with open(unit_path, 'w') as unit:
+            unit.write("# Jobs deferred by Cnchi to the first boot\n")
+            unit.write("[Unit]\n")
+            unit.write("Description=Finish Antergos installation\n")
+            unit.write("Wants=network-online.target\n")
+            unit.write("After=network-online.target\n\n")
+            unit.write("[Service]\n")
+            unit.write("Type=oneshot\n")
+            unit.write("Nice=19\n")
+            unit.write("IOSchedulingClass=idle\n")
+            for line in lines:
+                unit.write("{0}{1}\n".format(EXEC_START, line))
+            unit.write("ExecStartPost=/usr/bin/systemctl disable {0}\n\n".format(UNIT_NAME))
+            unit.write("[Install]\n")
+            unit.write("WantedBy=multi-user.target\n")
+
+        if not exists:
+            chroot_call(['systemctl', 'enable', UNIT_NAME], chroot_dir=dest_dir)
+
+
+def setup(jobs, dest_dir=DEST_DIR):
+    """ Runs jobs (names in JOBS) on first boot """
+    add_commands([JOBS[job] for job in jobs], dest_dir)
+    logging.debug("Jobs %s will run on first boot", ', '.join(jobs))
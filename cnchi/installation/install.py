@@ -41,10 +41,17 @@ import desktop_info
 import encfs
 import hardware.hardware as hardware
 import installation.pacman.pac as pac
+import installation.pacman.pacman_conf as pacman_conf
+import installation.pacman.session_pool as session_pool
+import installation.pacman.sync_db_cache as sync_db_cache
+import misc.chroot_executor as chroot_executor
 import misc.extra as misc
 from installation import firewall
+from installation import firstboot
 from installation import mkinitcpio
 from installation import special_dirs
+from installation import stream_install
+from installation import task_graph
 from installation.download import download
 from installation.storage import auto_partition
 from misc.extra import InstallError
@@ -73,7 +80,7 @@ class Installation(object):
     """ Installation process thread class """
 
     def __init__(self, settings, callback_queue, packages, metalinks,
-                 mount_devices, fs_devices, ssd=None, blvm=False):
+                 mount_devices, fs_devices, ssd=None, blvm=False, staging=None):
         """ Initialize installation class """
 
         self.settings = settings
@@ -81,6 +88,9 @@ class Installation(object):
         self.packages = packages
         self.metalinks = metalinks
 
+        # Packages being downloaded while formatting (see process.py)
+        self.staging = staging
+
         self.method = self.settings.get('partition_mode')
 
         self.desktop = self.settings.get('desktop').lower()
@@ -279,14 +289,21 @@ class Installation(object):
             message = template.format(type(ex).__name__, ex.args)
             logging.error(message)
 
-        logging.debug("Downloading packages...")
-        self.download_packages()
+        if self.settings.get('install_streaming'):
+            # This mounts (binds) /dev and others to /DEST_DIR/dev and others
+            special_dirs.mount(DEST_DIR)
+
+            logging.debug("Downloading and installing packages...")
+            self.stream_packages()
+        else:
+            logging.debug("Downloading packages...")
+            self.download_packages()
 
-        # This mounts (binds) /dev and others to /DEST_DIR/dev and others
-        special_dirs.mount(DEST_DIR)
+            # This mounts (binds) /dev and others to /DEST_DIR/dev and others
+            special_dirs.mount(DEST_DIR)
 
-        logging.debug("Installing packages...")
-        self.install_packages()
+            logging.debug("Installing packages...")
+            self.install_packages()
 
         logging.debug("Configuring system...")
         self.configure_system()
@@ -334,13 +351,67 @@ class Installation(object):
             pacman_conf_file='/tmp/pacman.conf',
             pacman_cache_dir=self.pacman_cache_dir,
             settings=self.settings,
-            callback_queue=self.callback_queue)
+            callback_queue=self.callback_queue,
+            extra_cache_dirs=self.wait_for_staging())
 
         # Metalinks have already been calculated before,
         # When downloadpackages class has been called in process.py to test
         # that Cnchi was able to create it before partitioning/formatting
         download_packages.start(self.metalinks)
 
+        if self.staging is not None:
+            # All packages are in the new system now, free the staging dir
+            self.staging.cleanup()
+
+    def wait_for_staging(self):
+        """ Packages may have been downloading while formatting.
+            Waits for them and returns the dirs where they are """
+        if self.staging is None:
+            return []
+        self.queue_event('info', _("Waiting for packages to be downloaded..."))
+        if not self.staging.wait():
+            logging.warning("Not all packages could be staged, the rest will be downloaded now")
+        return [self.staging.staging_dir]
+
+    def stream_packages(self):
+        """ Downloads packages and installs them in batches (dependencies
+            first) while the rest are still downloading """
+
+        self.pacman_cache_dir = os.path.join(DEST_DIR, 'var/cache/pacman/pkg')
+
+        for cache_dir in self.settings.get('xz_cache'):
+            self.pacman.add_cachedir(cache_dir)
+
+        streaming = stream_install.StreamingInstall(
+            pacman=self.pacman,
+            packages=self.packages,
+            metalinks=self.metalinks,
+            pacman_cache_dir=self.pacman_cache_dir,
+            settings=self.settings,
+            callback_queue=self.callback_queue,
+            extra_cache_dirs=self.wait_for_staging())
+
+        try:
+            result = streaming.start()
+        except pac.pyalpm.error as pyalpm_error:
+            logging.error(pyalpm_error)
+            result = False
+
+        if self.staging is not None:
+            self.staging.cleanup()
+
+        if result:
+            # Install whatever was not in the metalinks list (if any)
+            missing = streaming.get_missing_targets()
+            if missing:
+                self.install_packages(pkgs=missing)
+            else:
+                self.queue_event('progress_bar', 'hide')
+        else:
+            # Install the rest of the packages as usual
+            logging.warning("Streaming install failed, installing all remaining packages at once")
+            self.install_packages(options={'needed': True})
+
     def create_pacman_conf_file(self):
         """ Creates a temporary pacman.conf """
         myarch = os.uname()[-1]
@@ -365,9 +436,18 @@ class Installation(object):
         self.queue_event('info', msg)
         self.prepare_pacman_keyring()
 
+        # Databases of the live system have just been refreshed. Start with
+        # them, so only the ones that have changed since will be downloaded
+        try:
+            sync_db_cache.seed(
+                pacman_conf.PacmanConfig("/etc/pacman.conf"),
+                pacman_conf.PacmanConfig("/tmp/pacman.conf"))
+        except (OSError, pacman_conf.InvalidSyntax) as err:
+            logging.warning("Can't copy sync databases from the live system: %s", err)
+
         # Init pyalpm
         try:
-            self.pacman = pac.Pac("/tmp/pacman.conf", self.callback_queue)
+            self.pacman = session_pool.get_session("/tmp/pacman.conf", self.callback_queue)
         except Exception as ex:
             self.pacman = None
             template = "Can't initialize pyalpm. An exception of type {0} occured. Arguments:\n{1!r}"
@@ -422,18 +502,21 @@ class Installation(object):
         # cmd = ["pacman-key", "--refresh-keys", "--gpgdir", dest_path]
         # call(cmd)
 
-    def install_packages(self):
-        """ Start pacman installation of packages """
+    def install_packages(self, pkgs=None, options=None):
+        """ Start pacman installation of packages (all of them if
+            pkgs is not given) """
+        if pkgs is None:
+            pkgs = self.packages
         result = False
         # This shouldn't be necessary if download.py really downloaded all
         # needed packages, but it does not do it (why?)
         for cache_dir in self.settings.get('xz_cache'):
-            self.pacman.handle.add_cachedir(cache_dir)
+            self.pacman.add_cachedir(cache_dir)
 
         logging.debug("Installing packages...")
 
         try:
-            result = self.pacman.install(pkgs=self.packages, conflicts=None, options=None)
+            result = self.pacman.install(pkgs=pkgs, conflicts=None, options=options)
         except pac.pyalpm.error:
             pass
 
@@ -452,9 +535,9 @@ class Installation(object):
                             except Exception as err:
                                 logging.error(err)
 
-                self.pacman.refresh()
+                self.pacman.refresh(force=True)
 
-                result = self.pacman.install(pkgs=self.packages)
+                result = self.pacman.install(pkgs=pkgs, options=options)
 
         elif not result and self.settings.get('desktop').lower() in ['cinnamon', 'mate']:
             # Failure might be due to antergos mirror issues. Try using build server repo.
@@ -468,7 +551,7 @@ class Installation(object):
 
                     new_pacman_conf.write(line)
 
-            self.pacman.refresh()
+            self.pacman.refresh(force=True)
 
             result = self.pacman.install(pkgs=self.packages)
 
@@ -1049,25 +1132,8 @@ class Installation(object):
                 zfs_version = file_name.split("-")[1]
         return zfs_version
 
-    def configure_system(self):
-        """ Final install steps
-            Set clock, language, timezone
-            Run mkinitcpio
-            Populate pacman keyring
-            Setup systemd services
-            ... and more """
-
-        self.queue_event('pulse', 'start')
-        self.queue_event('info', _("Configuring your new system"))
-
-        self.auto_fstab()
-        logging.debug("fstab file generated.")
-
-        # If SSD was detected copy udev rule for deadline scheduler
-        if self.ssd:
-            self.set_scheduler()
-            logging.debug("SSD udev rule copied successfully")
-
+    def setup_network(self):
+        """ Configures network in the installed system """
         # Copy configured networks in Live medium to target system
         if self.settings.get("network_manager") == "NetworkManager":
             self.copy_network_config()
@@ -1086,7 +1152,9 @@ class Installation(object):
 
         logging.debug("Network configuration done.")
 
-        # Copy mirror list
+    @staticmethod
+    def copy_mirrorlist():
+        """ Copies mirror list to the installed system """
         mirrorlist_src_path = '/etc/pacman.d/mirrorlist'
         mirrorlist_dst_path = os.path.join(DEST_DIR, 'etc/pacman.d/mirrorlist')
         try:
@@ -1099,12 +1167,8 @@ class Installation(object):
         except FileExistsError:
             logging.warning("File %s already exists.", mirrorlist_dst_path)
 
-        # Add Antergos repo to /etc/pacman.conf
-        self.update_pacman_conf()
-
-        logging.debug("pacman.conf has been created successfully")
-
-        # Enable some useful services
+    def enable_default_services(self):
+        """ Enable some useful services """
         services = []
 
         if self.desktop != "base":
@@ -1120,41 +1184,42 @@ class Installation(object):
 
         self.enable_services(services)
 
-        # Enable timesyncd service
-        if self.settings.get("use_timesyncd"):
-            timesyncd_path = os.path.join(
-                DEST_DIR,
-                "etc/systemd/timesyncd.conf")
-            try:
-                with open(timesyncd_path, 'w') as timesyncd:
-                    timesyncd.write("[Time]\n")
-                    timesyncd.write("NTP=0.arch.pool.ntp.org 1.arch.pool.ntp.org "
-                                    "2.arch.pool.ntp.org 3.arch.pool.ntp.org\n")
-                    timesyncd.write("FallbackNTP=0.pool.ntp.org 1.pool.ntp.org "
-                                    "0.fr.pool.ntp.org\n")
-            except FileNotFoundError as err:
-                logging.warning("Can't find %s file.", timesyncd_path)
-            chroot_call(['timedatectl', 'set-ntp', 'true'])
-
-        # Set timezone
+    def setup_timesyncd(self):
+        """ Enable timesyncd service """
+        if not self.settings.get("use_timesyncd"):
+            return
+
+        timesyncd_path = os.path.join(
+            DEST_DIR,
+            "etc/systemd/timesyncd.conf")
+        try:
+            with open(timesyncd_path, 'w') as timesyncd:
+                timesyncd.write("[Time]\n")
+                timesyncd.write("NTP=0.arch.pool.ntp.org 1.arch.pool.ntp.org "
+                                "2.arch.pool.ntp.org 3.arch.pool.ntp.org\n")
+                timesyncd.write("FallbackNTP=0.pool.ntp.org 1.pool.ntp.org "
+                                "0.fr.pool.ntp.org\n")
+        except FileNotFoundError as err:
+            logging.warning("Can't find %s file.", timesyncd_path)
+        chroot_call(['timedatectl', 'set-ntp', 'true'])
+
+    def set_timezone(self):
+        """ Set timezone """
         zoneinfo_path = os.path.join(
             "/usr/share/zoneinfo",
             self.settings.get("timezone_zone"))
         chroot_call(['ln', '-s', zoneinfo_path, "/etc/localtime"])
         logging.debug("Timezone set.")
 
-        # Wait FOREVER until the user sets his params
+    def wait_for_user_info(self):
+        """ Wait FOREVER until the user sets his params """
         # FIXME: We can wait here forever!
-        while self.settings.get('user_info_done') is False:
-            # Wait five seconds and try again
-            time.sleep(5)
+        # (we are woken up as soon as the user_info page stores them)
+        self.settings.wait_for('user_info_done', True)
 
-        # Set user parameters
+    def setup_sudoers(self):
+        """ Allows our user to use sudo """
         username = self.settings.get('username')
-        fullname = self.settings.get('fullname')
-        password = self.settings.get('password')
-        hostname = self.settings.get('hostname')
-
         sudoers_dir = os.path.join(DEST_DIR, "etc/sudoers.d")
         if not os.path.exists(sudoers_dir):
             os.mkdir(sudoers_dir, 0o710)
@@ -1169,7 +1234,8 @@ class Installation(object):
             # Something bad must be happening, though.
             logging.error(io_error)
 
-        # Configure detected hardware
+    def setup_hardware(self):
+        """ Configure detected hardware """
         # NOTE: Because hardware can need extra repos, this code must run
         # always after having called the update_pacman_conf method
         if self.hardware_install:
@@ -1181,7 +1247,11 @@ class Installation(object):
                 message = template.format(type(ex).__name__, ex.args)
                 logging.error(message)
 
-        # Setup user
+    def setup_user(self):
+        """ Creates our user and sets user and root passwords """
+        username = self.settings.get('username')
+        fullname = self.settings.get('fullname')
+        password = self.settings.get('password')
 
         default_groups = 'wheel'
 
@@ -1214,7 +1284,13 @@ class Installation(object):
         cmd = ['chown', '-R', '{0}:users'.format(username), home_dir]
         chroot_call(cmd)
 
-        # Set hostname
+        # User password is the root password
+        self.change_user_password('root', password)
+        logging.debug("Set the same password to root.")
+
+    def set_hostname(self):
+        """ Set hostname """
+        hostname = self.settings.get('hostname')
         hostname_path = os.path.join(DEST_DIR, "etc/hostname")
         if not os.path.exists(hostname_path):
             with open(hostname_path, "w") as hostname_file:
@@ -1222,11 +1298,8 @@ class Installation(object):
 
         logging.debug("Hostname set to %s", hostname)
 
-        # User password is the root password
-        self.change_user_password('root', password)
-        logging.debug("Set the same password to root.")
-
-        # Generate locales
+    def generate_locales(self):
+        """ Generate locales """
         locale = self.settings.get("locale")
         self.queue_event('info', _("Generating locales..."))
         self.uncomment_locale_gen(locale)
@@ -1240,9 +1313,8 @@ class Installation(object):
         # with open(environment_path, "w") as environment:
         #    environment.write('LANG={0}\n'.format(locale))
 
-        self.queue_event('info', _("Adjusting hardware clock..."))
-        self.auto_timesetting()
-
+    def set_keymap(self):
+        """ Configures keyboard for X and the console """
         self.queue_event('info', _("Configuring keymap..."))
 
         if self.desktop != "base":
@@ -1250,12 +1322,9 @@ class Installation(object):
 
         self.set_vconsole_conf()
 
-        # Install configs for root
-        chroot_call(['cp', '-av', '/etc/skel/.', '/root/'])
-
-        self.queue_event('info', _("Configuring hardware..."))
-
-        # Copy generated xorg.conf to target
+    @staticmethod
+    def copy_xorg_conf():
+        """ Copy generated xorg.conf to target """
         if os.path.exists("/etc/X11/xorg.conf"):
             src = "/etc/X11/xorg.conf"
             dst = os.path.join(DEST_DIR, 'etc/X11/xorg.conf')
@@ -1269,24 +1338,25 @@ class Installation(object):
         #if os.path.exists(os.path.join(DEST_DIR, "usr/bin/pulseaudio-ctl")):
         #    chroot_run(['pulseaudio-ctl', 'normal'])
 
-        # Set fluidsynth audio system (in our case, pulseaudio)
-        self.set_fluidsynth()
-        logging.debug("Updated fluidsynth configuration file")
-
-        # Workaround for pacman-key bug FS#45351
-        # https://bugs.archlinux.org/task/45351
-        # We have to kill gpg-agent because if it stays around we can't
-        # reliably unmount the target partition.
+    @staticmethod
+    def stop_gpg_agent():
+        """ Workaround for pacman-key bug FS#45351
+            https://bugs.archlinux.org/task/45351
+            We have to kill gpg-agent because if it stays around we can't
+            reliably unmount the target partition. """
         logging.debug("Stopping gpg agent...")
         chroot_call(['killall', '-9', 'gpg-agent'])
 
-        # FIXME: Temporary workaround for spl and zfs packages
+    def install_zfs_modules(self):
+        """ FIXME: Temporary workaround for spl and zfs packages """
         if self.method == "zfs":
             zfs_version = self.get_zfs_version()
             logging.debug("Installing zfs modules v%s...", zfs_version)
             chroot_call(['dkms', 'install', 'spl/{0}'.format(zfs_version)])
             chroot_call(['dkms', 'install', 'zfs/{0}'.format(zfs_version)])
 
+    def run_mkinitcpio(self):
+        """ Creates the initial ramdisk images """
         # Let's start without using hwdetect for mkinitcpio.conf.
         # It should work out of the box most of the time.
         # This way we don't have to fix deprecated hooks.
@@ -1294,10 +1364,11 @@ class Installation(object):
         self.queue_event('info', _("Configuring System Startup..."))
         mkinitcpio.run(DEST_DIR, self.settings, self.mount_devices, self.blvm)
 
+    def run_postinstall(self):
+        """ Call post-install script to fine tune our setup """
         logging.debug("Running Cnchi post-install script")
         keyboard_layout = self.settings.get("keyboard_layout")
         keyboard_variant = self.settings.get("keyboard_variant")
-        # Call post-install script to fine tune our setup
         script_path_postinstall = os.path.join(
             self.settings.get('cnchi'),
             "scripts",
@@ -1305,10 +1376,10 @@ class Installation(object):
         cmd = [
             "/usr/bin/bash",
             script_path_postinstall,
-            username,
+            self.settings.get('username'),
             DEST_DIR,
             self.desktop,
-            locale,
+            self.settings.get("locale"),
             str(self.vbox),
             keyboard_layout]
         # Keyboard variant is optional
@@ -1318,25 +1389,16 @@ class Installation(object):
         call(cmd, timeout=300)
         logging.debug("Post install script completed successfully.")
 
-        # Patch user-dirs-update-gtk.desktop
-        self.patch_user_dirs_update_gtk()
-        logging.debug("File user-dirs-update-gtk.desktop patched.")
-
-        # Set lightdm config including autologin if selected
-        if self.desktop != "base":
-            self.setup_display_manager()
-
-        # Configure user features (firewall, libreoffice language pack, ...)
-        self.setup_features()
-
-        # Encrypt user's home directory if requested
+    def encrypt_home(self):
+        """ Encrypt user's home directory if requested """
         # FIXME: This is not working atm
         if self.settings.get('encrypt_home'):
             self.queue_event('info', _("Encrypting user home dir..."))
-            encfs.setup(username, DEST_DIR)
+            encfs.setup(self.settings.get('username'), DEST_DIR)
             logging.debug("User home dir encrypted")
 
-        # Install boot loader (always after running mkinitcpio)
+    def install_bootloader(self):
+        """ Install boot loader (always after running mkinitcpio) """
         if self.settings.get('bootloader_install'):
             try:
                 self.queue_event('info', _("Installing bootloader..."))
@@ -1351,14 +1413,114 @@ class Installation(object):
                 message = template.format(type(ex).__name__, ex.args)
                 logging.error(message)
 
-        # Create an initial database for mandb
+    def update_mandb(self):
+        """ Create an initial database for mandb """
         self.queue_event('info', _("Updating man pages..."))
         chroot_call(["mandb", "--quiet"])
 
-        # Initialise pkgfile (pacman .files metadata explorer) database
+    @staticmethod
+    def update_pkgfile():
+        """ Initialise pkgfile (pacman .files metadata explorer) database """
         logging.debug("Updating pkgfile database")
         chroot_call(["pkgfile", "--update"])
 
+    @staticmethod
+    def defer_jobs():
+        """ mandb and pkgfile databases will be created on first boot """
+        firstboot.setup(['mandb', 'pkgfile'], DEST_DIR)
+
+    def create_configure_tasks(self):
+        """ Returns the graph of steps needed to configure the new system.
+            Each step declares what it reads (requires) and what it writes
+            (provides). Steps that share something keep the order they are
+            added in, the rest run at the same time. """
+        tasks = task_graph.TaskGraph()
+
+        tasks.add('fstab', self.auto_fstab, provides=['fstab'])
+        if self.ssd:
+            # If SSD was detected copy udev rule for deadline scheduler
+            tasks.add('scheduler', self.set_scheduler, provides=['udev'])
+        tasks.add('network', self.setup_network, provides=['network', 'services'])
+        tasks.add('mirrorlist', self.copy_mirrorlist, provides=['mirrorlist'])
+        # Add Antergos repo to /etc/pacman.conf
+        tasks.add('pacman_conf', self.update_pacman_conf, provides=['pacman_conf'])
+        if self.settings.get('deferred_jobs') == 'firstboot':
+            tasks.add('firstboot', self.defer_jobs, provides=['services'])
+        else:
+            # Added first, so they start now and run in the background while
+            # the rest of the steps (bootloader included) are done
+            tasks.add('mandb', self.update_mandb, provides=['mandb'])
+            tasks.add('pkgfile', self.update_pkgfile,
+                      requires=['pacman_conf', 'mirrorlist'], provides=['pkgfile'])
+        tasks.add('services', self.enable_default_services, provides=['services'])
+        tasks.add('timesyncd', self.setup_timesyncd, provides=['services'])
+        tasks.add('timezone', self.set_timezone, provides=['localtime'])
+        tasks.add('user_info', self.wait_for_user_info, provides=['user_info'])
+        tasks.add('sudoers', self.setup_sudoers,
+                  requires=['user_info'], provides=['sudoers'])
+        tasks.add('hardware', self.setup_hardware,
+                  requires=['pacman_conf'],
+                  provides=['hardware', 'services', 'xorg', 'modules'])
+        tasks.add('user', self.setup_user,
+                  requires=['user_info'], provides=['user', 'home', 'services'])
+        tasks.add('hostname', self.set_hostname,
+                  requires=['user_info'], provides=['hostname'])
+        # Locales are never deferred: the display manager and the first
+        # session would start before they are generated (without them)
+        tasks.add('locales', self.generate_locales, provides=['locale'])
+        tasks.add('hwclock', self.auto_timesetting,
+                  requires=['localtime'], provides=['adjtime'])
+        tasks.add('keymap', self.set_keymap, provides=['keymap', 'xorg'])
+        # Install configs for root
+        tasks.add('root_skel', lambda: chroot_call(['cp', '-av', '/etc/skel/.', '/root/']),
+                  requires=['skel'], provides=['root_home'])
+        tasks.add('xorg_conf', self.copy_xorg_conf, provides=['xorg'])
+        # Set fluidsynth audio system (in our case, pulseaudio)
+        tasks.add('fluidsynth', self.set_fluidsynth, provides=['fluidsynth'])
+        tasks.add('gpg_agent', self.stop_gpg_agent, provides=['gpg_agent'])
+        tasks.add('zfs_modules', self.install_zfs_modules, provides=['modules'])
+        tasks.add('mkinitcpio', self.run_mkinitcpio,
+                  requires=['fstab', 'keymap', 'hardware', 'modules'],
+                  provides=['initramfs'])
+        # postinstall.sh changes lots of files (lightdm, xorg, skel, home...)
+        tasks.add('postinstall', self.run_postinstall,
+                  requires=['user', 'locale', 'keymap'],
+                  provides=['home', 'skel', 'xorg', 'display_manager', 'etc'])
+        tasks.add('user_dirs', self.patch_user_dirs_update_gtk, provides=['user_dirs'])
+        if self.desktop != "base":
+            # Set lightdm config including autologin if selected
+            tasks.add('display_manager', self.setup_display_manager,
+                      requires=['user'], provides=['display_manager'])
+        # Configure user features (firewall, libreoffice language pack, ...)
+        tasks.add('features', self.setup_features,
+                  requires=['pacman_conf', 'network'], provides=['services', 'features'])
+        tasks.add('encrypt_home', self.encrypt_home,
+                  requires=['user'], provides=['home'])
+        tasks.add('bootloader', self.install_bootloader,
+                  requires=['fstab', 'initramfs', 'locale', 'keymap', 'hardware', 'etc'],
+                  provides=['bootloader'])
+
+        return tasks
+
+    def configure_system(self):
+        """ Final install steps
+            Set clock, language, timezone
+            Run mkinitcpio
+            Populate pacman keyring
+            Setup systemd services
+            ... and more """
+
+        self.queue_event('pulse', 'start')
+        self.queue_event('info', _("Configuring your new system"))
+
+        # Enter the chroot once (instead of once for each command we run)
+        chroot_executor.start(DEST_DIR, helpers=task_graph.MAX_WORKERS)
+        try:
+            self.create_configure_tasks().run()
+        finally:
+            # Helpers keep DEST_DIR busy, they must be gone before unmounting it
+            chroot_executor.stop(DEST_DIR)
+
         # Copy installer log to the new installation
         logging.debug("Copying install log to /var/log.")
         self.copy_log()
@@ -29,11 +29,17 @@
 
 """ Module to setup and run mkinitcpio """
 
+import concurrent.futures
 import logging
 import os
+import shlex
+import time
 
+from installation import firstboot
 from misc.run_cmd import chroot_call
 
+PRESETS_DIR = "etc/mkinitcpio.d"
+
 
 def run(dest_dir, settings, mount_devices, blvm):
     """ Runs mkinitcpio """
@@ -97,13 +103,116 @@ def run(dest_dir, settings, mount_devices, blvm):
     set_hooks_and_modules(dest_dir, hooks, modules)
 
     # Run mkinitcpio on the target system
+    kernels = ['linux']
+    if settings.get('feature_lts'):
+        kernels.append('linux-lts')
+    build_images(dest_dir, kernels, settings.get('locale'),
+                 settings.get('mkinitcpio_fallback') or 'build')
+
+
+class Image(object):
+    """ An initramfs image of a kernel preset """
+
+    def __init__(self, kernel, preset, path, cmd):
+        self.kernel = kernel
+        self.preset = preset
+        self.path = path
+        # mkinitcpio command that builds this image
+        self.cmd = cmd
+
+    def __str__(self):
+        return "{0} ({1})".format(self.kernel, self.preset)
+
+
+def parse_preset(path):
+    """ Reads the variables of a mkinitcpio preset file (a bash script
+        with simple assignments) """
+    values = {}
+    with open(path) as preset_file:
+        for line in preset_file:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            value = value.strip()
+            if value.startswith('(') and value.endswith(')'):
+                values[key] = shlex.split(value[1:-1])
+            else:
+                values[key] = ' '.join(shlex.split(value))
+    return values
+
+
+def get_images(dest_dir, kernel):
+    """ Returns the images that 'mkinitcpio -p kernel' would build """
+    values = parse_preset(os.path.join(dest_dir, PRESETS_DIR, kernel + ".preset"))
+    images = []
+    for preset in values.get('PRESETS', []):
+        kver = values.get(preset + '_kver', values.get('ALL_kver'))
+        config = values.get(preset + '_config', values.get('ALL_config', '/etc/mkinitcpio.conf'))
+        path = values.get(preset + '_image')
+        if not kver or not path:
+            raise ValueError("Preset {0} of {1} has no kernel or image".format(preset, kernel))
+        cmd = ['/usr/bin/mkinitcpio', '-k', kver, '-c', config, '-g', path]
+        cmd.extend(shlex.split(values.get(preset + '_options', '')))
+        images.append(Image(kernel, preset, path, cmd))
+    return images
+
+
+def get_default_images(kernel):
+    """ Returns the images of Arch's default kernel preset (used when the
+        kernel preset can't be read) """
+    kver = '/boot/vmlinuz-{0}'.format(kernel)
+    images = []
+    for preset, suffix, options in [('default', '', []),
+                                    ('fallback', '-fallback', ['-S', 'autodetect'])]:
+        path = '/boot/initramfs-{0}{1}.img'.format(kernel, suffix)
+        cmd = ['/usr/bin/mkinitcpio', '-k', kver, '-c', '/etc/mkinitcpio.conf', '-g', path]
+        images.append(Image(kernel, preset, path, cmd + options))
+    return images
+
+
+def build_image(dest_dir, image, locale):
+    """ Builds one image. Returns True if it has been built """
+    host_path = os.path.join(dest_dir, image.path.lstrip('/'))
+    start = time.time()
     # Fix for bsdcpio error. See: http://forum.antergos.com/viewtopic.php?f=5&t=1378&start=20#p5450
-    locale = settings.get('locale')
-    cmd = ['sh', '-c', 'LANG={0} /usr/bin/mkinitcpio -p linux'.format(locale)]
+    cmd = ['env', 'LANG={0}'.format(locale)] + image.cmd
     chroot_call(cmd, dest_dir)
-    if settings.get('feature_lts'):
-        cmd = ['sh', '-c', 'LANG={0} /usr/bin/mkinitcpio -p linux-lts'.format(locale)]
-        chroot_call(cmd, dest_dir)
+    built = os.path.exists(host_path) and os.path.getmtime(host_path) >= int(start)
+    logging.debug("mkinitcpio: image %s %s in %.2fs", image,
+                  "built" if built else "failed", time.time() - start)
+    return built
+
+
+def build_images(dest_dir, kernels, locale, fallback='build'):
+    """ Builds the images of all kernel presets at the same time.
+        fallback can be 'build', 'skip' or 'firstboot' (build the fallback
+        images on the first boot of the installed system) """
+    images = []
+    for kernel in kernels:
+        try:
+            images.extend(get_images(dest_dir, kernel))
+        except (OSError, ValueError) as err:
+            logging.warning(
+                "Can't read mkinitcpio preset of %s (%s), using the default one",
+                kernel, err)
+            images.extend(get_default_images(kernel))
+
+    if fallback != 'build':
+        deferred = [image for image in images if image.preset == 'fallback']
+        images = [image for image in images if image.preset != 'fallback']
+        if fallback == 'firstboot' and deferred:
+            firstboot.add_commands([image.cmd for image in deferred], dest_dir)
+            logging.debug("mkinitcpio: fallback images will be built on first boot")
+
+    if not images:
+        return
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(images)) as executor:
+        results = list(executor.map(lambda image: build_image(dest_dir, image, locale), images))
+    logging.debug("mkinitcpio: %d of %d images built in %.2fs",
+                  results.count(True), len(images), time.time() - start)
 
 
 def set_hooks_and_modules(dest_dir, hooks, modules):
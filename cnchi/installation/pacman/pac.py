@@ -50,6 +50,8 @@ except NameError:
 from installation import pacman as alpm
 import installation.pacman.pkginfo as pkginfo
 import installation.pacman.pacman_conf as config
+from installation.pacman.provider_index import ProviderIndex
+import installation.pacman.sync_db_cache as sync_db_cache
 
 try:
     import pyalpm
@@ -85,8 +87,22 @@ class Pac:
         # Store package total download size
         self.total_download_size = 0
 
+        # When packages are installed in several transactions, cb_progress
+        # shows progress over all of them (see set_progress_range)
+        self.progress_offset = 0
+        self.progress_total = 0
+
         self.last_event = {}
 
+        # Provider indexes of the alpm databases (see get_provider_index)
+        self.provider_indexes = {}
+
+        # State of the sync db files after our last refresh (see refresh)
+        self.synced_dbs = None
+
+        # Cache dirs added with add_cachedir (kept when the handle is recreated)
+        self.extra_cachedirs = []
+
         if not os.path.exists(conf_path):
             raise pyalpm.error
 
@@ -124,6 +140,9 @@ class Pac:
         if self.config is not None:
             self.config.apply(self.handle)
 
+        for cache_dir in self.extra_cachedirs:
+            self.handle.add_cachedir(cache_dir)
+
         # Set callback functions
         # Callback used for logging
         self.handle.logcb = self.cb_log
@@ -140,8 +159,25 @@ class Pac:
         # Downloading callback
         self.handle.fetchcb = None
 
+    def add_cachedir(self, cache_dir):
+        """ Adds a package cache dir (besides the ones in pacman.conf) """
+        if cache_dir not in self.extra_cachedirs:
+            self.extra_cachedirs.append(cache_dir)
+            self.handle.add_cachedir(cache_dir)
+
+    def get_provider_index(self, database):
+        """ Returns the provider index of a pyalpm database. It's built the
+            first time it's needed and reused until a transaction (that
+            may change the databases) is started """
+        index = self.provider_indexes.get(database.name)
+        if index is None:
+            index = ProviderIndex(database.pkgcache)
+            self.provider_indexes[database.name] = index
+        return index
+
     def release(self):
         """ Release alpm handle """
+        self.provider_indexes.clear()
         if self.handle is not None:
             del self.handle
             self.handle = None
@@ -173,6 +209,9 @@ class Pac:
 
         transaction = None
 
+        # Databases will change, our indexes won't be valid anymore
+        self.provider_indexes.clear()
+
         try:
             transaction = self.handle.init_transaction(
                 nodeps=options.get('nodeps', False),
@@ -219,62 +258,94 @@ class Pac:
 
         return self.finalize_transaction(transaction)
 
-    def refresh(self):
-        """ Sync databases like pacman -Sy """
+    def get_syncdbs_state(self):
+        """ Returns modification time and size of each sync db file
+            (None if the file does not exist) """
+        sync_dir = os.path.join(self.config.options["DBPath"], "sync")
+        state = {}
+        for database in self.handle.get_syncdbs():
+            path = os.path.join(sync_dir, database.name + ".db")
+            try:
+                stat = os.stat(path)
+                state[database.name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                state[database.name] = None
+        return state
+
+    def refresh(self, force=False):
+        """ Sync databases like pacman -Sy
+            Databases already refreshed by us are not checked again if
+            their files have not changed since then, and they are only
+            downloaded if they have changed in the server (see sync_db_cache).
+            If force is True all databases are downloaded again, like
+            pacman -Syy """
         if self.handle is None:
             logging.error("alpm is not initialised")
             raise pyalpm.error
 
-        force = True
+        if not force and self.synced_dbs is not None:
+            state = self.get_syncdbs_state()
+            if None not in state.values() and state == self.synced_dbs:
+                logging.debug("Sync databases have not changed since our last refresh")
+                return True
+
         res = True
+        changed = False
+        db_cache = sync_db_cache.SyncDbCache(self.config.options["DBPath"])
         for database in self.handle.get_syncdbs():
-            transaction = self.init_transaction()
-            if transaction:
-                database.update(force)
-                transaction.release()
-            else:
-                res = False
+            # Only download databases that have changed in the server
+            updated = db_cache.update(database.name, database.servers, force)
+            if updated is None:
+                # Let alpm try it
+                transaction = self.init_transaction()
+                if transaction:
+                    database.update(True)
+                    transaction.release()
+                else:
+                    res = False
+            elif updated:
+                changed = True
+        db_cache.save()
+
+        if changed:
+            # alpm does not know that we have changed its database
+            # files, start a new handle so it loads them again
+            self.release()
+            self.initialize_alpm()
+
+        if res:
+            self.synced_dbs = self.get_syncdbs_state()
+        else:
+            self.synced_dbs = None
         return res
 
-    def install(self, pkgs, conflicts=None, options=None):
-        """ Install a list of packages like pacman -S """
+    def get_repos(self):
+        """ Returns sync dbs by name (in pacman.conf order) """
+        # `alpm.handle.get_syncdbs()` returns a list (the order is important) so we
+        # have to ensure we don't clobber the priority of the repos.
+        repos = OrderedDict()
+        for syncdb in self.handle.get_syncdbs():
+            repos[syncdb.name] = syncdb
+        return repos
+
+    def get_targets(self, pkgs, conflicts=None):
+        """ Returns the names of the packages that have to be installed
+            for pkgs (package or group names) """
 
         if not conflicts:
             conflicts = []
 
-        if not options:
-            options = {}
-
-        if self.handle is None:
-            logging.error("alpm is not initialised")
-            raise pyalpm.error
-
-        if len(pkgs) == 0:
-            logging.error("Package list is empty")
-            raise pyalpm.error
-
-        # Discard duplicates
-        pkgs = list(set(pkgs))
-
-        # `alpm.handle.get_syncdbs()` returns a list (the order is important) so we
-        # have to ensure we don't clobber the priority of the repos.
-        repos = OrderedDict()
-        repo_order = []
+        repos = self.get_repos()
         one_repo_groups = ['cinnamon', 'mate', 'mate-extra']
-        db_match = [db for db in self.handle.get_syncdbs() if 'antergos' == db.name]
         antdb = OrderedDict()
-        antdb['antergos'] = db_match[0]
+        antdb['antergos'] = repos['antergos']
         one_repo_groups = [antdb['antergos'].read_grp(one_repo_group)
                            for one_repo_group in one_repo_groups]
         one_repo_pkgs = {pkg for one_repo_group in one_repo_groups
                          for pkg in one_repo_group[1] if one_repo_group}
 
-        for syncdb in self.handle.get_syncdbs():
-            repo_order.append(syncdb)
-            repos[syncdb.name] = syncdb
-
         targets = []
-        logging.debug('REPO DB ORDER IS: %s', repo_order)
+        logging.debug('REPO DB ORDER IS: %s', list(repos.values()))
 
         for name in pkgs:
             _repos = repos
@@ -306,6 +377,28 @@ class Pac:
                     # we'll allow to continue.
                     logging.error("Can't find a package or group called '%s'", name)
 
+        return targets
+
+    def install(self, pkgs, conflicts=None, options=None):
+        """ Install a list of packages like pacman -S """
+
+        if not options:
+            options = {}
+
+        if self.handle is None:
+            logging.error("alpm is not initialised")
+            raise pyalpm.error
+
+        if len(pkgs) == 0:
+            logging.error("Package list is empty")
+            raise pyalpm.error
+
+        # Discard duplicates
+        pkgs = list(set(pkgs))
+
+        repos = self.get_repos()
+        targets = self.get_targets(pkgs, conflicts)
+
         # Discard duplicates
         targets = list(set(targets))
         logging.debug(targets)
@@ -577,9 +670,19 @@ class Pac:
             # We can revisit this later if need be.
             logging.debug(line)
 
+    def set_progress_range(self, offset=0, total=0):
+        """ The next transaction installs packages offset + 1 to
+            offset + n of a total. Use total 0 to report progress of
+            each transaction on its own """
+        self.progress_offset = offset
+        self.progress_total = total
+
     def cb_progress(self, target, percent, total, current):
         """ Shows install progress """
         if target:
+            if self.progress_total > 0:
+                current = min(self.progress_offset + current, self.progress_total)
+                total = self.progress_total
             msg = _("Installing {0} ({1}/{2})").format(target, current, total)
             self.queue_event('info', msg)
             percent = current / total
@@ -627,6 +730,20 @@ class Pac:
                 self.last_dl_progress = progress
                 self.queue_event('percent', progress)
 
+    def set_pkgreason(self, pkg_names, reason):
+        """ Sets install reason (explicit or dependency) of
+            installed packages """
+        database = self.handle.get_localdb()
+        for pkg_name in pkg_names:
+            pkg = database.get_pkg(pkg_name)
+            if pkg is None:
+                logging.warning("Can't set install reason of %s (not installed)", pkg_name)
+                continue
+            try:
+                self.handle.set_pkgreason(pkg, reason)
+            except pyalpm.error as pyalpm_error:
+                logging.warning("Can't set install reason of %s: %s", pkg_name, pyalpm_error)
+
     def is_package_installed(self, package_name):
         """ Check if package is already installed """
         database = self.handle.get_localdb()
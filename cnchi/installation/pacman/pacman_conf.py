@@ -219,6 +219,7 @@ class PacmanConfig(collections.OrderedDict):
         # h.logcb = cb_log
 
         # set sync databases
+        self.repo_order = []
         for repo, servers in self.repos.items():
             self.repo_order.append(repo)
             database = handle.register_syncdb(repo, 0)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# provider_index.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+
+""" Indexed dependency satisfier lookups for pyalpm package caches
+
+    pyalpm.find_satisfier() scans the whole package list each time it is
+    called. ProviderIndex maps every package name and every 'provides'
+    entry to its packages once, so each lookup only needs to check the
+    few packages that can actually satisfy the dependency. """
+
+import re
+
+try:
+    import pyalpm
+except ImportError:
+    pass
+
+# Splits a dependency string ("name>=version") in its three parts
+DEP_RE = re.compile(r'^(?P<name>[^<>=]+)(?:(?P<mod><=|>=|<|>|=)(?P<version>.+))?$')
+
+
+def parse_dep(dep):
+    """ Returns name, modifier and version of a dependency string.
+        Modifier and version are None if the dependency has no version """
+    match = DEP_RE.match(dep)
+    if match is None:
+        return dep, None, None
+    return match.group('name'), match.group('mod'), match.group('version')
+
+
+def version_satisfies(version, mod, wanted):
+    """ Checks version against the wanted version using modifier mod.
+        Uses pyalpm.vercmp, so versions compare the same way pacman does """
+    if mod is None:
+        return True
+    if version is None:
+        # An unversioned provision can't satisfy a versioned dependency
+        return False
+    result = pyalpm.vercmp(version, wanted)
+    if mod == '=':
+        return result == 0
+    if mod == '>=':
+        return result >= 0
+    if mod == '<=':
+        return result <= 0
+    if mod == '>':
+        return result > 0
+    return result < 0
+
+
+class ProviderIndex(object):
+    """ Maps package names and provisions to packages of a package list
+        (for instance, the pkgcache of a pyalpm database) """
+
+    def __init__(self, pkgs):
+        self.by_name = {}
+        self.by_provision = {}
+        for pkg in pkgs:
+            # Keep the first one, as find_satisfier does
+            self.by_name.setdefault(pkg.name, pkg)
+            for provision in pkg.provides:
+                name, _mod, version = parse_dep(provision)
+                self.by_provision.setdefault(name, []).append((pkg, version))
+
+    def find_satisfier(self, dep):
+        """ Returns the package that satisfies dep (or None).
+            Same result as pyalpm.find_satisfier(pkgs, dep): packages
+            with that exact name are preferred over packages that
+            provide it, in package list order """
+        name, mod, wanted = parse_dep(dep)
+
+        pkg = self.by_name.get(name)
+        if pkg is not None and version_satisfies(pkg.version, mod, wanted):
+            return pkg
+
+        for pkg, version in self.by_provision.get(name, []):
+            if version_satisfies(version, mod, wanted):
+                return pkg
+
+        return None
+
+    def __len__(self):
+        return len(self.by_name)
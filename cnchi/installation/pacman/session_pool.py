@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# session_pool.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Pool of loaded alpm sessions
+
+    Selecting packages, creating the metalinks and installing them used to
+    create a new Pac object each time, parsing pacman.conf, registering all
+    sync databases and loading their package caches again. The pool keeps
+    one Pac object for each (pacman.conf, root dir) pair, so all these
+    phases share the same loaded databases (and their provider indexes). """
+
+import logging
+import os
+import threading
+
+import installation.pacman.pac as pac
+import installation.pacman.pacman_conf as config
+
+
+def get_file_state(path):
+    """ Returns modification time and size of a file (None if it does not exist) """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class SessionPool(object):
+    """ Keeps a Pac object for each (pacman.conf, root dir) pair """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (conf path, root dir) -> (conf file state, Pac object)
+        self.sessions = {}
+        # conf path -> (conf file state, root dir)
+        self.root_dirs = {}
+
+    def get_root_dir(self, conf_path, conf_state):
+        """ Returns the root dir set in a pacman.conf file (the file is only
+            parsed again if it has changed) """
+        state, root_dir = self.root_dirs.get(conf_path, (None, None))
+        if state is None or state != conf_state:
+            root_dir = config.PacmanConfig(conf_path).options["RootDir"]
+            self.root_dirs[conf_path] = (conf_state, root_dir)
+        return root_dir
+
+    def get(self, conf_path="/etc/pacman.conf", callback_queue=None):
+        """ Returns the Pac object of conf_path, creating it if needed """
+        conf_path = os.path.realpath(conf_path)
+
+        with self.lock:
+            conf_state = get_file_state(conf_path)
+            if conf_state is None:
+                # Let Pac complain about it
+                return pac.Pac(conf_path, callback_queue)
+
+            key = (conf_path, self.get_root_dir(conf_path, conf_state))
+            state, session = self.sessions.get(key, (None, None))
+
+            if session is not None and state != conf_state:
+                logging.debug("%s has changed, its alpm session will be created again",
+                              conf_path)
+                session.release()
+                session = None
+
+            if session is None:
+                session = pac.Pac(conf_path, callback_queue)
+                self.sessions[key] = (conf_state, session)
+                logging.debug("New alpm session for %s (root dir %s)", key[0], key[1])
+            else:
+                logging.debug("Reusing alpm session for %s (root dir %s)", key[0], key[1])
+
+            session.callback_queue = callback_queue
+            return session
+
+    def release(self):
+        """ Releases all alpm sessions """
+        with self.lock:
+            for _state, session in self.sessions.values():
+                session.release()
+            self.sessions.clear()
+
+
+_POOL = SessionPool()
+
+
+def get_session(conf_path="/etc/pacman.conf", callback_queue=None):
+    """ Returns the shared Pac object of conf_path """
+    return _POOL.get(conf_path, callback_queue)
+
+
+def release_sessions():
+    """ Releases all shared Pac objects """
+    _POOL.release()
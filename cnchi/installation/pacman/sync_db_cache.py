@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# sync_db_cache.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Conditional downloads of pacman sync databases
+
+    alpm downloads every sync database again each time they are refreshed.
+    This module asks mirrors for them with If-Modified-Since/If-None-Match
+    headers instead, so unchanged databases are not downloaded at all.
+    Databases of the live system can also be copied to the new system
+    before refreshing its databases, so they are only downloaded if the
+    mirrors have newer ones. """
+
+import email.utils
+import json
+import logging
+import os
+import shutil
+
+import requests
+
+import misc.http_session as http_session
+import misc.state_files as state_files
+
+# Stores ETag and Last-Modified headers of our downloaded databases
+# (in Cnchi's state dir, see misc/state_files.py)
+STATE_NAME = "sync-state"
+
+# Seconds to wait for a mirror to answer
+TIMEOUT = 30
+
+
+def get_sync_dir(db_path):
+    """ Returns the dir where sync databases are stored """
+    return os.path.join(db_path, "sync")
+
+
+def load_state(sync_dir):
+    """ Loads saved headers of the databases in sync_dir """
+    try:
+        with open(state_files.get_path(sync_dir, STATE_NAME)) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(sync_dir, state):
+    """ Saves headers of the databases in sync_dir """
+    try:
+        with open(state_files.get_path(sync_dir, STATE_NAME), 'w') as state_file:
+            json.dump(state, state_file)
+    except OSError as err:
+        logging.warning("Can't save sync databases state: %s", err)
+
+
+def get_file_id(path):
+    """ Returns size and mtime of a database file. Saved headers are
+        only used if the file is still the one they were sent with """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def remove_file(path):
+    """ Removes a file (if it exists) """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SyncDbCache(object):
+    """ Updates sync database files using conditional requests """
+
+    def __init__(self, db_path):
+        self.sync_dir = get_sync_dir(db_path)
+        os.makedirs(self.sync_dir, mode=0o755, exist_ok=True)
+        self.state = load_state(self.sync_dir)
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+    def get_headers(self, repo, url):
+        """ Returns the conditional headers for a database request """
+        path = os.path.join(self.sync_dir, repo + ".db")
+        try:
+            file_id = get_file_id(path)
+        except OSError:
+            return {}
+
+        headers = {}
+        entry = self.state.get(repo, {})
+        if entry.get('url') == url and entry.get('file_id') == file_id:
+            # Validators are only valid for the server that sent them
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        if 'If-Modified-Since' not in headers:
+            # alpm sets the modification time of the files
+            # it downloads to the one sent by the server
+            headers['If-Modified-Since'] = email.utils.formatdate(
+                os.path.getmtime(path), usegmt=True)
+        return headers
+
+    def download(self, url, path, headers=None):
+        """ Downloads url to path. Returns the server response (None on error) """
+        try:
+            req = http_session.get(url, headers=headers, timeout=TIMEOUT)
+        except requests.exceptions.RequestException as err:
+            logging.debug("Can't download %s: %s", url, err)
+            return None
+
+        if req.status_code != requests.codes.ok:
+            return req
+
+        tmp_path = path + ".part"
+        try:
+            with open(tmp_path, 'wb') as db_file:
+                db_file.write(req.content)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logging.warning("Can't save %s: %s", path, err)
+            remove_file(tmp_path)
+            return None
+        self.bytes_downloaded += len(req.content)
+
+        last_modified = req.headers.get('Last-Modified')
+        if last_modified:
+            try:
+                mtime = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                os.utime(path, (mtime, mtime))
+            except (TypeError, ValueError, OSError):
+                pass
+        return req
+
+    def update_from(self, repo, url, force=False):
+        """ Updates repo database from url (even if it has not changed
+            when force is True).
+            Returns True if it has been downloaded, False if it has not changed
+            and None if the server could not give it to us """
+        path = os.path.join(self.sync_dir, repo + ".db")
+        headers = {} if force else self.get_headers(repo, url)
+        req = self.download(url, path, headers)
+
+        if req is None:
+            return None
+
+        if req.status_code == requests.codes.not_modified:
+            self.bytes_saved += os.path.getsize(path)
+            return False
+
+        if req.status_code != requests.codes.ok:
+            logging.debug("Server answered %d when downloading %s", req.status_code, url)
+            return None
+
+        # An old signature would not match the new database
+        sig_req = self.download(url + ".sig", path + ".sig")
+        try:
+            if sig_req is None or sig_req.status_code != requests.codes.ok:
+                remove_file(path + ".sig")
+            file_id = get_file_id(path)
+        except OSError as err:
+            logging.warning("Can't update %s database: %s", repo, err)
+            self.state.pop(repo, None)
+            return None
+
+        self.state[repo] = {
+            'url': url,
+            'etag': req.headers.get('ETag'),
+            'last_modified': req.headers.get('Last-Modified'),
+            'file_id': file_id}
+
+        return True
+
+    def update(self, repo, servers, force=False):
+        """ Updates repo database trying all its servers in order.
+            Returns True if it has been downloaded, False if it has not changed
+            and None if no server could give it to us """
+        for server in servers:
+            url = "{0}/{1}.db".format(server.rstrip('/'), repo)
+            result = self.update_from(repo, url, force)
+            if result is not None:
+                return result
+        logging.warning("Can't download %s database from any of its servers", repo)
+        return None
+
+    def save(self):
+        """ Saves headers of our downloaded databases and logs our savings """
+        save_state(self.sync_dir, self.state)
+        logging.info(
+            "Sync databases refreshed: %d bytes downloaded, %d bytes saved",
+            self.bytes_downloaded,
+            self.bytes_saved)
+
+
+def seed(source_conf, dest_conf):
+    """ Copies sync databases of source_conf (usually the live system's
+        pacman.conf) to the databases dir of dest_conf, when dest_conf uses
+        the same servers for that repository and has no newer database.
+        Returns the names of the copied databases """
+    source_dir = get_sync_dir(source_conf.options["DBPath"])
+    dest_dir = get_sync_dir(dest_conf.options["DBPath"])
+    os.makedirs(dest_dir, mode=0o755, exist_ok=True)
+
+    source_state = load_state(source_dir)
+    dest_state = load_state(dest_dir)
+
+    seeded = []
+    for repo, servers in dest_conf.repos.items():
+        if source_conf.repos.get(repo) != servers:
+            continue
+
+        source_path = os.path.join(source_dir, repo + ".db")
+        dest_path = os.path.join(dest_dir, repo + ".db")
+        if not os.path.exists(source_path):
+            continue
+        if os.path.exists(dest_path) and \
+                os.path.getmtime(dest_path) >= os.path.getmtime(source_path):
+            continue
+
+        # copy2 keeps the modification time, which is the one of the server
+        shutil.copy2(source_path, dest_path)
+        if os.path.exists(source_path + ".sig"):
+            shutil.copy2(source_path + ".sig", dest_path + ".sig")
+        else:
+            remove_file(dest_path + ".sig")
+
+        if repo in source_state:
+            dest_state[repo] = source_state[repo]
+        else:
+            dest_state.pop(repo, None)
+        seeded.append(repo)
+
+    if seeded:
+        save_state(dest_dir, dest_state)
+        logging.debug("Sync databases %s copied from %s", ', '.join(seeded), source_dir)
+    return seeded
@@ -42,8 +42,11 @@ except ImportError:
     pass
 
 import misc.extra as misc
+import misc.event_bus as event_bus
 
 from installation.download import download
+from installation.download import staging
+import installation.pacman.session_pool as session_pool
 
 from installation import select_packages as pack
 
@@ -59,6 +62,7 @@ class Process(multiprocessing.Process):
         self.install_screen = install_screen
         self.pkg = None
         self.down = None
+        self.staging = None
 
 
     def create_metalinks_list(self):
@@ -85,37 +89,63 @@ class Process(multiprocessing.Process):
             txt = _("Cannot create download package list (metalinks).")
             raise misc.InstallError(txt)
 
+    def start_staged_download(self):
+        """ Starts downloading packages to a staging dir, so downloading
+            and formatting can be done at the same time """
+        staging_dir = self.settings.get('download_staging_dir')
+        if not self.settings.get('download_staging') or not staging_dir:
+            return
+
+        self.staging = staging.StagedDownload(
+            metalinks=self.down.metalinks,
+            staging_dir=staging_dir,
+            settings=self.settings,
+            mirror_health=self.down.mirror_health)
+
+        if not self.staging.start():
+            # Packages will be downloaded after formatting
+            self.staging = None
+
     def run(self):
         """ Calculates download package list and then calls run_format and
         run_install. Takes care of the exceptions, too. """
 
+        if self.callback_queue is not None:
+            # All events of this process go through our event bus, which
+            # coalesces progress events so the GUI is not flooded by them
+            rate = self.settings.get('progress_events_rate') or event_bus.RATE
+            self.callback_queue = event_bus.EventBus(self.callback_queue, rate)
+            self.install_screen.callback_queue = self.callback_queue
+
         try:
             # Before formatting, let's try to calculate package download list
             # this way, if something fails (a missing package, mostly) we have
             # not formatted anything yet.
             self.create_metalinks_list()
 
-            self.queue_event('info', _("Getting your disk(s) ready for Antergos..."))
+            # Privileges are kept during format and install, as packages
+            # may be downloading (as root) in the background all the time
             with misc.raised_privileges() as __:
+                # Start downloading now, while the disks are being prepared
                 if self.settings.get('is_iso'):
-                    self.install_screen.run_format()
+                    self.start_staged_download()
 
-            path = "/tmp/.cnchi_partitioning_completed"
-            with open(path, 'w') as part_file:
-                part_file.write("# File created by Cnchi to force\n")
-                part_file.write("# users to reboot before retry\n")
-                part_file.write("# formatting their hard disk(s)\n")
+                self.queue_event('info', _("Getting your disk(s) ready for Antergos..."))
+                if self.settings.get('is_iso'):
+                    self.install_screen.run_format()
 
-            path = "/tmp/.cnchi_partitioning_completed"
-            with open(path, 'w') as part_file:
-                part_file.write("# File created by Cnchi to force\n")
-                part_file.write("# users to reboot before retry\n")
-                part_file.write("# formatting their hard disk(s)\n")
+                path = "/tmp/.cnchi_partitioning_completed"
+                with open(path, 'w') as part_file:
+                    part_file.write("# File created by Cnchi to force\n")
+                    part_file.write("# users to reboot before retry\n")
+                    part_file.write("# formatting their hard disk(s)\n")
 
-            self.queue_event('info', _("Installation will start now!"))
-            with misc.raised_privileges() as __:
+                self.queue_event('info', _("Installation will start now!"))
                 if self.settings.get('is_iso'):
-                    self.install_screen.run_install(self.pkg.packages, self.down.metalinks)
+                    self.install_screen.run_install(
+                        self.pkg.packages,
+                        self.down.metalinks,
+                        self.staging)
         except subprocess.CalledProcessError as process_error:
             txt = "Error running command {0}: {1}".format(
                 process_error.cmd,
@@ -142,10 +172,23 @@ class Process(multiprocessing.Process):
             for line in trace:
                 logging.error(line.rstrip())
             self.queue_fatal_event(install_error)
+        finally:
+            # alpm sessions are shared by all installation steps, close them now
+            session_pool.release_sessions()
+
+            if self.callback_queue is not None:
+                # Do not leave any event behind
+                self.callback_queue.flush()
 
     def queue_fatal_event(self, txt):
         """ Enqueues a fatal event and exits process """
+        if self.staging is not None:
+            # Do not keep downloading after a failure
+            self.staging.cancel()
         self.queue_event('error', txt)
+        if self.callback_queue is not None:
+            # Send the events still waiting in the bus before exiting
+            self.callback_queue.flush()
         sys.exit(0)
 
     def queue_event(self, event_type, event_text=""):
@@ -28,7 +28,6 @@ import logging
 import os
 import queue
 import sys
-import requests
 from requests.exceptions import RequestException
 
 try:
@@ -39,8 +38,9 @@ except ImportError as err:
 import desktop_info
 import info
 
-from installation import pacman as pac
+import installation.pacman.session_pool as session_pool
 import misc.extra as misc
+import misc.http_session as http_session
 from misc.extra import InstallError
 
 import hardware.hardware as hardware
@@ -119,9 +119,10 @@ class SelectPackages(object):
     @misc.raise_privileges
     def refresh_pacman_databases(self):
         """ Updates pacman databases """
-        # Init pyalpm
+        # Init pyalpm (the alpm session is kept, so creating the
+        # metalinks later will reuse its loaded databases)
         try:
-            pacman = pac.Pac("/etc/pacman.conf", self.callback_queue)
+            pacman = session_pool.get_session("/etc/pacman.conf", self.callback_queue)
         except Exception as ex:
             template = "Can't initialize pyalpm. An exception of type {0} occured. Arguments:\n{1!r}"
             message = template.format(type(ex).__name__, ex.args)
@@ -134,15 +135,6 @@ class SelectPackages(object):
             txt = _("Can't refresh pacman databases.")
             raise InstallError(txt)
 
-        try:
-            pacman.release()
-            del pacman
-        except Exception as ex:
-            template = "Can't release pyalpm. An exception of type {0} occured. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            raise InstallError(message)
-
     def get_desktop_lib(self):
         """ Returns which widget library our desktop will need """
         for lib in desktop_info.LIBS:
@@ -203,7 +195,7 @@ class SelectPackages(object):
             try:
                 url = '{0}packages-{1}.xml'.format(PKGLIST_URL, info.CNCHI_VERSION.rsplit('.')[-2])
                 logging.debug("Getting url %s...", url)
-                req = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+                req = http_session.get(url, headers={'User-Agent': 'Mozilla/5.0'})
                 packages_xml_data = req.content
             except RequestException as url_error:
                 # If the installer can't retrieve the remote file Cnchi will use
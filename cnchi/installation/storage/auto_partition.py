@@ -36,6 +36,7 @@ import math
 from misc.extra import InstallError
 from misc.run_cmd import call, popen
 import storage.filesystems as fs
+import storage.block_devices as block_devices
 
 from installation import wrapper
 
@@ -177,6 +178,8 @@ def remove_lvm(device):
                 cmd = ["pvremove", "-ff", "-y", pvolume]
                 call(cmd, msg=err_msg)
 
+    block_devices.invalidate()
+
 
 def close_antergos_luks_devices():
     """ Close LUKS devices (they may have been left open because of a previous
@@ -246,6 +249,9 @@ def setup_luks(luks_device, luks_name, luks_pass=None, luks_key=None):
         proc = popen(cmd, msg=err_msg, fatal=True)
         proc.communicate(input=luks_pass_bytes)
 
+    # The partition is now a LUKS container and there is a new mapper device
+    block_devices.invalidate()
+
 
 class AutoPartition(object):
     """ Class used by the automatic installation method """
@@ -362,6 +368,8 @@ class AutoPartition(object):
                 mode = 0o755
             os.chmod(path, mode)
 
+        # Cached UUID and LABEL of this device are not valid anymore
+        block_devices.invalidate()
         fs_uuid = fs.get_uuid(device)
         fs_label = fs.get_label(device)
         msg = "Device details: %s UUID=%s LABEL=%s"
@@ -742,6 +750,7 @@ class AutoPartition(object):
 
         # Wait until /dev initialized correct devices
         call(["udevadm", "settle"])
+        block_devices.invalidate()
 
         devices = self.get_devices()
 
@@ -806,6 +815,8 @@ class AutoPartition(object):
                 cmd = ["lvcreate", "--name", "AntergosHome", "--extents", "100%FREE", "AntergosVG"]
                 call(cmd, msg=err_msg, fatal=True)
 
+            block_devices.invalidate()
+
         # We have all partitions and volumes created. Let's create its filesystems with mkfs.
 
         mount_points = {
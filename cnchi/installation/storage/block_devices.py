@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# block_devices.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Snapshot of block device metadata
+
+Instead of running blkid or lsblk once per partition, all block devices
+are probed with a single lsblk call and the result is cached. Anything
+that modifies partitions or filesystems must call invalidate() so the
+next query probes the devices again. """
+
+import json
+import logging
+import os
+import subprocess
+import threading
+
+LSBLK_COLUMNS = "NAME,KNAME,PKNAME,TYPE,FSTYPE,UUID,PARTUUID,LABEL,SIZE,ROTA"
+
+_LOCK = threading.Lock()
+_SNAPSHOT = None
+
+
+class BlockDevice(object):
+    """ Metadata of a block device as reported by lsblk """
+
+    def __init__(self, info):
+        self.path = info.get('name') or ""
+        self.kname = info.get('kname') or ""
+        self.pkname = info.get('pkname') or ""
+        self.type = info.get('type') or ""
+        self.fstype = info.get('fstype') or ""
+        self.uuid = info.get('uuid') or ""
+        self.partuuid = info.get('partuuid') or ""
+        self.label = info.get('label') or ""
+        self.size = to_int(info.get('size'))
+        self.rotational = to_bool(info.get('rota'))
+
+    def __repr__(self):
+        return "BlockDevice({0}, {1}, {2})".format(
+            self.path, self.type, self.fstype)
+
+
+def to_int(value):
+    """ lsblk (depending on its version) outputs numbers as strings """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_bool(value):
+    """ lsblk outputs booleans as true/false or as "1"/"0" """
+    if isinstance(value, str):
+        return value not in ("0", "false", "")
+    return bool(value)
+
+
+def flatten(devices, result):
+    """ Flattens lsblk tree output (children are nested in their parent) """
+    for info in devices:
+        result.append(info)
+        flatten(info.get('children', []), result)
+    return result
+
+
+def probe():
+    """ Gets metadata of all block devices with one lsblk call """
+    # Make sure pending udev events (new partitions, new filesystems) have
+    # been processed, lsblk reads its data from the udev database.
+    try:
+        subprocess.call(["udevadm", "settle"], timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as err:
+        logging.warning("udevadm settle failed: %s", err)
+
+    cmd = ["lsblk", "--json", "--bytes", "--paths", "-o", LSBLK_COLUMNS]
+    try:
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        devices = json.loads(output.decode()).get('blockdevices', [])
+    except (OSError, subprocess.CalledProcessError, ValueError) as err:
+        logging.error("Can't get block devices information: %s", err)
+        return {}
+
+    snapshot = {}
+    for info in flatten(devices, []):
+        device = BlockDevice(info)
+        if not device.path:
+            continue
+        # A device can appear several times (a RAID member, for instance),
+        # the information is the same in all of them.
+        snapshot[device.path] = device
+        if device.kname:
+            snapshot.setdefault(device.kname, device)
+    return snapshot
+
+
+def get_snapshot():
+    """ Returns a dict (device path -> BlockDevice) of all block devices """
+    global _SNAPSHOT
+    with _LOCK:
+        if _SNAPSHOT is None:
+            _SNAPSHOT = probe()
+            logging.debug("Block devices probed (%d devices)", len(_SNAPSHOT))
+        return _SNAPSHOT
+
+
+def invalidate():
+    """ Discards cached data. Must be called after changing partitions or
+    filesystems (partitioning, mkfs, labeling, luksFormat...) """
+    global _SNAPSHOT
+    with _LOCK:
+        _SNAPSHOT = None
+
+
+def lookup(snapshot, path):
+    """ Finds a device by its path or by the path it points to """
+    device = snapshot.get(path)
+    if device is None and os.path.islink(path):
+        # /dev/disk/by-uuid/..., /dev/VolGroup/LogVol...
+        device = snapshot.get(os.path.realpath(path))
+    return device
+
+
+def get_device(path):
+    """ Returns the BlockDevice of path (or None if it does not exist) """
+    if not path:
+        return None
+    device = lookup(get_snapshot(), path)
+    if device is None:
+        # The device may have been created after the snapshot was taken
+        invalidate()
+        device = lookup(get_snapshot(), path)
+    return device
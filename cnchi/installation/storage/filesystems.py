@@ -36,6 +36,8 @@ import os
 
 import misc.extra as misc
 
+import storage.block_devices as block_devices
+
 from misc.run_cmd import call
 
 # constants
@@ -70,60 +72,44 @@ def get_label(part):
         return ""
 
 
-@misc.raise_privileges
 def get_info(part):
-    """ Get partition info using blkid """
-
-    ret = ''
+    """ Get partition info (same keys as blkid output) """
     partdic = {}
     # Do not try to get extended partition info
     if part and not misc.is_partition_extended(part):
-        # -c /dev/null means no cache
-        cmd = ['blkid', '-c', '/dev/null', part]
-        call(cmd)
-
-        for info in ret.split():
-            if '=' in info:
-                info = info.split('=')
-                partdic[info[0]] = info[1].strip('"')
+        device = block_devices.get_device(part)
+        if device:
+            info = {
+                'UUID': device.uuid,
+                'PARTUUID': device.partuuid,
+                'LABEL': device.label,
+                'TYPE': device.fstype}
+            # Like blkid, omit the tags the partition does not have
+            for key in info:
+                if info[key]:
+                    partdic[key] = info[key]
 
     return partdic
 
 
-@misc.raise_privileges
 def get_type(part):
-    """ Get filesystem type using blkid """
-    ret = ''
-    if part and not misc.is_partition_extended(part):
-        cmd = ['blkid', '-o', 'value', '-s', 'TYPE', part]
-        ret = call(cmd)
-
-    return ret
+    """ Get filesystem type """
+    return get_info(part).get('TYPE', '')
 
 
 def get_pknames():
     """ PKNAME: internal parent kernel device name """
     pknames = {}
-    info = None
-    cmd = ['lsblk', '-o', 'NAME,PKNAME', '-l']
-    info = call(cmd)
-    if info:
-        info = info.split('\n')
-        # skip header
-        info = info[1:]
-        skip_list = ["disk", "rom", "loop", "arch_root-image"]
-        for line in info:
-            skip_line = False
-            for skip in skip_list:
-                if skip in line:
-                    skip_line = True
-                    break
-            if not skip_line:
-                line = line.split()
-                try:
-                    pknames[line[0]] = line[1]
-                except IndexError as err:
-                    pass
+    skip_list = ["disk", "rom", "loop", "arch_root-image"]
+    for device in set(block_devices.get_snapshot().values()):
+        if not device.pkname:
+            continue
+        name = os.path.basename(device.path)
+        pkname = os.path.basename(device.pkname)
+        # Same names lsblk -o NAME,PKNAME -l would show
+        line = "{0} {1}".format(name, pkname)
+        if not any(skip in line for skip in skip_list):
+            pknames[name] = pkname
     return pknames
 
 
@@ -152,6 +138,7 @@ def label_fs(fstype, part, label):
     if fstype in ladic:
         cmd = shlex.split(ladic[fstype] % vars())
         call(cmd)
+        block_devices.invalidate()
     else:
         # Not being able to label a partition shouldn't worry us much
         logging.warning("Can't label %s (%s) with label %s", part, fstype, label)
@@ -237,12 +224,17 @@ def create_fs(part, fstype, label='', other_opts=''):
     cmd += " %(part)s"
 
     cmd = shlex.split(cmd % vars())
-    return call(cmd)
+    ret = call(cmd)
+    block_devices.invalidate()
+    return ret
 
 
-@misc.raise_privileges
 def is_ssd(disk_path):
     """ Checks if given disk is actually a ssd disk. """
+    device = block_devices.get_device(disk_path)
+    if device:
+        return not device.rotational
+
     disk_name = disk_path.split('/')[-1]
     filename = os.path.join("/sys/block", disk_name, "queue/rotational")
     if not os.path.exists(filename):
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# stream_install.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+
+""" Streaming install: packages are installed in batches (base packages
+    first) while the rest of them are still being downloaded """
+
+import logging
+import queue
+import threading
+from collections import OrderedDict
+
+try:
+    import pyalpm
+except ImportError:
+    pass
+
+import misc.extra as misc
+from installation.download import download
+
+# Minimum number of packages of each alpm transaction (but the last one).
+# All pacman hooks run after each transaction, so batches can't be too small
+MIN_BATCH_SIZE = 100
+
+# Download events shown while packages are being installed (the rest
+# would overwrite the install progress messages)
+DOWNLOAD_EVENTS = ['downloads_progress_bar', 'downloads_percent', 'error', 'warning']
+
+
+def get_components(graph):
+    """ Returns the strongly connected components of graph, a dict that maps
+        each node to the nodes it depends on. Components are returned after
+        all the components they depend on. Iterative version of Tarjan's
+        algorithm (dependency chains are too long for a recursive one) """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph[child])))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def get_layers(graph):
+    """ Splits graph nodes in layers. Nodes only depend on nodes of their
+        own layer (dependency cycles) or of previous layers """
+    layer_of = {}
+    layers = []
+    for component in get_components(graph):
+        members = set(component)
+        layer = 0
+        for node in component:
+            for dep in graph[node]:
+                if dep not in members:
+                    layer = max(layer, layer_of[dep] + 1)
+        for node in component:
+            layer_of[node] = layer
+        while len(layers) <= layer:
+            layers.append([])
+        layers[layer].extend(component)
+    return [sorted(layer) for layer in layers]
+
+
+def get_batches(layers, min_size=MIN_BATCH_SIZE):
+    """ Joins consecutive layers into batches of at least min_size packages """
+    batches = []
+    batch = []
+    for layer in layers:
+        batch.extend(layer)
+        if len(batch) >= min_size:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EventFilter(object):
+    """ Only lets some events through to the callback queue """
+
+    def __init__(self, callback_queue, event_types):
+        self.callback_queue = callback_queue
+        self.event_types = event_types
+
+    def put_nowait(self, event):
+        """ Adds event to callback queue, if its type is allowed """
+        if self.callback_queue is not None and event[0] in self.event_types:
+            try:
+                self.callback_queue.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+class StreamingInstall(object):
+    """ Downloads packages in dependency order and installs each batch
+        of packages as soon as all of them are in pacman's cache """
+
+    def __init__(self, pacman, packages, metalinks, pacman_cache_dir,
+                 settings=None, callback_queue=None, extra_cache_dirs=None):
+        self.pacman = pacman
+        self.packages = packages
+        self.metalinks = metalinks
+        self.pacman_cache_dir = pacman_cache_dir
+        self.settings = settings
+        self.callback_queue = callback_queue
+        self.extra_cache_dirs = extra_cache_dirs
+
+        self.downloaded = set()
+        self.download_done = False
+        self.download_error = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def get_dependency_graph(self, pkg_names):
+        """ Returns which packages of pkg_names each one of them depends on """
+        repos = self.pacman.get_repos()
+        indexes = [self.pacman.get_provider_index(db) for db in repos.values()]
+        names = set(pkg_names)
+        graph = {}
+        for pkg_name in pkg_names:
+            graph[pkg_name] = set()
+            result_ok, pkg = self.pacman.find_sync_package(pkg_name, repos)
+            if not result_ok:
+                # alpm will tell what's wrong when it's installed
+                continue
+            for dep in pkg.depends:
+                for index in indexes:
+                    prov = index.find_satisfier(dep)
+                    if prov is not None:
+                        if prov.name in names and prov.name != pkg_name:
+                            graph[pkg_name].add(prov.name)
+                        break
+        return graph
+
+    def package_downloaded(self, element):
+        """ Called (from a download thread) when a package is ready """
+        with self.condition:
+            self.downloaded.add(element['identity'])
+            self.condition.notify_all()
+
+    def download(self, downloads):
+        """ Thread function, downloads all packages """
+        download_packages = download.DownloadPackages(
+            package_names=self.packages,
+            pacman_conf_file='/tmp/pacman.conf',
+            pacman_cache_dir=self.pacman_cache_dir,
+            settings=self.settings,
+            callback_queue=EventFilter(self.callback_queue, DOWNLOAD_EVENTS),
+            extra_cache_dirs=self.extra_cache_dirs)
+        try:
+            download_packages.start(downloads, package_callback=self.package_downloaded)
+        except misc.InstallError as install_error:
+            self.download_error = install_error
+        finally:
+            with self.condition:
+                self.download_done = True
+                self.condition.notify_all()
+
+    def wait_for(self, pkg_names):
+        """ Waits until all pkg_names are downloaded.
+            Returns False if some of them can't be downloaded """
+        with self.condition:
+            while not self.downloaded.issuperset(pkg_names):
+                if self.download_done:
+                    return False
+                self.condition.wait()
+        return True
+
+    def wait(self):
+        """ Waits until the download thread ends. Raises InstallError
+            if packages could not be downloaded """
+        if self.thread is not None:
+            self.thread.join()
+        if self.download_error is not None:
+            raise self.download_error
+
+    def start(self):
+        """ Downloads and installs packages. Returns False if something
+            went wrong installing them (download errors raise InstallError).
+            Packages not installed here can then be installed as usual """
+        pkg_names = list(self.metalinks.keys())
+        layers = get_layers(self.get_dependency_graph(pkg_names))
+        batches = get_batches(layers)
+        logging.debug(
+            "Streaming install of %d packages: %d dependency layers, %d transactions",
+            len(pkg_names), len(layers), len(batches))
+
+        # Download.start() takes packages from the end of the dict,
+        # so the last layer goes first
+        downloads = OrderedDict()
+        for layer in reversed(layers):
+            for pkg_name in layer:
+                downloads[pkg_name] = self.metalinks[pkg_name]
+
+        explicit = set(self.pacman.get_targets(self.packages))
+
+        self.queue_event('progress_bar', 'show')
+        self.thread = threading.Thread(target=self.download, args=(downloads,), daemon=True)
+        self.thread.start()
+
+        installed = 0
+        try:
+            for batch in batches:
+                if not self.wait_for(batch):
+                    # Download failed, wait() will raise the error
+                    break
+                self.pacman.set_progress_range(installed, len(pkg_names))
+                logging.debug("Installing a batch of %d packages...", len(batch))
+                if not self.pacman.install(pkgs=batch):
+                    logging.error("Can't install batch of packages %s", ' '.join(batch))
+                    self.wait()
+                    return False
+                # Packages have been installed as explicit targets,
+                # restore the reason pacman would have given them
+                self.pacman.set_pkgreason(
+                    [pkg_name for pkg_name in batch if pkg_name not in explicit],
+                    pyalpm.PKG_REASON_DEPEND)
+                installed += len(batch)
+        finally:
+            self.pacman.set_progress_range()
+
+        self.wait()
+        return True
+
+    def get_missing_targets(self):
+        """ Returns the packages in our package list that are not
+            installed yet (if any) """
+        database = self.pacman.handle.get_localdb()
+        return [pkg_name for pkg_name in self.pacman.get_targets(self.packages)
+                if database.get_pkg(pkg_name) is None]
+
+    def queue_event(self, event_type, event_text=""):
+        """ Enqueue a new event """
+        if self.callback_queue is not None:
+            try:
+                self.callback_queue.put_nowait((event_type, event_text))
+            except queue.Full:
+                pass
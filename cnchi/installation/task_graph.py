@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# task_graph.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Runs installation steps as a dependency graph
+
+    Each task declares the resources (files, services, users...) it reads
+    (requires) and the ones it writes (provides). A task waits for all the
+    tasks added before it that write something it reads or writes, or that
+    read something it writes. Tasks that do not share any resource run at
+    the same time in a bounded pool of threads. """
+
+import concurrent.futures
+import logging
+import time
+from collections import OrderedDict
+
+# Max number of tasks running at the same time
+MAX_WORKERS = 4
+
+
+class Task(object):
+    """ One installation step """
+
+    def __init__(self, name, function, requires=None, provides=None):
+        self.name = name
+        self.function = function
+        self.requires = set(requires or [])
+        self.provides = set(provides or [])
+        # Names of the tasks that have to be done before this one
+        self.depends = set()
+        self.elapsed = None
+
+    def must_wait_for(self, other):
+        """ Returns True if this task can't run until other has finished """
+        return bool(self.provides & (other.requires | other.provides) or
+                    self.requires & other.provides)
+
+    def run(self):
+        """ Runs the task, measuring how long it takes """
+        start = time.perf_counter()
+        try:
+            self.function()
+        finally:
+            self.elapsed = time.perf_counter() - start
+            logging.debug("Task '%s' done in %.2fs", self.name, self.elapsed)
+
+
+class TaskGraph(object):
+    """ Stores tasks and runs them in dependency order """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self.tasks = OrderedDict()
+
+    def add(self, name, function, requires=None, provides=None):
+        """ Adds a task. Tasks are ordered by the resources they share with
+            tasks added before (in the same order they are added) """
+        task = Task(name, function, requires, provides)
+        for other in self.tasks.values():
+            if task.must_wait_for(other):
+                task.depends.add(other.name)
+        self.tasks[name] = task
+        return task
+
+    def run(self):
+        """ Runs all tasks. If a task fails, no more tasks are started and its
+            exception is raised once the running ones have finished """
+        pending = OrderedDict(self.tasks)
+        running = {}
+        done = set()
+        error = None
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while running or (pending and error is None):
+                if error is None:
+                    for name, task in list(pending.items()):
+                        if len(running) >= self.max_workers:
+                            break
+                        if task.depends <= done:
+                            del pending[name]
+                            running[executor.submit(task.run)] = task
+
+                finished, _not_done = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    done.add(task.name)
+                    exception = future.exception()
+                    if exception is not None and error is None:
+                        logging.error("Task '%s' failed: %s", task.name, exception)
+                        error = exception
+        elapsed = time.perf_counter() - start
+
+        busy = sum(task.elapsed for task in self.tasks.values() if task.elapsed)
+        logging.debug(
+            "%d tasks done in %.2fs (%.2fs if run one after the other)",
+            len(done), elapsed, busy)
+        slowest = sorted(
+            (task for task in self.tasks.values() if task.elapsed),
+            key=lambda task: task.elapsed, reverse=True)
+        for task in slowest[:5]:
+            logging.debug("  %s: %.2fs", task.name, task.elapsed)
+
+        if error is not None:
+            raise error
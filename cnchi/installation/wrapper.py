@@ -31,6 +31,8 @@
 import subprocess
 import logging
 
+import storage.block_devices as block_devices
+
 from misc.extra import InstallError
 from misc.run_cmd import call
 
@@ -39,7 +41,10 @@ def wipefs(device, fatal=True):
     """ Wipe fs from device """
     err_msg = "Cannot wipe the filesystem of device {0}".format(device)
     cmd = ["wipefs", "-a", device]
-    call(cmd, msg=err_msg, fatal=fatal)
+    try:
+        call(cmd, msg=err_msg, fatal=fatal)
+    finally:
+        block_devices.invalidate()
 
 
 def dd(input_device, output_device, bs=512, count=2048, seek=0):
@@ -56,6 +61,8 @@ def dd(input_device, output_device, bs=512, count=2048, seek=0):
         subprocess.check_output(cmd, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as err:
         logging.warning("Command %s failed: %s", err.cmd, err.output)
+    finally:
+        block_devices.invalidate()
 
 
 def sgdisk(command, device):
@@ -67,6 +74,8 @@ def sgdisk(command, device):
         logging.error("Command %s failed: %s", err.cmd, err.output.decode())
         txt = _("Command {0} failed: {1}").format(err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def sgdisk_new(device, part_num, label, size, hex_code):
@@ -100,6 +109,8 @@ def sgdisk_new(device, part_num, label, size, hex_code):
         txt = _("Cannot create a new partition on device {0}. Command {1} has failed: {2}")
         txt = txt.format(device, err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def parted_set(device, number, flag, state):
@@ -113,6 +124,8 @@ def parted_set(device, number, flag, state):
         txt = "Cannot set flag {0} on device {1}. Command {2} has failed: {3}"
         txt = txt.format(flag, device, err.cmd, err.output.decode())
         logging.error(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def parted_mkpart(device, ptype, start, end, filesystem=""):
@@ -143,6 +156,8 @@ def parted_mkpart(device, ptype, start, end, filesystem=""):
         txt = _("Cannot create a new partition on device {0}. Command {1} has failed: {2}")
         txt = txt.format(device, err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def parted_mklabel(device, label_type="msdos"):
@@ -163,3 +178,5 @@ def parted_mklabel(device, label_type="msdos"):
                 "Command {1} failed: {2}")
         txt = txt.format(device, err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
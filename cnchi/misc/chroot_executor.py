@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# chroot_executor.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Runs commands inside a chroot without spawning chroot each time
+
+    ChrootExecutor starts a few helper processes that enter the chroot once
+    and then run the commands they receive through a pipe, sending back
+    their exit status and output. Some simple file operations (symlinks and
+    chown) are done directly by us, without running any command at all. """
+
+import multiprocessing
+import os
+import queue
+import subprocess
+import threading
+
+# Number of helper processes (commands can be run from several threads)
+MAX_HELPERS = 4
+
+_EXECUTORS = {}
+_LOCK = threading.Lock()
+
+
+def serve(conn, chroot_dir):
+    """ Helper process main loop: enters the chroot and runs commands """
+    os.chroot(chroot_dir)
+    os.chdir("/")
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        cmd, timeout = request
+        try:
+            proc = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=timeout)
+            conn.send(('done', proc.returncode, proc.stdout))
+        except subprocess.TimeoutExpired as err:
+            conn.send(('timeout', None, err.output or b''))
+        except OSError as err:
+            conn.send(('error', err.errno, err.strerror))
+    conn.close()
+
+
+class ChrootExecutor(object):
+    """ Pool of helper processes running commands inside chroot_dir """
+
+    def __init__(self, chroot_dir, helpers=MAX_HELPERS):
+        self.chroot_dir = chroot_dir
+        self.helpers = []
+        self.idle = queue.Queue()
+
+        # Cnchi has other threads running by now (downloads, event timers).
+        # Forking it could leave a helper stuck on a lock held by one of
+        # them, so helpers are forked from a clean forkserver process.
+        context = multiprocessing.get_context('forkserver')
+        for _index in range(max(1, helpers)):
+            parent_conn, child_conn = context.Pipe()
+            helper = context.Process(target=serve, args=(child_conn, chroot_dir))
+            helper.start()
+            child_conn.close()
+            self.helpers.append((helper, parent_conn))
+            self.idle.put(parent_conn)
+
+    def run(self, cmd, timeout=None):
+        """ Runs cmd inside the chroot and returns its output (bytes).
+            Raises subprocess.TimeoutExpired or OSError like subprocess does """
+        conn = self.idle.get()
+        try:
+            conn.send((list(cmd), timeout))
+            status, code, output = conn.recv()
+        finally:
+            self.idle.put(conn)
+
+        if status == 'timeout':
+            raise subprocess.TimeoutExpired(cmd, timeout, output)
+        if status == 'error':
+            raise OSError(code, output)
+        return output
+
+    def close(self):
+        """ Stops all helpers (they keep chroot_dir busy while running) """
+        for helper, conn in self.helpers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for helper, conn in self.helpers:
+            helper.join()
+            conn.close()
+        self.helpers = []
+
+
+def start(chroot_dir, helpers=MAX_HELPERS):
+    """ Starts an executor for chroot_dir. While it is running, chroot_call
+        uses it for all commands run inside chroot_dir """
+    chroot_dir = os.path.normpath(chroot_dir)
+    with _LOCK:
+        if chroot_dir not in _EXECUTORS:
+            _EXECUTORS[chroot_dir] = ChrootExecutor(chroot_dir, helpers)
+        return _EXECUTORS[chroot_dir]
+
+
+def stop(chroot_dir):
+    """ Stops the executor of chroot_dir (if any) """
+    with _LOCK:
+        executor = _EXECUTORS.pop(os.path.normpath(chroot_dir), None)
+    if executor is not None:
+        executor.close()
+
+
+def get_executor(chroot_dir):
+    """ Returns the running executor of chroot_dir (None if there is not one) """
+    return _EXECUTORS.get(os.path.normpath(chroot_dir))
+
+
+def get_host_path(chroot_dir, path):
+    """ Returns where an absolute path inside the chroot is, seen from
+        outside of it. Returns None if the path goes through a symlink, as
+        it would not point to the same place inside and outside the chroot """
+    if not os.path.isabs(path):
+        return None
+    host_path = os.path.normpath(os.path.join(chroot_dir, path.lstrip("/")))
+    if os.path.realpath(host_path) != host_path:
+        return None
+    return host_path
+
+
+def get_id(chroot_dir, database, name):
+    """ Returns the id of a user or group name (database is 'passwd' or
+        'group') as defined inside the chroot. None if it's not found """
+    if name.isdigit():
+        return int(name)
+    try:
+        with open(os.path.join(chroot_dir, "etc", database)) as database_file:
+            for line in database_file:
+                fields = line.split(":")
+                if len(fields) > 2 and fields[0] == name:
+                    return int(fields[2])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def symlink(chroot_dir, target, link_name):
+    """ ln -s target link_name. Returns False if it can't be done here """
+    host_path = get_host_path(chroot_dir, link_name)
+    if host_path is None or os.path.lexists(host_path):
+        return False
+    if not os.path.isdir(os.path.dirname(host_path)):
+        return False
+    os.symlink(target, host_path)
+    return True
+
+
+def chown(chroot_dir, owner, path, recursive=False):
+    """ chown [-R] user[:group] path. Returns False if it can't be done here """
+    user, sep, group = owner.partition(":")
+    if sep and not group:
+        # "user:" means user's login group
+        return False
+    uid = get_id(chroot_dir, "passwd", user) if user else -1
+    gid = get_id(chroot_dir, "group", group) if group else -1
+    host_path = get_host_path(chroot_dir, path)
+    if uid is None or gid is None or host_path is None or not os.path.exists(host_path):
+        return False
+
+    os.lchown(host_path, uid, gid)
+    if recursive and os.path.isdir(host_path):
+        # Like chown -R, symlinks are not followed
+        for root, dirs, files in os.walk(host_path):
+            for name in dirs + files:
+                os.lchown(os.path.join(root, name), uid, gid)
+    return True
+
+
+def run_file_op(cmd, chroot_dir):
+    """ Does simple file operations (ln -s, chown) without running them.
+        Returns their (empty) output, or None if cmd has to be run """
+    try:
+        if len(cmd) == 4 and cmd[:2] == ['ln', '-s']:
+            done = symlink(chroot_dir, cmd[2], cmd[3])
+        elif len(cmd) == 3 and cmd[0] == 'chown' and not cmd[1].startswith('-'):
+            done = chown(chroot_dir, cmd[1], cmd[2])
+        elif len(cmd) == 4 and cmd[:2] == ['chown', '-R']:
+            done = chown(chroot_dir, cmd[2], cmd[3], recursive=True)
+        else:
+            done = False
+    except OSError:
+        # Let the real command try it (and report the error)
+        done = False
+    return "" if done else None
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# event_bus.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Coalesces progress events before sending them to the GUI process """
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+# Max number of times per second events are sent to the GUI
+RATE = 10
+
+# These events are never coalesced (nor delayed)
+IMMEDIATE_EVENTS = ['error', 'finished', 'cache_pkgs_md5_check_failed']
+
+# Event type of a list of events sent at once
+BATCH_EVENT = 'batch'
+
+
+class EventBus(object):
+    """ Sits between event producers and the callback queue (it can be
+        used instead of it, as it has the same put_nowait method).
+        Only the last event of each type is kept (a percent or a text
+        replaces the previous one) and pending events are sent together,
+        in a single 'batch' event, at most RATE times per second. Errors
+        and other IMMEDIATE_EVENTS are sent right away (after the pending
+        ones, so order is kept). """
+
+    def __init__(self, callback_queue, rate=RATE):
+        self.callback_queue = callback_queue
+        self.interval = 1.0 / max(1, rate)
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_send = 0
+        self.timer = None
+
+    def put_nowait(self, event):
+        """ Adds an event """
+        event_type, event_text = event
+        with self.lock:
+            if event_type in IMMEDIATE_EVENTS:
+                events = list(self.pending.items())
+                self.pending.clear()
+                events.append((event_type, event_text))
+                self.send(events)
+                return
+
+            # Last value wins (and goes after the other pending events)
+            self.pending.pop(event_type, None)
+            self.pending[event_type] = event_text
+
+            if self.timer is None:
+                delay = max(0, self.last_send + self.interval - time.monotonic())
+                self.timer = threading.Timer(delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """ Sends all pending events now """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            events = list(self.pending.items())
+            self.pending.clear()
+            self.send(events)
+
+    def send(self, events):
+        """ Puts events in the callback queue. Lock must be held. """
+        if not events:
+            return
+        self.last_send = time.monotonic()
+        if len(events) == 1:
+            event = events[0]
+        else:
+            event = (BATCH_EVENT, events)
+        try:
+            self.callback_queue.put_nowait(event)
+        except queue.Full:
+            pass
+
+    def join(self):
+        """ Sends pending events and waits until the GUI has processed
+            all of them """
+        self.flush()
+        self.callback_queue.join()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# misc/http_session.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Shared HTTP sessions (keep-alive connection pools, one per host) """
+
+import logging
+import os
+import threading
+import urllib.parse
+
+import requests
+import requests.adapters
+
+# Max number of connections kept alive for each host
+POOL_MAXSIZE = 4
+
+_SESSIONS = {}
+_LOCK = threading.Lock()
+_PID = None
+
+
+def get_host(url):
+    """ Returns scheme and host of an url (http://host:port) """
+    parts = urllib.parse.urlsplit(url)
+    return "{0}://{1}".format(parts.scheme, parts.netloc)
+
+
+def create_session(pool_maxsize=POOL_MAXSIZE):
+    """ Creates a requests session with a bounded connection pool """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url, pool_maxsize=POOL_MAXSIZE):
+    """ Returns the session used to connect to url's host.
+        Sessions (and their sockets) can't be shared between processes,
+        so a forked process starts with an empty pool. """
+    global _PID
+
+    host = get_host(url)
+    with _LOCK:
+        if _PID != os.getpid():
+            _SESSIONS.clear()
+            _PID = os.getpid()
+        if host not in _SESSIONS:
+            logging.debug("Creating HTTP session for %s", host)
+            _SESSIONS[host] = create_session(pool_maxsize)
+        return _SESSIONS[host]
+
+
+def get(url, pool_maxsize=POOL_MAXSIZE, **kwargs):
+    """ Like requests.get but reusing a kept alive connection to url's host """
+    return get_session(url, pool_maxsize).get(url, **kwargs)
+
+
+def head(url, pool_maxsize=POOL_MAXSIZE, **kwargs):
+    """ Like requests.head but reusing a kept alive connection to url's host """
+    return get_session(url, pool_maxsize).head(url, **kwargs)
+
+
+def close_all():
+    """ Closes all sessions (and their connections) """
+    with _LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
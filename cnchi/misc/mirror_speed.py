@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mirror_speed.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Measures mirror speed downloading the first bytes of a file from
+    many mirrors at the same time (using asyncio) """
+
+import asyncio
+import collections
+import logging
+import ssl
+import urllib.parse
+
+# Number of mirrors tested at the same time
+CONCURRENCY = 16
+
+# Max seconds spent testing all mirrors
+TIME_BUDGET = 20
+
+# Max seconds spent testing one mirror
+TIMEOUT = 5
+
+# Bytes downloaded from each mirror (using a HTTP Range request)
+SAMPLE_SIZE = 256 * 1024
+
+# Stop testing when this many mirrors are at least this fast (bytes/s)
+ENOUGH_FAST = 10
+FAST_RATE = 2 * 1024 * 1024
+
+BLOCK_SIZE = 16 * 1024
+
+# Redirections followed when testing a mirror
+MAX_REDIRECTS = 3
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+# rate is bytes/s (0 if the mirror failed), latency is the time until
+# the response arrived and elapsed the time spent downloading the sample
+SpeedResult = collections.namedtuple(
+    'SpeedResult',
+    ['url', 'rate', 'latency', 'elapsed', 'size'])
+
+
+class MirrorError(Exception):
+    """ The mirror answered, but not with the file we asked for """
+    pass
+
+
+class MirrorSpeedTest(object):
+    """ Tests download speed of a list of urls (one per mirror) """
+
+    def __init__(self, concurrency=CONCURRENCY, time_budget=TIME_BUDGET,
+                 timeout=TIMEOUT, sample_size=SAMPLE_SIZE,
+                 enough_fast=ENOUGH_FAST, fast_rate=FAST_RATE):
+        self.concurrency = max(1, concurrency)
+        self.time_budget = time_budget
+        self.timeout = timeout
+        self.sample_size = sample_size
+        self.enough_fast = enough_fast
+        self.fast_rate = fast_rate
+        self.results = {}
+        self.fast_mirrors = 0
+        self.ssl_context = None
+
+    def run(self, urls):
+        """ Tests all urls. Returns a dict with a SpeedResult for each
+            tested url. Urls left untested (because the time budget ran
+            out or enough fast mirrors were found) are not in it """
+        self.results = {}
+        self.fast_mirrors = 0
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.test_urls(list(urls)))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        return self.results
+
+    def has_enough(self):
+        """ Checks if we already have enough fast mirrors """
+        return self.enough_fast > 0 and self.fast_mirrors >= self.enough_fast
+
+    async def test_urls(self, urls):
+        """ Tests urls (concurrency at a time) until all have been tested,
+            time is up or we have enough fast mirrors """
+        if not urls:
+            return
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.time_budget
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        pending = set(
+            asyncio.ensure_future(self.test_url_limited(url, semaphore))
+            for url in urls)
+
+        while pending and not self.has_enough():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logging.debug("Mirror speed test time budget is over")
+                break
+            __, pending = await asyncio.wait(
+                pending,
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED)
+
+        if pending:
+            # Cancel the rest and wait for them to close their connections
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+
+    async def test_url_limited(self, url, semaphore):
+        """ Tests url when there is a free slot """
+        async with semaphore:
+            if self.has_enough():
+                return
+            try:
+                result = await asyncio.wait_for(self.test_url(url), self.timeout)
+            except (OSError, EOFError, ValueError, MirrorError,
+                    asyncio.TimeoutError, asyncio.IncompleteReadError) as err:
+                logging.debug("Can't test mirror %s: %s", url, err)
+                result = SpeedResult(url, 0, None, None, 0)
+            self.results[url] = result
+            if result.rate >= self.fast_rate:
+                self.fast_mirrors += 1
+
+    def get_ssl_context(self):
+        """ Returns a default ssl context (created only once) """
+        if self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        return self.ssl_context
+
+    async def open_url(self, url):
+        """ Sends a GET request for the first sample_size bytes of url.
+            Returns reader, writer, status code and headers (lowercase) """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == 'https':
+            port = parts.port or 443
+            context = self.get_ssl_context()
+        elif parts.scheme == 'http':
+            port = parts.port or 80
+            context = None
+        else:
+            raise MirrorError("Unsupported url {0}".format(url))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port, ssl=context)
+        try:
+            request = (
+                "GET {0} HTTP/1.1\r\n"
+                "Host: {1}\r\n"
+                "User-Agent: Mozilla/5.0\r\n"
+                "Range: bytes=0-{2}\r\n"
+                "Connection: close\r\n\r\n").format(
+                    path, parts.netloc, self.sample_size - 1)
+            writer.write(request.encode('ascii'))
+            await writer.drain()
+
+            # Status line: HTTP/1.1 206 Partial Content
+            status = (await reader.readline()).decode('latin-1').split()
+            if len(status) < 2 or not status[1].isdigit():
+                raise MirrorError("Unexpected answer {0}".format(' '.join(status)))
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise EOFError("Connection closed")
+                if line in [b'\r\n', b'\n']:
+                    break
+                name, __, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except BaseException:
+            await close_writer(writer)
+            raise
+
+        return reader, writer, int(status[1]), headers
+
+    async def read_body(self, reader, chunked):
+        """ Reads (at most) the first sample_size bytes of the body.
+            Returns how many bytes have been read """
+        size = 0
+        while size < self.sample_size:
+            if chunked:
+                # Chunk size (hex) line, maybe followed by extensions
+                line = await reader.readline()
+                if not line:
+                    break
+                chunk_size = int(line.split(b';')[0].strip(), 16)
+                if chunk_size == 0:
+                    break
+                to_read = min(chunk_size, self.sample_size - size)
+                data = await reader.readexactly(to_read)
+                size += len(data)
+                if to_read < chunk_size:
+                    # We have enough, no need to read the rest of the chunk
+                    break
+                # CRLF after chunk data
+                await reader.readline()
+            else:
+                data = await reader.read(min(BLOCK_SIZE, self.sample_size - size))
+                if not data:
+                    break
+                size += len(data)
+        return size
+
+    async def test_url(self, url):
+        """ Downloads the first sample_size bytes of url
+            (following up to MAX_REDIRECTS redirections) """
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+
+        location = url
+        for __ in range(MAX_REDIRECTS + 1):
+            reader, writer, status, headers = await self.open_url(location)
+            if status in REDIRECT_CODES and headers.get('location'):
+                # Many mirrors redirect to a CDN or to another server
+                await close_writer(writer)
+                location = urllib.parse.urljoin(location, headers['location'])
+                continue
+            break
+        else:
+            raise MirrorError("Too many redirections")
+
+        try:
+            latency = loop.time() - start
+            if status not in [200, 206]:
+                raise MirrorError("Unexpected answer {0}".format(status))
+
+            # Mirrors that do not support ranges send the whole file,
+            # just read the first sample_size bytes of it
+            chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+            transfer_start = loop.time()
+            size = await self.read_body(reader, chunked)
+            elapsed = loop.time() - transfer_start
+        finally:
+            await close_writer(writer)
+
+        if size == 0:
+            raise MirrorError("Empty answer")
+
+        # Tiny files are downloaded too fast to be measured
+        rate = size / max(elapsed, 0.001)
+        return SpeedResult(url, rate, latency, elapsed, size)
+
+
+async def close_writer(writer):
+    """ Closes a connection and waits until it is really closed """
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        # The server may have closed it first
+        pass
@@ -37,6 +37,7 @@ import os
 import shutil
 
 from misc.extra import InstallError, raised_privileges
+import misc.chroot_executor as chroot_executor
 
 DEST_DIR = "/install"
 
@@ -124,7 +125,14 @@ def call(cmd, warning=True, error=False, fatal=False, msg=None, timeout=None,
 
 def chroot_call(cmd, chroot_dir=DEST_DIR, fatal=False, msg=None, timeout=None,
                 stdin=None):
-    """ Runs command inside the chroot """
+    """ Runs command inside the chroot
+        Simple file operations (ln -s, chown) are done without running any
+        command. While a chroot executor is running for chroot_dir, commands
+        are run by its helpers instead of spawning chroot each time """
+    output = chroot_executor.run_file_op(cmd, chroot_dir)
+    if output is not None:
+        return output
+
     full_cmd = ['chroot', chroot_dir]
 
     for element in cmd:
@@ -133,13 +141,18 @@ def chroot_call(cmd, chroot_dir=DEST_DIR, fatal=False, msg=None, timeout=None,
     if not os.environ.get('CNCHI_RUNNING', False):
         os.environ['CNCHI_RUNNING'] = 'True'
 
+    executor = chroot_executor.get_executor(chroot_dir)
+    proc = None
     try:
-        proc = subprocess.Popen(
-            full_cmd,
-            stdin=stdin,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT)
-        stdout_data, stderr_data = proc.communicate(timeout=timeout)
+        if executor is not None and stdin is None:
+            stdout_data = executor.run(cmd, timeout=timeout)
+        else:
+            proc = subprocess.Popen(
+                full_cmd,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+            stdout_data, stderr_data = proc.communicate(timeout=timeout)
         stdout_data = stdout_data.decode().strip()
         if stdout_data:
             logging.debug(stdout_data)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# state_files.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Where Cnchi keeps its own state files (download journal, hash
+    indexes, sync database validators...)
+
+    They are stored in the live system, never in the installed system
+    nor in the user's cache directories """
+
+import hashlib
+import logging
+import os
+
+STATE_DIR = '/var/cache/cnchi/state'
+
+
+def get_path(directory, name):
+    """ Returns the path of the state file name that belongs to directory """
+    directory = os.path.realpath(directory)
+    key = hashlib.sha1(directory.encode('utf-8')).hexdigest()[:16]
+    try:
+        os.makedirs(STATE_DIR, mode=0o755, exist_ok=True)
+    except OSError as err:
+        logging.debug("Can't create %s: %s", STATE_DIR, err)
+    return os.path.join(STATE_DIR, "{0}-{1}.json".format(name, key))
+
@@ -30,22 +30,64 @@
 
 """ Creates mirrorlist sorted by both latest updates and fastest connection """
 
-import queue
-import threading
-import urllib.request
-import urllib.error
-import http.client
+import collections
+import json
 import subprocess
 import logging
 import time
 import os
 import shutil
-import tempfile
 import multiprocessing
 
 import requests
 
 import misc.extra as misc
+import misc.http_session as http_session
+import misc.mirror_speed as mirror_speed
+
+# Saved mirror rankings (see AutoRankmirrorsProcess.load_ranking_cache)
+RANKING_CACHE_NAME = "cnchi-mirror-ranking.json"
+
+# Seconds a saved ranking is valid
+RANKING_CACHE_TTL = 6 * 60 * 60
+
+# When using a saved ranking, only these best mirrors are tested again
+RECHECK_TOP = 8
+
+
+def get_network_fingerprint():
+    """ Identifies the network we are connected to by the IP and MAC
+        address of the default gateway. Returns None if unknown """
+    gateway = None
+    try:
+        with open('/proc/net/route') as route_file:
+            # Iface Destination Gateway Flags ...
+            for line in route_file.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == '00000000':
+                    # Gateway address is little endian hex
+                    gateway = '.'.join(
+                        str(int(fields[2][i:i + 2], 16)) for i in range(6, -1, -2))
+                    break
+    except (OSError, ValueError) as err:
+        logging.debug("Can't read routing table: %s", err)
+
+    if gateway is None:
+        return None
+
+    mac = ''
+    try:
+        with open('/proc/net/arp') as arp_file:
+            # IP address HW type Flags HW address Mask Device
+            for line in arp_file.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 3 and fields[0] == gateway:
+                    mac = fields[3]
+                    break
+    except OSError as err:
+        logging.debug("Can't read arp table: %s", err)
+
+    return "{0}/{1}".format(gateway, mac)
 
 
 class AutoRankmirrorsProcess(multiprocessing.Process):
@@ -59,8 +101,9 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
         self.antergos_mirrorlist = "/etc/pacman.d/antergos-mirrorlist"
         self.arch_mirrorlist = "/etc/pacman.d/mirrorlist"
         self.arch_mirror_status = "http://www.archlinux.org/mirrors/status/json/"
-        self.arch_mirrorlist_ranked = []
+        self.antergos_autoselect = "http://mirrors.antergos.com/$repo/$arch"
         self.settings = settings
+        self.network_fingerprint = None
 
     @staticmethod
     def is_good_mirror(m):
@@ -110,7 +153,7 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
 
         if not self.json_obj:
             try:
-                req = requests.get(
+                req = http_session.get(
                     self.arch_mirror_status,
                     headers={'User-Agent': 'Mozilla/5.0'}
                 )
@@ -136,15 +179,9 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
         return mirrors
 
     @staticmethod
-    def sort_mirrors_by_speed(mirrors=None, threads=5):
-        # Ensure that "mirrors" is a list and not a generator.
-        if not isinstance(mirrors, list):
-            mirrors = list(mirrors)
-
-        threads = min(threads, len(mirrors))
-
-        rates = {}
-
+    def get_test_subpath():
+        """ Returns the path (inside an Arch mirror) of the file
+            used to test mirror speed """
         # Check version of cryptsetup pkg (used to test mirror speed)
         try:
             cmd = ["pacman", "-Ss", "cryptsetup"]
@@ -155,53 +192,58 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
             logging.debug(err)
             version = False
 
-        # URL input queue.Queue
-        q_in = queue.Queue()
-        # URL and rate output queue.Queue
-        q_out = queue.Queue()
-
-        def worker():
-            """ worker thread. Retrieves data to test mirror speed """
-            while True:
-                url = q_in.get()
-                if version:
-                    db_subpath = 'core/os/x86_64/cryptsetup-{0}-x86_64.pkg.tar.xz'
-                    db_subpath = db_subpath.format(version)
-                else:
-                    db_subpath = 'core/os/x86_64/core.db.tar.gz'
-                db_url = url + db_subpath
-                # Leave the rate as 0 if the connection fails.
-                # TODO: Consider more graceful error handling.
-                rate = 0
-                dt = float('NaN')
-
-                req = urllib.request.Request(url=db_url)
-                try:
-                    t0 = time.time()
-                    with urllib.request.urlopen(req, None, 5) as f:
-                        size = len(f.read())
-                        dt = time.time() - t0
-                        rate = size / dt
-                except (OSError,
-                        urllib.error.HTTPError,
-                        http.client.HTTPException):
-                    pass
-                q_out.put((url, rate, dt))
-                q_in.task_done()
-
-        # Launch threads
-        for i in range(threads):
-            t = threading.Thread(target=worker)
-            t.start()
-
-        # Load the input queue.Queue
-        url_len = 0
-        for mirror in mirrors:
-            url_len = max(url_len, len(mirror['url']))
-            logging.debug("Rating mirror '%s'", mirror['url'])
-            q_in.put(mirror['url'])
+        if version:
+            db_subpath = 'core/os/x86_64/cryptsetup-{0}-x86_64.pkg.tar.xz'
+            return db_subpath.format(version)
+        return 'core/os/x86_64/core.db.tar.gz'
+
+    def get_speed_test(self):
+        """ Returns a MirrorSpeedTest configured from our settings """
+        concurrency = self.settings.get('rankmirrors_concurrency')
+        time_budget = self.settings.get('rankmirrors_time_budget')
+        return mirror_speed.MirrorSpeedTest(
+            concurrency=concurrency or mirror_speed.CONCURRENCY,
+            time_budget=time_budget or mirror_speed.TIME_BUDGET)
+
+    def get_antergos_mirrors(self):
+        """ Returns Antergos mirror urls (commented or not) found in
+            antergos-mirrorlist. Auto selection urls are left out """
+        mirrors = []
+        if not os.path.exists(self.antergos_mirrorlist):
+            return mirrors
+        with open(self.antergos_mirrorlist) as mirrorlist:
+            for line in mirrorlist:
+                line = line.strip().lstrip('#').strip()
+                if not line.startswith('Server'):
+                    continue
+                url = line.split('=', 1)[-1].strip()
+                if url == self.antergos_autoselect or 'sourceforge' in url:
+                    continue
+                if url not in mirrors:
+                    mirrors.append(url)
+        return mirrors
+
+    def measure_mirrors(self, arch_mirrors, antergos_mirrors):
+        """ Tests Arch and Antergos mirrors at the same time.
+            Returns throughput (bytes/s, 0 if the mirror failed) and latency
+            of each tested mirror """
+        test_urls = collections.OrderedDict()
+
+        # Antergos mirrors go first, they are far fewer and must not be
+        # left out if the test stops early
+        arch = os.uname()[-1]
+        for url in antergos_mirrors:
+            test_url = url.replace('$repo', 'antergos').replace('$arch', arch)
+            test_urls[test_url + '/antergos.db'] = url
 
-        q_in.join()
+        db_subpath = self.get_test_subpath()
+        for url in arch_mirrors:
+            test_urls[url + db_subpath] = url
+
+        results = self.get_speed_test().run(test_urls.keys())
+
+        stats = {}
+        url_len = max([len(url) for url in test_urls.values()] or [0])
 
         # Log some extra data.
         url_len = str(url_len)
@@ -213,88 +255,34 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
 
         fmt = '%-' + url_len + 's  %8.2f KiB/s  %7.2f s'
 
-        # Loop over the mirrors just to ensure that we get the rate for each.
-        # The value in the loop does not (necessarily) correspond to the mirror.
-        for mirror in mirrors:
-            url, rate, dt = q_out.get()
-            kibps = rate / 1024.0
-            logging.debug(fmt, url, kibps, dt)
-            rates[url] = rate
-            q_out.task_done()
-
-        # Sort by rate.
-        rated_mirrors = [m for m in mirrors if rates[m['url']] > 0]
-        rated_mirrors.sort(key=lambda m: rates[m['url']], reverse=True)
-
-        return rated_mirrors
-
-    def uncomment_antergos_mirrors(self):
-        """ Uncomment Antergos mirrors and comment out auto selection so
-        rankmirrors can find the best mirror. """
-
-        autoselect = "http://mirrors.antergos.com/$repo/$arch"
-        autoselect_on = True
-        autoselect_sf = True
-
-        if os.path.exists(self.antergos_mirrorlist):
-            with open(self.antergos_mirrorlist) as mirrors:
-                lines = [x.strip() for x in mirrors.readlines()]
-
-            for i in range(len(lines)):
-                srv_comment = lines[i].startswith("#Server")
-                srv = lines[i].startswith("Server")
-
-                if autoselect_on and srv and autoselect in lines[i]:
-                    # Comment out auto selection
-                    lines[i] = "#" + lines[i]
-                    autoselect_on = False
-                elif autoselect_sf and srv and 'sourceforge' in lines[i]:
-                    # Comment out sourceforge auto selection url
-                    lines[i] = "#" + lines[i]
-                    autoselect_sf = False
-                elif srv_comment and autoselect not in lines[i] and 'sourceforge' not in lines[i]:
-                    # Uncomment Antergos mirror
-                    lines[i] = lines[i].lstrip("#")
-
-            with misc.raised_privileges() as __:
-                # Write new one
-                with open(self.antergos_mirrorlist, 'w') as mirrors:
-                    mirrors.write("\n".join(lines) + "\n")
-            self.sync()
-
-    def run_rankmirrors(self):
-        if os.path.exists("/usr/bin/rankmirrors"):
-            self.uncomment_antergos_mirrors()
-
-            with misc.raised_privileges() as __:
-                try:
-                    # Store rankmirrors output in a temporary file
-                    with tempfile.TemporaryFile(mode='w+t') as temp_file:
-                        cmd = [
-                            'rankmirrors',
-                            '-n', '0',
-                            '-r', 'antergos',
-                            self.antergos_mirrorlist]
-                        subprocess.call(cmd, stdout=temp_file)
-                        temp_file.seek(0)
-                        # Copy new mirrorlist to the old one
-                        with open(self.antergos_mirrorlist, 'w') as antergos_mirrorlist_file:
-                            antergos_mirrorlist_file.write(temp_file.read())
-                except subprocess.CalledProcessError as why:
-                    logging.debug(
-                        'Cannot run rankmirrors on Antergos mirrorlist: %s',
-                        why)
-            self.sync()
-
-    def filter_and_sort_arch_mirrorlist(self):
-        output = '# Arch Linux mirrorlist generated by Cnchi #\n'
-        mlist = self.get_mirror_stats()
-        mirrors = self.sort_mirrors_by_speed(mirrors=mlist)
+        for test_url, result in results.items():
+            url = test_urls[test_url]
+            stats[url] = {'rate': result.rate, 'latency': result.latency}
+            if result.rate > 0:
+                logging.debug(fmt, url, result.rate / 1024.0, result.latency + result.elapsed)
+
+        logging.debug("%d of %d mirrors tested", len(results), len(test_urls))
+        return stats
+
+    @staticmethod
+    def sort_by_rate(urls, stats):
+        """ Sorts urls by rate. Mirrors that failed are left out, and the
+            ones that were not tested go last, in their original order. """
+        rated = [url for url in urls if url in stats and stats[url]['rate'] > 0]
+        rated.sort(key=lambda url: stats[url]['rate'], reverse=True)
+        rated.extend([url for url in urls if url not in stats])
+        return rated
+
+    def write_arch_mirrorlist(self, mirrors):
+        """ Writes Arch mirrorlist (mirrors must be sorted already) """
+        if not mirrors:
+            logging.warning("No Arch mirror is available, mirrorlist won't be modified")
+            return
 
+        output = '# Arch Linux mirrorlist generated by Cnchi #\n'
         for mirror in mirrors:
-            self.arch_mirrorlist_ranked.append(mirror['url'])
             output += "Server = {0}{1}/os/{2}\n".format(
-                mirror['url'],
+                mirror,
                 '$repo',
                 '$arch'
             )
@@ -305,6 +293,127 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
                 arch_mirrors.write(output)
         self.sync()
 
+    def write_antergos_mirrorlist(self, mirrors, all_mirrors):
+        """ Writes Antergos mirrorlist (mirrors must be sorted already).
+            Mirrors that failed are kept, but commented out """
+        if not mirrors:
+            logging.warning("No Antergos mirror is available, mirrorlist won't be modified")
+            return
+
+        output = '# Antergos mirrorlist generated by Cnchi #\n'
+        for mirror in mirrors:
+            output += "Server = {0}\n".format(mirror)
+
+        failed = [mirror for mirror in all_mirrors if mirror not in mirrors]
+        if failed:
+            output += '\n# These mirrors failed the speed test\n'
+            for mirror in failed:
+                output += "#Server = {0}\n".format(mirror)
+
+        output += '\n# Automatically select a mirror\n'
+        output += "#Server = {0}\n".format(self.antergos_autoselect)
+
+        with misc.raised_privileges() as __:
+            with open(self.antergos_mirrorlist, 'w') as antergos_mirrors:
+                antergos_mirrors.write(output)
+        self.sync()
+
+    def get_ranking_cache_path(self):
+        """ Returns where mirror rankings are saved (in our state dir or in
+            the first xz cache dir, as both survive between installs).
+            Returns None if rankings can't be saved """
+        cache_dir = self.settings.get('rankmirrors_cache_dir')
+        if not cache_dir:
+            xz_cache = self.settings.get('xz_cache')
+            if xz_cache:
+                cache_dir = xz_cache[0]
+        if not cache_dir:
+            return None
+        return os.path.join(cache_dir, RANKING_CACHE_NAME)
+
+    def load_ranking_cache(self):
+        """ Returns a saved mirror ranking if it is recent enough and was
+            made in this same network. Returns None otherwise """
+        path = self.get_ranking_cache_path()
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path) as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError) as err:
+            logging.debug("Can't read saved mirror ranking %s: %s", path, err)
+            return None
+
+        ttl = self.settings.get('rankmirrors_cache_ttl') or RANKING_CACHE_TTL
+        age = time.time() - cache.get('timestamp', 0)
+        if age < 0 or age > ttl:
+            logging.debug("Saved mirror ranking is too old (%d s)", age)
+            return None
+
+        if self.network_fingerprint is None or \
+                cache.get('fingerprint') != self.network_fingerprint:
+            logging.debug("Saved mirror ranking was made in another network")
+            return None
+
+        for key in ['arch_mirrors', 'antergos_mirrors', 'stats']:
+            if key not in cache:
+                return None
+
+        logging.debug("Using saved mirror ranking (%d s old)", age)
+        return cache
+
+    def save_ranking_cache(self, cache):
+        """ Saves mirror ranking, so next installs can use it """
+        path = self.get_ranking_cache_path()
+        if path is None or self.network_fingerprint is None:
+            return
+
+        cache['fingerprint'] = self.network_fingerprint
+        temp_path = path + '.tmp'
+        with misc.raised_privileges() as __:
+            try:
+                os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+                with open(temp_path, 'w') as cache_file:
+                    json.dump(cache, cache_file)
+                os.replace(temp_path, path)
+            except OSError as err:
+                logging.debug("Can't save mirror ranking to %s: %s", path, err)
+
+    def rank_mirrors(self, cache=None):
+        """ Ranks Arch and Antergos mirrors and writes both mirrorlists.
+            If a saved ranking is given, only its best mirrors are tested """
+        if cache is None:
+            arch_mirrors = [mirror['url'] for mirror in self.get_mirror_stats()]
+            antergos_mirrors = self.get_antergos_mirrors()
+            stats = self.measure_mirrors(arch_mirrors, antergos_mirrors)
+            cache = {'timestamp': time.time()}
+        else:
+            arch_mirrors = cache['arch_mirrors']
+            antergos_mirrors = cache['antergos_mirrors']
+            stats = cache['stats']
+            top = self.sort_by_rate(antergos_mirrors + arch_mirrors, stats)[:RECHECK_TOP]
+            stats.update(self.measure_mirrors(
+                [url for url in arch_mirrors if url in top],
+                [url for url in antergos_mirrors if url in top]))
+
+        # The timestamp is kept when updating a saved ranking, so all
+        # mirrors are tested again when it expires
+        cache['arch_mirrors'] = arch_mirrors
+        cache['antergos_mirrors'] = antergos_mirrors
+        cache['stats'] = stats
+        self.save_ranking_cache(cache)
+
+        self.write_arch_mirrorlist(self.sort_by_rate(arch_mirrors, stats))
+        self.write_antergos_mirrorlist(
+            self.sort_by_rate(antergos_mirrors, stats),
+            antergos_mirrors)
+
+        # One list with all mirrors, so downloads can prefer the fastest ones
+        ranked = self.sort_by_rate(antergos_mirrors + arch_mirrors, stats)
+        self.settings.set('rankmirrors_result', ranked)
+        self.settings.set('rankmirrors_stats', stats)
+
     def run(self):
         """ Run process """
 
@@ -312,16 +421,17 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
         while not misc.has_connection():
             time.sleep(2)  # Delay, try again after 2 seconds
 
-        logging.debug("Updating both mirrorlists (Arch and Antergos)...")
-        self.update_mirrorlist()
+        self.network_fingerprint = get_network_fingerprint()
+        cache = self.load_ranking_cache()
+
+        if cache is None:
+            logging.debug("Updating both mirrorlists (Arch and Antergos)...")
+            self.update_mirrorlist()
 
-        logging.debug("Filtering and sorting Arch mirrors...")
-        self.filter_and_sort_arch_mirrorlist()
+        logging.debug("Ranking Arch and Antergos mirrors...")
+        self.rank_mirrors(cache)
 
-        logging.debug("Running rankmirrors command to sort Antergos mirrors...")
-        self.run_rankmirrors()
-        self.arch_mirrorlist_ranked = [x for x in self.arch_mirrorlist_ranked if x]
-        self.settings.set('rankmirrors_result', self.arch_mirrorlist_ranked)
+        http_session.close_all()
 
         logging.debug("Auto mirror selection has been run successfully.")
 
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# benchmark_settings.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Compares the shared memory settings store with the previous one slot
+    queue store. Run it with python tests/benchmark_settings.py """
+
+import multiprocessing
+import os
+import sys
+import time
+
+CNCHI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if CNCHI_DIR not in sys.path:
+    sys.path.insert(0, CNCHI_DIR)
+
+import config
+
+
+class QueueSettings(config.Settings):
+    """ Previous settings store (the whole dict lives in a one slot queue).
+        Only used to compare it with the shared memory store """
+
+    def __init__(self):
+        self.queue = multiprocessing.Queue(1)
+        self.queue.put(config.Settings()._get_settings())
+
+    def _get_settings(self):
+        settings = self.queue.get()
+        self.queue.put(settings)
+        return settings
+
+    def set(self, key, value):
+        settings = self.queue.get()
+        settings[key] = value
+        self.queue.put(settings)
+
+
+def _benchmark_reader(settings, iterations, results):
+    """ Reads settings from another process (as the installation does) """
+    start = time.time()
+    for _index in range(iterations):
+        settings.get('download_threads')
+    results.put(time.time() - start)
+
+
+def benchmark(iterations=20000):
+    """ Compares get/set throughput of the one slot queue store with the
+        shared memory store, both in the same process and while another
+        process reads settings and this one keeps changing them """
+
+    for name, store_class in [('queue', QueueSettings), ('shared memory', config.Settings)]:
+        store = store_class()
+
+        start = time.time()
+        for _index in range(iterations):
+            store.get('download_threads')
+        get_time = time.time() - start
+
+        start = time.time()
+        for index in range(iterations // 10):
+            store.set('rankmirrors_result', str(index))
+        set_time = time.time() - start
+
+        results = multiprocessing.Queue()
+        reader = multiprocessing.Process(
+            target=_benchmark_reader, args=(store, iterations, results))
+        reader.start()
+        index = 0
+        while reader.is_alive() and results.empty():
+            store.set('rankmirrors_result', str(index))
+            index += 1
+            time.sleep(0.01)
+        cross_time = results.get()
+        reader.join()
+
+        print("{0}: {1:.0f} get/s, {2:.0f} set/s, {3:.0f} get/s from another "
+              "process while this one sets".format(
+                  name, iterations / get_time, (iterations // 10) / set_time,
+                  iterations / cross_time))
+
+
+if __name__ == '__main__':
+    benchmark()
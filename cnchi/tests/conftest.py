@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# conftest.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Makes Cnchi modules importable from the tests (as they are when
+    Cnchi runs) """
+
+import builtins
+import os
+import sys
+
+CNCHI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in [CNCHI_DIR, os.path.join(CNCHI_DIR, 'installation')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Cnchi installs gettext's _ as a builtin
+if not hasattr(builtins, '_'):
+    builtins._ = lambda message: message
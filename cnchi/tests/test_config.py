@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_config.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests for the settings shared between Cnchi processes """
+
+import multiprocessing
+
+import pytest
+
+pytest.importorskip('strictyaml')
+
+import config
+
+
+def set_in_child(settings, key, value):
+    """ Changes a setting from another process """
+    settings.set(key, value)
+
+
+def get_in_child(settings, key, results):
+    """ Reads a setting from another process """
+    results.put(settings.get(key))
+
+
+def test_defaults():
+    settings = config.Settings()
+    assert settings.get('bootloader') == 'grub2'
+    assert settings.get('xz_cache') == []
+    assert settings.get('not_a_setting') is None
+
+
+def test_version_changes_on_set():
+    settings = config.Settings()
+    version = settings.version.value
+    settings.set('hostname', 'antergos')
+    assert settings.version.value == version + 1
+    assert settings.get('hostname') == 'antergos'
+
+
+def test_cache_is_used_until_version_changes():
+    settings = config.Settings()
+    settings.set('hostname', 'antergos')
+    cached = settings.cache
+    settings.get('hostname')
+    assert settings.cache is cached
+
+    settings.set('hostname', 'other')
+    assert settings.cache is not cached
+    assert settings.get('hostname') == 'other'
+
+
+def test_stale_local_copy_is_reloaded():
+    settings = config.Settings()
+    settings.set('hostname', 'antergos')
+    # Another process has changed the snapshot since we read it
+    settings.cache = (settings.cache[0] - 1, {'hostname': 'stale'})
+    assert settings.get('hostname') == 'antergos'
+
+
+def test_mutable_values_are_copied():
+    settings = config.Settings()
+    settings.set('xz_cache', ['/a'])
+    value = settings.get('xz_cache')
+    value.append('/b')
+    assert settings.get('xz_cache') == ['/a']
+
+
+def test_set_appends_to_lists():
+    settings = config.Settings()
+    settings.set('cache_pkgs_md5_check_failed', ['a'])
+    settings.set('cache_pkgs_md5_check_failed', 'b')
+    assert settings.get('cache_pkgs_md5_check_failed') == ['a', 'b']
+
+
+def test_buffer_too_small():
+    settings = config.Settings(buffer_size=64 * 1024)
+    with pytest.raises(ValueError):
+        settings.set('big', 'x' * 64 * 1024)
+    # Settings are not changed
+    assert settings.get('big') is None
+
+
+def test_changes_are_seen_by_other_processes():
+    settings = config.Settings()
+    settings.get('hostname')
+
+    child = multiprocessing.Process(target=set_in_child, args=(settings, 'hostname', 'child'))
+    child.start()
+    child.join()
+    assert settings.get('hostname') == 'child'
+
+    settings.set('hostname', 'parent')
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=get_in_child, args=(settings, 'hostname', results))
+    child.start()
+    assert results.get(timeout=10) == 'parent'
+    child.join()
+
+
+def test_wait_for():
+    settings = config.Settings()
+    assert not settings.wait_for('user_info_done', True, timeout=0.1)
+
+    child = multiprocessing.Process(
+        target=set_in_child, args=(settings, 'user_info_done', True))
+    child.start()
+    assert settings.wait_for('user_info_done', True, timeout=10)
+    child.join()
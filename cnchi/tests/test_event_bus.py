@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_event_bus.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests for the event bus that coalesces progress events """
+
+import queue
+import time
+
+from misc import event_bus
+from misc.event_bus import EventBus, BATCH_EVENT
+
+
+def get_events(callback_queue):
+    """ Returns all events in the queue (batches are expanded) """
+    events = []
+    while True:
+        try:
+            event_type, event_text = callback_queue.get_nowait()
+        except queue.Empty:
+            return events
+        if event_type == BATCH_EVENT:
+            events.extend(event_text)
+        else:
+            events.append((event_type, event_text))
+
+
+def make_bus(callback_queue):
+    """ Returns a bus that has just sent events, so the next ones wait
+        (one second) for the timer or for a flush """
+    bus = EventBus(callback_queue, rate=1)
+    bus.last_send = time.monotonic()
+    return bus
+
+
+def test_last_event_of_each_type_wins():
+    callback_queue = queue.Queue()
+    bus = make_bus(callback_queue)
+    bus.put_nowait(('percent', 0.1))
+    bus.put_nowait(('info', 'Downloading'))
+    bus.put_nowait(('percent', 0.2))
+    bus.put_nowait(('percent', 0.3))
+    assert callback_queue.empty()
+
+    bus.flush()
+    assert get_events(callback_queue) == [('info', 'Downloading'), ('percent', 0.3)]
+
+
+def test_pending_events_are_sent_in_one_batch():
+    callback_queue = queue.Queue()
+    bus = make_bus(callback_queue)
+    bus.put_nowait(('percent', 0.1))
+    bus.put_nowait(('info', 'Downloading'))
+    bus.flush()
+    assert callback_queue.qsize() == 1
+    event_type, events = callback_queue.get_nowait()
+    assert event_type == BATCH_EVENT
+    assert events == [('percent', 0.1), ('info', 'Downloading')]
+
+
+def test_single_event_is_not_batched():
+    callback_queue = queue.Queue()
+    bus = make_bus(callback_queue)
+    bus.put_nowait(('percent', 0.5))
+    bus.flush()
+    assert callback_queue.get_nowait() == ('percent', 0.5)
+
+
+def test_immediate_events_go_after_pending_ones():
+    callback_queue = queue.Queue()
+    bus = make_bus(callback_queue)
+    bus.put_nowait(('info', 'Installing'))
+    bus.put_nowait(('error', 'Something failed'))
+    # Sent right away, without waiting for the timer
+    assert get_events(callback_queue) == [
+        ('info', 'Installing'), ('error', 'Something failed')]
+
+
+def test_immediate_events_are_not_coalesced():
+    callback_queue = queue.Queue()
+    bus = make_bus(callback_queue)
+    for event_type in event_bus.IMMEDIATE_EVENTS:
+        bus.put_nowait((event_type, 'first'))
+        bus.put_nowait((event_type, 'second'))
+    expected = []
+    for event_type in event_bus.IMMEDIATE_EVENTS:
+        expected.extend([(event_type, 'first'), (event_type, 'second')])
+    assert get_events(callback_queue) == expected
+
+
+def test_timer_sends_pending_events():
+    callback_queue = queue.Queue()
+    bus = EventBus(callback_queue, rate=100)
+    bus.put_nowait(('percent', 0.4))
+    deadline = time.monotonic() + 5
+    while callback_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert get_events(callback_queue) == [('percent', 0.4)]
+
+
+def test_flush_without_events_sends_nothing():
+    callback_queue = queue.Queue()
+    bus = EventBus(callback_queue)
+    bus.flush()
+    assert callback_queue.empty()
+
+
+def test_full_queue_does_not_raise():
+    callback_queue = queue.Queue(maxsize=1)
+    bus = make_bus(callback_queue)
+    bus.put_nowait(('error', 'first'))
+    bus.put_nowait(('error', 'second'))
+    assert get_events(callback_queue) == [('error', 'first')]
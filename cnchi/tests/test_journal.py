@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_journal.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests for the download journal (resuming interrupted downloads) """
+
+import os
+
+import pytest
+
+import misc.state_files as state_files
+from installation.download import journal
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """ A pacman cache dir, with Cnchi's state dir in tmp_path too """
+    monkeypatch.setattr(state_files, 'STATE_DIR', str(tmp_path / 'state'))
+    path = tmp_path / 'pkg'
+    path.mkdir()
+    return str(path)
+
+
+def write_file(path, size):
+    """ Creates a file of size bytes """
+    with open(path, 'wb') as new_file:
+        new_file.write(b'x' * size)
+
+
+def test_journal_is_not_stored_in_cache_dir(cache_dir):
+    download_journal = journal.DownloadJournal(cache_dir)
+    download_journal.checkpoint('a.pkg.tar.xz', 10, 'hash')
+    download_journal.flush()
+    assert os.listdir(cache_dir) == []
+    assert os.path.exists(download_journal.path)
+
+
+def test_resume_from_checkpoint(cache_dir):
+    part_path = journal.get_part_path(os.path.join(cache_dir, 'a.pkg.tar.xz'))
+    write_file(part_path, 100)
+
+    download_journal = journal.DownloadJournal(cache_dir)
+    download_journal.checkpoint('a.pkg.tar.xz', 60, 'hash')
+    download_journal.flush()
+
+    # A new journal (Cnchi has been restarted) resumes at the synced offset
+    download_journal = journal.DownloadJournal(cache_dir)
+    assert download_journal.get_offset('a.pkg.tar.xz', part_path, 'hash') == 60
+
+
+def test_offset_is_limited_to_part_file_size(cache_dir):
+    part_path = journal.get_part_path(os.path.join(cache_dir, 'a.pkg.tar.xz'))
+    write_file(part_path, 30)
+
+    download_journal = journal.DownloadJournal(cache_dir)
+    download_journal.checkpoint('a.pkg.tar.xz', 60, 'hash')
+    assert download_journal.get_offset('a.pkg.tar.xz', part_path, 'hash') == 30
+
+
+def test_part_file_of_another_version_is_removed(cache_dir):
+    part_path = journal.get_part_path(os.path.join(cache_dir, 'a.pkg.tar.xz'))
+    write_file(part_path, 100)
+
+    download_journal = journal.DownloadJournal(cache_dir)
+    download_journal.checkpoint('a.pkg.tar.xz', 60, 'old-hash')
+    assert download_journal.get_offset('a.pkg.tar.xz', part_path, 'new-hash') == 0
+    assert not os.path.exists(part_path)
+
+
+def test_untracked_part_file_is_removed(cache_dir):
+    part_path = journal.get_part_path(os.path.join(cache_dir, 'a.pkg.tar.xz'))
+    write_file(part_path, 100)
+
+    download_journal = journal.DownloadJournal(cache_dir)
+    assert download_journal.get_offset('a.pkg.tar.xz', part_path) == 0
+    assert not os.path.exists(part_path)
+
+
+def test_complete_file(cache_dir):
+    path = os.path.join(cache_dir, 'a.pkg.tar.xz')
+    write_file(path, 100)
+
+    download_journal = journal.DownloadJournal(cache_dir)
+    download_journal.mark_complete('a.pkg.tar.xz', path, 'hash')
+    download_journal.flush()
+
+    download_journal = journal.DownloadJournal(cache_dir)
+    assert download_journal.is_complete('a.pkg.tar.xz', path, 'hash')
+    assert not download_journal.is_complete('a.pkg.tar.xz', path, 'other-hash')
+
+    # The file has changed since it was checked
+    write_file(path, 50)
+    assert not download_journal.is_complete('a.pkg.tar.xz', path, 'hash')
+
+
+def test_forget(cache_dir):
+    download_journal = journal.DownloadJournal(cache_dir)
+    download_journal.checkpoint('a.pkg.tar.xz', 60, 'hash')
+    download_journal.forget('a.pkg.tar.xz')
+    assert 'a.pkg.tar.xz' not in download_journal.entries
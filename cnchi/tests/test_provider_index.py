@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_provider_index.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests for ProviderIndex, which must give the same answers as
+    pyalpm.find_satisfier """
+
+import collections
+import os
+import types
+
+import pytest
+
+from installation.pacman import provider_index
+from installation.pacman.provider_index import ProviderIndex
+
+Package = collections.namedtuple('Package', ['name', 'version', 'provides'])
+
+PACKAGES = [
+    Package('sh', '1.0-1', []),
+    Package('bash', '4.4-1', ['sh=4.4']),
+    Package('dash', '0.5-1', ['sh']),
+    Package('java-runtime-openjdk', '8-1', ['java-runtime=8', 'java-environment=8']),
+    Package('java-runtime-jre', '9-1', ['java-runtime=9']),
+    Package('libgl', '17-1', []),
+    Package('mesa-libgl', '17-2', ['libgl=17']),
+    Package('nvidia-libgl', '375-1', ['libgl']),
+]
+
+DEPS = [
+    'sh', 'sh>=1.0', 'sh>1.0', 'sh=4.4', 'sh<1.0', 'bash', 'bash<=4.4',
+    'java-runtime', 'java-runtime>=9', 'java-runtime=8', 'java-runtime<8',
+    'java-environment', 'libgl', 'libgl>17', 'libgl=17', 'missing', 'missing>1']
+
+
+def vercmp(version1, version2):
+    """ Simplified pyalpm.vercmp (numeric parts only) """
+    def parts(version):
+        return [int(part) for part in version.replace('-', '.').split('.')]
+    first, second = parts(version1), parts(version2)
+    return (first > second) - (first < second)
+
+
+@pytest.fixture(autouse=True)
+def simple_vercmp(monkeypatch):
+    """ Version comparison is pacman's business, here we test the index """
+    monkeypatch.setattr(
+        provider_index, 'pyalpm', types.SimpleNamespace(vercmp=vercmp), raising=False)
+
+
+def satisfies(name, version, dep):
+    """ Checks if a package (or provision) called name satisfies dep """
+    dep_name, mod, wanted = provider_index.parse_dep(dep)
+    return name == dep_name and provider_index.version_satisfies(version, mod, wanted)
+
+
+def find_satisfier(pkgs, dep):
+    """ What alpm_find_satisfier does: first a package with that name,
+        then a package that provides it, in package list order """
+    for pkg in pkgs:
+        if satisfies(pkg.name, pkg.version, dep):
+            return pkg
+    for pkg in pkgs:
+        for provision in pkg.provides:
+            name, __, version = provider_index.parse_dep(provision)
+            if satisfies(name, version, dep):
+                return pkg
+    return None
+
+
+def test_parse_dep():
+    assert provider_index.parse_dep('glibc') == ('glibc', None, None)
+    assert provider_index.parse_dep('glibc>=2.25') == ('glibc', '>=', '2.25')
+    assert provider_index.parse_dep('sh=4.4-1') == ('sh', '=', '4.4-1')
+    assert provider_index.parse_dep('libgl<17') == ('libgl', '<', '17')
+
+
+def test_unversioned_provision_does_not_satisfy_versioned_dep():
+    index = ProviderIndex([Package('nvidia-libgl', '375-1', ['libgl'])])
+    assert index.find_satisfier('libgl') is not None
+    assert index.find_satisfier('libgl>=17') is None
+
+
+@pytest.mark.parametrize('dep', DEPS)
+def test_same_result_as_find_satisfier(dep):
+    index = ProviderIndex(PACKAGES)
+    assert index.find_satisfier(dep) == find_satisfier(PACKAGES, dep)
+
+
+@pytest.mark.parametrize('dep', DEPS)
+def test_package_order_is_kept(dep):
+    pkgs = list(reversed(PACKAGES))
+    index = ProviderIndex(pkgs)
+    assert index.find_satisfier(dep) == find_satisfier(pkgs, dep)
+
+
+def test_same_result_as_pyalpm_with_local_database(monkeypatch):
+    """ Checks every dependency of every installed package (Arch only) """
+    pyalpm = pytest.importorskip('pyalpm')
+    if not os.path.isdir('/var/lib/pacman/local'):
+        pytest.skip("No pacman database in this system")
+    monkeypatch.setattr(provider_index, 'pyalpm', pyalpm)
+
+    handle = pyalpm.Handle('/', '/var/lib/pacman')
+    pkgs = handle.get_localdb().pkgcache
+    index = ProviderIndex(pkgs)
+    for pkg in pkgs:
+        for dep in pkg.depends:
+            expected = pyalpm.find_satisfier(pkgs, dep)
+            found = index.find_satisfier(dep)
+            assert (found and found.name) == (expected and expected.name), dep
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_staging.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests that staged packages are not hashed again when imported """
+
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+
+import misc.state_files as state_files
+from installation.download import cache_index
+from installation.download import checksum
+from installation.download import download_requests
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """ Keeps Cnchi's state files in tmp_path """
+    monkeypatch.setattr(state_files, 'STATE_DIR', str(tmp_path / 'state'))
+
+
+def make_element(directory, name, data):
+    """ Writes a package and returns its metalink element """
+    filename = name + '-1.0-1-x86_64.pkg.tar.xz'
+    with open(os.path.join(directory, filename), 'wb') as package:
+        package.write(data)
+    return {
+        'identity': name,
+        'version': '1.0-1',
+        'filename': filename,
+        'size': str(len(data)),
+        'urls': [],
+        'hash': hashlib.md5(data).hexdigest(),
+        'sha256': hashlib.sha256(data).hexdigest()}
+
+
+def test_staged_packages_are_not_hashed_again(tmp_path, monkeypatch):
+    staging_dir = str(tmp_path / 'staging')
+    target_dir = str(tmp_path / 'target')
+    os.makedirs(staging_dir)
+
+    elements = [make_element(staging_dir, name, name.encode() * 1000)
+                for name in ['bash', 'glibc', 'linux']]
+
+    # The staging download checks the packages (here they are already
+    # there, as if they had just been downloaded) and indexes them
+    staging = download_requests.Download(staging_dir, [], None, index_packages=True)
+    assert staging.start({element['identity']: element for element in elements})
+
+    # Importing them into the new system does not read them again
+    hashed = []
+    get_file_hashes = checksum.get_file_hashes
+
+    def counting_get_file_hashes(path, algorithms=checksum.ALGORITHMS):
+        hashed.append(path)
+        return get_file_hashes(path, algorithms)
+
+    monkeypatch.setattr(checksum, 'get_file_hashes', counting_get_file_hashes)
+
+    install = download_requests.Download(target_dir, [staging_dir], None)
+    assert install.start({element['identity']: element for element in elements})
+    assert hashed == []
+    for element in elements:
+        assert os.path.exists(os.path.join(target_dir, element['filename']))
+
+
+def test_only_needed_hashes_are_computed(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    os.makedirs(cache_dir)
+    element = make_element(cache_dir, 'bash', b'bash' * 1000)
+    del element['sha256']
+
+    download = download_requests.Download(str(tmp_path / 'target'), [cache_dir], None)
+    download.update_cache_indexes([element])
+
+    index = cache_index.CacheIndex(cache_dir)
+    hashes = index.get_cached_hashes(element['filename'], ('md5',))
+    assert hashes == {'md5': element['hash']}
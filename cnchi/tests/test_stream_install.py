@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_stream_install.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests for the dependency layers used by the streaming install """
+
+import pytest
+
+pytest.importorskip('dbus')
+pytest.importorskip('requests')
+
+from installation import stream_install
+
+
+def check_order(graph, components):
+    """ Every node must come after the nodes it depends on
+        (but the ones of its own component) """
+    position = {}
+    for index, component in enumerate(components):
+        for node in component:
+            position[node] = index
+    assert sorted(position) == sorted(graph)
+    for node, deps in graph.items():
+        for dep in deps:
+            assert position[dep] <= position[node]
+
+
+def test_components_of_a_chain():
+    graph = {'a': ['b'], 'b': ['c'], 'c': []}
+    assert stream_install.get_components(graph) == [['c'], ['b'], ['a']]
+
+
+def test_cycles_are_one_component():
+    graph = {'a': ['b'], 'b': ['c'], 'c': ['a', 'd'], 'd': []}
+    components = stream_install.get_components(graph)
+    assert [sorted(component) for component in components] == [['d'], ['a', 'b', 'c']]
+
+
+def test_components_order():
+    graph = {
+        'app': ['gtk', 'glib'],
+        'gtk': ['glib', 'cairo'],
+        'cairo': ['glib', 'pixman'],
+        'glib': ['pcre'],
+        'pcre': [],
+        'pixman': [],
+        'lib1': ['lib2'],
+        'lib2': ['lib1', 'pcre']}
+    components = stream_install.get_components(graph)
+    check_order(graph, components)
+    assert sorted(['lib1', 'lib2']) in [sorted(component) for component in components]
+
+
+def test_long_chain_does_not_hit_recursion_limit():
+    size = 20000
+    graph = {index: [index + 1] for index in range(size)}
+    graph[size] = []
+    components = stream_install.get_components(graph)
+    assert len(components) == size + 1
+    check_order(graph, components)
+
+
+def test_layers():
+    graph = {
+        'app': ['gtk'],
+        'gtk': ['glib', 'cairo'],
+        'cairo': ['glib'],
+        'glib': [],
+        'bash': [],
+        'lib1': ['lib2', 'glib'],
+        'lib2': ['lib1']}
+    assert stream_install.get_layers(graph) == [
+        ['bash', 'glib'],
+        ['cairo', 'lib1', 'lib2'],
+        ['gtk'],
+        ['app']]
+
+
+def test_batches():
+    layers = [['a', 'b'], ['c'], ['d', 'e', 'f'], ['g']]
+    assert stream_install.get_batches(layers, min_size=3) == [
+        ['a', 'b', 'c'], ['d', 'e', 'f'], ['g']]
+    assert stream_install.get_batches(layers, min_size=100) == [
+        ['a', 'b', 'c', 'd', 'e', 'f', 'g']]
+    assert stream_install.get_batches([], min_size=3) == []
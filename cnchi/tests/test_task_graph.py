@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_task_graph.py
+#
+# Copyright © 2013-2016 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests for the task graph that runs configure_system steps """
+
+import threading
+import time
+
+import pytest
+
+from installation.task_graph import TaskGraph
+
+
+class Recorder(object):
+    """ Records when each task starts and ends """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+
+    def task(self, name, duration=0.05, error=None):
+        """ Returns a task function """
+        def function():
+            with self.lock:
+                self.events.append(('start', name))
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(duration)
+            with self.lock:
+                self.running -= 1
+                self.events.append(('end', name))
+            if error is not None:
+                raise error
+        return function
+
+    def index(self, event, name):
+        """ Position of an event """
+        return self.events.index((event, name))
+
+    def ran_before(self, first, second):
+        """ Checks that first ended before second started """
+        return self.index('end', first) < self.index('start', second)
+
+
+def test_dependencies_from_resources():
+    graph = TaskGraph()
+    graph.add('write', None, provides=['file'])
+    graph.add('read', None, requires=['file'])
+    graph.add('other', None, requires=['other_file'])
+    graph.add('overwrite', None, provides=['file'])
+    assert graph.tasks['write'].depends == set()
+    assert graph.tasks['read'].depends == {'write'}
+    assert graph.tasks['other'].depends == set()
+    # Must not change the file while 'read' may still be reading it
+    assert graph.tasks['overwrite'].depends == {'write', 'read'}
+
+
+def test_readers_do_not_wait_for_each_other():
+    graph = TaskGraph()
+    graph.add('read1', None, requires=['file'])
+    graph.add('read2', None, requires=['file'])
+    assert graph.tasks['read2'].depends == set()
+
+
+def test_order_is_kept():
+    recorder = Recorder()
+    graph = TaskGraph(max_workers=4)
+    graph.add('users', recorder.task('users'), provides=['passwd'])
+    graph.add('sudoers', recorder.task('sudoers'), requires=['passwd'], provides=['sudoers'])
+    graph.add('locale', recorder.task('locale'), provides=['locale'])
+    graph.add('keymap', recorder.task('keymap'), requires=['locale'])
+    graph.add('initramfs', recorder.task('initramfs'), requires=['passwd', 'locale'])
+    graph.run()
+
+    assert recorder.ran_before('users', 'sudoers')
+    assert recorder.ran_before('locale', 'keymap')
+    assert recorder.ran_before('users', 'initramfs')
+    assert recorder.ran_before('locale', 'initramfs')
+    assert len(recorder.events) == 10
+
+
+def test_independent_tasks_run_at_the_same_time():
+    recorder = Recorder()
+    graph = TaskGraph(max_workers=3)
+    for index in range(6):
+        name = 'task{0}'.format(index)
+        graph.add(name, recorder.task(name, duration=0.1), provides=[name])
+    graph.run()
+    assert recorder.max_running == 3
+
+
+def test_one_worker_runs_tasks_one_at_a_time():
+    recorder = Recorder()
+    graph = TaskGraph(max_workers=1)
+    for index in range(3):
+        name = 'task{0}'.format(index)
+        graph.add(name, recorder.task(name, duration=0.01))
+    graph.run()
+    assert recorder.max_running == 1
+
+
+def test_error_stops_new_tasks_and_is_raised():
+    recorder = Recorder()
+    graph = TaskGraph(max_workers=2)
+    graph.add('fails', recorder.task('fails', error=RuntimeError("boom")), provides=['a'])
+    graph.add('slow', recorder.task('slow', duration=0.2), provides=['b'])
+    graph.add('after', recorder.task('after'), requires=['a'])
+
+    with pytest.raises(RuntimeError, match="boom"):
+        graph.run()
+
+    # The running task is allowed to finish, dependent tasks never start
+    assert ('end', 'slow') in recorder.events
+    assert ('start', 'after') not in recorder.events
+
+
+def test_first_error_wins():
+    recorder = Recorder()
+    graph = TaskGraph(max_workers=2)
+    graph.add('first', recorder.task('first', duration=0.01, error=ValueError("first")))
+    graph.add('second', recorder.task('second', duration=0.2, error=ValueError("second")))
+    with pytest.raises(ValueError, match="first"):
+        graph.run()
+
+
+def test_elapsed_is_measured():
+    graph = TaskGraph()
+    task = graph.add('sleep', lambda: time.sleep(0.02))
+    graph.run()
+    assert task.elapsed >= 0.02
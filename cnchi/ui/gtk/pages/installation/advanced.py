@@ -540,12 +540,11 @@ class InstallationAdvanced(Page):
 
                     uid = self.gen_partition_uid(path=partition_path)
 
-                    if fs.get_type(partition_path):
-                        fs_type = fs.get_type(partition_path)
-                    elif used_space.is_btrfs(partition_path):
+                    fs_type = fs.get_type(partition_path)
+                    if not fs_type and used_space.is_btrfs(partition_path):
                         # kludge, btrfs not being detected...
                         fs_type = 'btrfs'
-                    else:
+                    elif not fs_type:
                         # Say unknown if we can't detect fs type instead
                         # of assumming btrfs
                         fs_type = 'unknown'
@@ -647,11 +646,9 @@ class InstallationAdvanced(Page):
                     # the filesystem with blkid.
                     elif 'free' in partition_path:
                         fs_type = _("none")
-                    elif fs.get_type(path):
-                        fs_type = fs.get_type(path)
                     else:
-                        # Unknown filesystem
-                        fs_type = '?'
+                        # Say '?' if the filesystem is unknown
+                        fs_type = fs.get_type(path) or '?'
 
                     # Nothing should be mounted at this point
 
@@ -2311,7 +2308,7 @@ class InstallationAdvanced(Page):
             msg = _("Cannot commit your changes to disk: {0}").format(str(io_error))
             show.error(self.get_main_window(), msg)
 
-    def run_install(self, packages, metalinks):
+    def run_install(self, packages, metalinks, staging=None):
         """ Start installation process """
 
         # Fill fs_devices and mount_devices dicts that are going to be used
@@ -2368,7 +2365,8 @@ class InstallationAdvanced(Page):
             self.mount_devices,
             self.fs_devices,
             self.ssd,
-            self.blvm)
+            self.blvm,
+            staging=staging)
         self.installation.start()
 
 # When testing, no _() is available
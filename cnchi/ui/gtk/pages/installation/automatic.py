@@ -325,7 +325,7 @@ class InstallationAutomatic(Page):
             msg = msg.format(self.bootloader, self.bootloader_device)
             logging.info(msg)
 
-    def run_install(self, packages, metalinks):
+    def run_install(self, packages, metalinks, staging=None):
         """ Perform installation """
         txt = _("Cnchi will install Antergos on device %s")
         logging.info(txt, self.auto_device)
@@ -341,7 +341,8 @@ class InstallationAutomatic(Page):
             metalinks,
             self.mount_devices,
             self.fs_devices,
-            ssd)
+            ssd,
+            staging=staging)
 
         self.installation.start()
 
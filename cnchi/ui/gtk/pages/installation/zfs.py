@@ -1229,7 +1229,7 @@ class InstallationZFS(Page):
             with open(hostid_path, "w") as hostid_file:
                 hostid_file.write("{0}\n".format(hostid))
 
-    def run_install(self, packages, metalinks):
+    def run_install(self, packages, metalinks, staging=None):
         """ Start installation process """
 
         self.installation = install.Installation(
@@ -1238,7 +1238,8 @@ class InstallationZFS(Page):
             packages,
             metalinks,
             self.mount_devices,
-            self.fs_devices)
+            self.fs_devices,
+            staging=staging)
 
         self.installation.start()
 